@@ -0,0 +1,251 @@
+import math
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+
+class Unit:
+    """Participants that have to share a team (a keep-together group, or one person)"""
+
+    __slots__ = ("members", "size", "attrs", "signature", "avoid")
+
+    def __init__(self, members: list, balance_by: list):
+        self.members = members
+        self.size = len(members)
+        self.attrs = Counter((key, str(member.get(key))) for member in members for key in balance_by)
+        # Most common value per balance key, used to deal similar units in runs
+        self.signature = tuple(
+            Counter(str(member.get(key)) for member in members).most_common(1)[0][0] for key in balance_by
+        )
+        self.avoid = set()
+
+def build_units(participants: list, balance_by: list, keep_together: list, keep_apart: list) -> list:
+    """Merge keep-together groups with union-find and map keep-apart pairs onto the resulting units"""
+    index = {p["id"]: i for i, p in enumerate(participants)}
+    parent = list(range(len(participants)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for group in keep_together:
+        ids = [index[pid] for pid in group if pid in index]
+        for other in ids[1:]:
+            parent[find(other)] = find(ids[0])
+
+    groups = {}
+    for i, participant in enumerate(participants):
+        groups.setdefault(find(i), []).append(participant)
+    roots = list(groups)
+    units = [Unit(groups[root], balance_by) for root in roots]
+    unit_of = {root: n for n, root in enumerate(roots)}
+
+    for pair in keep_apart:
+        ids = [index[pid] for pid in pair if pid in index]
+        for a in range(len(ids)):
+            for b in range(a + 1, len(ids)):
+                ua, ub = unit_of[find(ids[a])], unit_of[find(ids[b])]
+                if ua == ub:
+                    raise ValueError(
+                        f"Participants {participants[ids[a]]['id']} and {participants[ids[b]]['id']} "
+                        "are kept together and kept apart"
+                    )
+                units[ua].avoid.add(ub)
+                units[ub].avoid.add(ua)
+    return units
+
+class Plan:
+    """Team assignment of units with the counters needed to price a move in O(attributes)"""
+
+    def __init__(self, units: list, team_count: int, capacity: int):
+        self.units = units
+        self.team_count = team_count
+        self.capacity = capacity
+        total = sum(unit.size for unit in units)
+        self.mean_size = total / team_count
+        totals = Counter()
+        for unit in units:
+            totals.update(unit.attrs)
+        self.ideal = {key: count / team_count for key, count in totals.items()}
+        self.sizes = [0] * team_count
+        self.counts = [Counter() for _ in range(team_count)]
+        self.members = [set() for _ in range(team_count)]
+        self.team_of = [None] * len(units)
+
+    def delta(self, team: int, size: int, attrs: dict) -> float:
+        """Cost change of adding size people with attrs (negative values remove) to team"""
+        # (c + d - I)^2 - (c - I)^2 = d * (2 * (c - I) + d)
+        change = size * (2 * (self.sizes[team] - self.mean_size) + size)
+        counts = self.counts[team]
+        for key, d in attrs.items():
+            if d:
+                change += d * (2 * (counts[key] - self.ideal[key]) + d)
+        return change
+
+    def conflicts(self, unit: int, team: int, ignore: int = -1) -> bool:
+        return any(other != ignore and self.team_of[other] == team for other in self.units[unit].avoid)
+
+    def place(self, unit: int, team: int):
+        u = self.units[unit]
+        self.team_of[unit] = team
+        self.members[team].add(unit)
+        self.sizes[team] += u.size
+        self.counts[team].update(u.attrs)
+
+    def remove(self, unit: int):
+        u = self.units[unit]
+        team = self.team_of[unit]
+        self.members[team].discard(unit)
+        self.sizes[team] -= u.size
+        self.counts[team].subtract(u.attrs)
+        self.team_of[unit] = None
+
+    def cost(self) -> float:
+        total = sum((size - self.mean_size) ** 2 for size in self.sizes)
+        for counts in self.counts:
+            total += sum((counts[key] - ideal) ** 2 for key, ideal in self.ideal.items())
+        return total
+
+    def violations(self) -> int:
+        return sum(
+            1 for unit, u in enumerate(self.units) for other in u.avoid
+            if unit < other and self.team_of[unit] == self.team_of[other]
+        )
+
+def greedy(plan: Plan, rng: random.Random):
+    """Deal units round-robin, largest first and grouped by their balance values.
+
+    Dealing a run of units that share a grade (and, within it, a section) across the
+    teams in turn spreads every value almost evenly in O(units); a team without room
+    or with a keep-apart conflict is skipped for the next one in turn.
+    """
+    order = list(range(len(plan.units)))
+    rng.shuffle(order)
+    order.sort(key=lambda unit: (-plan.units[unit].size, plan.units[unit].signature))
+    turn = 0
+    for unit in order:
+        u = plan.units[unit]
+        chosen = None
+        for step in range(plan.team_count):
+            team = (turn + step) % plan.team_count
+            if plan.sizes[team] + u.size <= plan.capacity and not plan.conflicts(unit, team):
+                chosen = team
+                break
+        if chosen is None:
+            # Nowhere without a conflict; take the least harmful team and let the report show it
+            chosen = min(
+                range(plan.team_count),
+                key=lambda team: (plan.sizes[team] + u.size > plan.capacity, plan.conflicts(unit, team), plan.sizes[team])
+            )
+        plan.place(unit, chosen)
+        turn = (chosen + 1) % plan.team_count
+
+def local_search(plan: Plan, rng: random.Random, deadline: float, max_iterations: int) -> int:
+    """Random unit moves and swaps between teams, kept only when they lower the cost"""
+    units = plan.units
+    count = len(units)
+    if count < 2 or plan.team_count < 2:
+        return 0
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        if iterations % 256 == 0 and time.monotonic() > deadline:
+            break
+        a = rng.randrange(count)
+        ua, ta = units[a], plan.team_of[a]
+        if rng.random() < 0.25:
+            tb = rng.randrange(plan.team_count)
+            if tb == ta or plan.sizes[tb] + ua.size > plan.capacity or plan.conflicts(a, tb):
+                continue
+            negative = {key: -value for key, value in ua.attrs.items()}
+            if plan.delta(ta, -ua.size, negative) + plan.delta(tb, ua.size, ua.attrs) < -1e-9:
+                plan.remove(a)
+                plan.place(a, tb)
+            continue
+
+        b = rng.randrange(count)
+        ub, tb = units[b], plan.team_of[b]
+        if ta == tb:
+            continue
+        if plan.sizes[ta] - ua.size + ub.size > plan.capacity or plan.sizes[tb] - ub.size + ua.size > plan.capacity:
+            continue
+        if plan.conflicts(a, tb, ignore=b) or plan.conflicts(b, ta, ignore=a):
+            continue
+        diff = Counter(ub.attrs)
+        diff.subtract(ua.attrs)
+        reverse = {key: -value for key, value in diff.items()}
+        size = ub.size - ua.size
+        if plan.delta(ta, size, diff) + plan.delta(tb, -size, reverse) < -1e-9:
+            plan.remove(a)
+            plan.remove(b)
+            plan.place(a, tb)
+            plan.place(b, ta)
+    return iterations
+
+def plan_teams(
+    participants: List[dict],
+    team_count: Optional[int] = None,
+    team_size: Optional[int] = None,
+    balance_by: Optional[List[str]] = None,
+    keep_together: Optional[List[list]] = None,
+    keep_apart: Optional[List[list]] = None,
+    seed: Optional[int] = None,
+    time_budget: float = 0.5
+) -> dict:
+    """Split participants into balanced teams.
+
+    Team sizes and the per-team counts of every balance_by value are pulled towards their
+    means (sum of squared deviations). Keep-together groups are never split; keep-apart
+    pairs are honoured whenever the greedy pass or a swap can manage it.
+    """
+    started = time.monotonic()
+    if not participants:
+        raise ValueError("No participants to place")
+    if team_size is not None and team_size < 1:
+        raise ValueError("team_size must be at least 1")
+    if team_count is None:
+        if team_size is None:
+            raise ValueError("team_count or team_size is required")
+        team_count = math.ceil(len(participants) / team_size)
+    if team_count < 1:
+        raise ValueError("team_count must be at least 1")
+    if team_count > len(participants):
+        raise ValueError(f"team_count ({team_count}) is more than the {len(participants)} participant(s) to place")
+    if team_size is not None and team_count * team_size < len(participants):
+        raise ValueError(
+            f"{team_count} teams of {team_size} hold {team_count * team_size} participants, "
+            f"{len(participants) - team_count * team_size} short of the {len(participants)} to place"
+        )
+    capacity = team_size or math.ceil(len(participants) / team_count)
+    balance_by = balance_by or []
+
+    units = build_units(participants, balance_by, keep_together or [], keep_apart or [])
+    largest = max(unit.size for unit in units)
+    if largest > capacity:
+        raise ValueError(f"A keep-together group of {largest} does not fit in teams of {capacity}")
+
+    rng = random.Random(seed)
+    plan = Plan(units, team_count, capacity)
+    greedy(plan, rng)
+    initial_cost = plan.cost()
+    iterations = local_search(plan, rng, started + time_budget, 40 * len(units))
+
+    teams = []
+    for team in range(team_count):
+        members = [member for unit in sorted(plan.members[team]) for member in units[unit].members]
+        balance = {key: dict(Counter(str(member.get(key)) for member in members)) for key in balance_by}
+        teams.append({"participant_ids": [member["id"] for member in members], "size": len(members), "balance": balance})
+    return {
+        "teams": teams,
+        "capacity": capacity,
+        "score": {
+            "initial_cost": round(initial_cost, 3),
+            "cost": round(plan.cost(), 3),
+            "keep_apart_violations": plan.violations(),
+            "overfull_teams": sum(1 for size in plan.sizes if size > capacity)
+        },
+        "iterations": iterations,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+    }
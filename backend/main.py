@@ -5,19 +5,44 @@ from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import aiofiles
+import asyncio
+import functools
+import gzip
+import hashlib
 import json
 from pathlib import Path
+import queue
+import re
 import secrets
+import shutil
 import sqlite3
+import threading
+import time
 import bcrypt
 import string
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
+import multipart
+from multipart.multipart import parse_options_header
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are only served at full size
+    Image = None
+import base64
+import binascii
+import importlib.util
 
 import os
 
 SECRET_KEY = os.environ.get('ARISTA_SECRET_KEY', "arista-secret-key-change-in-production")
 ALGORITHM = "HS256"
+# Admins of any school can register themselves, so server-wide figures (pool, caches, hash queue,
+# storage) are only shown to the user ids listed here, e.g. ARISTA_OPERATOR_USER_IDS=1,7
+OPERATOR_USER_IDS = {int(v) for v in os.environ.get('ARISTA_OPERATOR_USER_IDS', '').split(',') if v.strip()}
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 
 def create_access_token(data: dict):
@@ -29,12 +54,430 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-DB_PATH = Path(__file__).parent.parent / "arista.db"
+DB_PATH = Path(os.environ.get('ARISTA_DB_PATH', str(Path(__file__).parent.parent / "arista.db")))
 UPLOADS_DIR = Path(__file__).parent.parent / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
+BLOBS_DIR = UPLOADS_DIR / "blobs"
+MAX_UPLOAD_SIZE = int(os.environ.get('ARISTA_MAX_UPLOAD_SIZE', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('ARISTA_UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+STAGING_DIR = UPLOADS_DIR / "staging"
+MAX_RESUMABLE_UPLOAD_SIZE = int(os.environ.get('ARISTA_MAX_RESUMABLE_UPLOAD_SIZE', str(1024 * 1024 * 1024)))
+UPLOAD_PART_SIZE = int(os.environ.get('ARISTA_UPLOAD_PART_SIZE', str(5 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = float(os.environ.get('ARISTA_UPLOAD_SESSION_TTL', str(24 * 3600)))
+IMPORT_CHUNK_SIZE = int(os.environ.get('ARISTA_IMPORT_CHUNK_SIZE', '500'))
+IMPORT_MAX_ERRORS = int(os.environ.get('ARISTA_IMPORT_MAX_ERRORS', '1000'))
+IDEMPOTENCY_KEY_TTL = float(os.environ.get('ARISTA_IDEMPOTENCY_KEY_TTL', str(24 * 3600)))
+# Seconds of local search the team generator spends after its greedy pass
+TEAM_PLAN_TIME_BUDGET = float(os.environ.get('ARISTA_TEAM_PLAN_TIME_BUDGET', '0.5'))
+UPLOAD_SWEEP_INTERVAL = float(os.environ.get('ARISTA_UPLOAD_SWEEP_INTERVAL', '600'))
+THUMBNAIL_WORKERS = int(os.environ.get('ARISTA_THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_QUEUE_LIMIT = int(os.environ.get('ARISTA_THUMBNAIL_QUEUE_LIMIT', '64'))
+# Variant name -> longest edge in pixels, served through /api/files/{id}?size=<name>
+DERIVATIVE_SIZES = {"thumb": 256, "web": 1280}
+IMAGE_MIME_TYPES = ("image/jpeg", "image/png", "image/gif")
+# Hand file bodies to a fronting proxy: "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd)
+FILE_ACCEL_MODE = os.environ.get('ARISTA_FILE_ACCEL', '').lower()
+FILE_ACCEL_PREFIX = os.environ.get('ARISTA_FILE_ACCEL_PREFIX', '/protected-uploads/')
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+AUTO_MIGRATE = os.environ.get('ARISTA_AUTO_MIGRATE', '1') == '1'
+
+DB_POOL_SIZE = int(os.environ.get('ARISTA_DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('ARISTA_DB_POOL_TIMEOUT', '10'))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('ARISTA_DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+DB_WORKERS = int(os.environ.get('ARISTA_DB_WORKERS', str(DB_POOL_SIZE)))
+DB_QUERY_TIMEOUT = float(os.environ.get('ARISTA_DB_QUERY_TIMEOUT', '15'))
+STREAM_BATCH_SIZE = int(os.environ.get('ARISTA_STREAM_BATCH_SIZE', '500'))
+
+BCRYPT_ROUNDS = int(os.environ.get('ARISTA_BCRYPT_ROUNDS', '12'))
+HASH_WORKERS = int(os.environ.get('ARISTA_HASH_WORKERS', str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.environ.get('ARISTA_HASH_QUEUE_LIMIT', str(HASH_WORKERS * 8)))
+
+USER_CACHE_TTL = float(os.environ.get('ARISTA_USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.environ.get('ARISTA_USER_CACHE_SIZE', '10000'))
+CACHE_SYNC_ENABLED = os.environ.get('ARISTA_CACHE_SYNC', '0') == '1'
+CACHE_SYNC_INTERVAL = float(os.environ.get('ARISTA_CACHE_SYNC_INTERVAL', '1'))
+COUNT_CACHE_TTL = float(os.environ.get('ARISTA_COUNT_CACHE_TTL', '30'))
+DASHBOARD_CACHE_TTL = float(os.environ.get('ARISTA_DASHBOARD_CACHE_TTL', '10'))
+CALENDAR_CACHE_TTL = float(os.environ.get('ARISTA_CALENDAR_CACHE_TTL', '300'))
+STREAM_QUEUE_SIZE = int(os.environ.get('ARISTA_STREAM_QUEUE_SIZE', '100'))
+STREAM_POLL_INTERVAL = float(os.environ.get('ARISTA_STREAM_POLL_INTERVAL', '0.5'))
+STREAM_HEARTBEAT = float(os.environ.get('ARISTA_STREAM_HEARTBEAT', '15'))
+STREAM_REPLAY_LIMIT = int(os.environ.get('ARISTA_STREAM_REPLAY_LIMIT', '500'))
+STREAM_RETENTION_HOURS = int(os.environ.get('ARISTA_STREAM_RETENTION_HOURS', '24'))
+AUDIT_MODE = os.environ.get('ARISTA_AUDIT_MODE', 'async').lower()
+AUDIT_BATCH_SIZE = int(os.environ.get('ARISTA_AUDIT_BATCH_SIZE', '200'))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('ARISTA_AUDIT_FLUSH_INTERVAL', '1'))
+AUDIT_BUFFER_SIZE = int(os.environ.get('ARISTA_AUDIT_BUFFER_SIZE', '10000'))
+AUDIT_SPOOL_PATH = Path(os.environ.get('ARISTA_AUDIT_SPOOL', str(DB_PATH.parent / "audit_spool.jsonl")))
+AUDIT_RETENTION_DAYS = int(os.environ.get('ARISTA_AUDIT_RETENTION_DAYS', '90'))
+AUDIT_ARCHIVE_DIR = Path(os.environ.get('ARISTA_AUDIT_ARCHIVE_DIR', str(DB_PATH.parent / "audit_archive")))
+# Segments whose newest record is older than this are deleted; 0 keeps them forever
+AUDIT_ARCHIVE_KEEP_DAYS = int(os.environ.get('ARISTA_AUDIT_ARCHIVE_KEEP_DAYS', '0'))
+# page/limit on the audit log merges every row before the offset, so deeper reads must use the cursor
+AUDIT_MAX_OFFSET = int(os.environ.get('ARISTA_AUDIT_MAX_OFFSET', '500'))
+CALENDAR_CACHE_MAX_BYTES = int(os.environ.get('ARISTA_CALENDAR_CACHE_MAX_BYTES', str(1024 * 1024)))
+
+# Storage profiles selected with ARISTA_DB_PROFILE. journal_mode is persisted in the
+# database file and set once at startup; the rest are per-connection settings.
+STORAGE_PROFILES = {
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY"
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 0,
+        "busy_timeout": 10000,
+        "temp_store": "MEMORY"
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+        "temp_store": "DEFAULT"
+    }
+}
+CONNECTION_PRAGMAS = ("synchronous", "cache_size", "mmap_size", "busy_timeout", "temp_store")
+
+def storage_profile():
+    name = os.environ.get('ARISTA_DB_PROFILE', 'wal').lower()
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown ARISTA_DB_PROFILE '{name}', expected one of {', '.join(STORAGE_PROFILES)}")
+
+    profile = dict(STORAGE_PROFILES[name])
+    # Individual settings can be overridden, e.g. ARISTA_DB_PRAGMA_CACHE_SIZE=-64000
+    for pragma in profile:
+        override = os.environ.get(f'ARISTA_DB_PRAGMA_{pragma.upper()}')
+        if override is not None:
+            profile[pragma] = int(override) if override.lstrip('-').isdigit() else override
+    return name, profile
+
+def apply_connection_pragmas(conn, profile):
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {profile[pragma]}")
+
+def read_pragmas(conn):
+    return {
+        pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in ("journal_mode",) + CONNECTION_PRAGMAS
+    }
+
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+class QueryTimeout(sqlite3.OperationalError):
+    pass
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+    pool = None
+    generation = 0
+    checked_out = False
+    last_used = 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        self.pool = None
+        try:
+            super().close()
+        except sqlite3.Error:
+            pass
+
+class ConnectionPool:
+    """Bounded pool of long-lived connections shared by the threads of one worker process"""
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must never cross a fork, so a new worker starts from scratch
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._size = 0
+        self._generation = getattr(self, '_generation', 0) + 1
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        apply_connection_pragmas(conn, storage_profile()[1])
+        conn.pool = self
+        conn.generation = self._generation
+        return conn
+
+    def _healthy(self, conn):
+        if time.monotonic() - conn.last_used < self.healthcheck_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn.generation == self._generation:
+                self._size -= 1
+        conn.discard()
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                self._reset()
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    create = self._size < self.max_size
+                    if create:
+                        self._size += 1
+                if create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._size -= 1
+                        raise
+                else:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        conn = self._idle.get(timeout=max(remaining, 0))
+                    except queue.Empty:
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+            if conn.generation == self._generation and self._healthy(conn):
+                conn.checked_out = True
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+
+        if conn.generation != self._generation or conn.pool is not self:
+            conn.discard()
+            return
+
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._reset()
+        while True:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.discard()
+
+    def stats(self):
+        return {
+            "size": self._size,
+            "idle": self._idle.qsize(),
+            "max_size": self.max_size
+        }
+
+class SchemaRegistry:
+    """Column maps introspected once at startup (or after a migration) and the SQL built from them"""
+
+    def __init__(self):
+        self._columns = {}
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, conn):
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+        columns = {
+            table: [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+            for table in tables
+        }
+        with self._lock:
+            self._columns = columns
+            self._statements = {}
+
+    def columns(self, table: str) -> List[str]:
+        return self._columns.get(table, [])
+
+    def has(self, table: str, column: str) -> bool:
+        return column in self._columns.get(table, ())
+
+    def statement(self, key, build):
+        sql = self._statements.get(key)
+        if sql is None:
+            sql = build()
+            with self._lock:
+                self._statements[key] = sql
+        return sql
+
+    def insert_statement(self, table: str, candidates: tuple):
+        """INSERT covering the candidate columns present in table, returned as (sql, columns)"""
+        def build():
+            cols = [c for c in candidates if self.has(table, c)]
+            if not cols:
+                return None, []
+            placeholders = ', '.join(['?'] * len(cols))
+            return f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({placeholders})", cols
+        return self.statement(("insert", table, candidates), build)
+
+schema = SchemaRegistry()
+
+class Migration:
+    def __init__(self, version: int, name: str, description: str, upgrade):
+        self.version = version
+        self.name = name
+        self.description = description
+        self.upgrade = upgrade
+
+class MigrationContext:
+    """Helpers handed to each migration's upgrade(db); all work runs inside the migration transaction"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql: str, params: tuple = ()):
+        return self.conn.execute(sql, params)
+
+    def columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+    def table_exists(self, table: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+
+    def add_column(self, table: str, column: str, decl: str) -> bool:
+        if column in self.columns(table):
+            return False
+        self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+
+    def rebuild_table(self, table: str, create_sql: str, copy_sql: str):
+        """Recreate table from create_sql ({table} placeholder) and copy rows with copy_sql ({new}/{old})"""
+        new = f"{table}__new"
+        self.execute(create_sql.format(table=new))
+        self.execute(copy_sql.format(new=new, old=table))
+        self.execute(f"DROP TABLE {table}")
+        self.execute(f"ALTER TABLE {new} RENAME TO {table}")
+
+class Migrator:
+    """Applies the ordered files in backend/migrations and records them in schema_version"""
+
+    def __init__(self, path=DB_PATH, directory=MIGRATIONS_DIR):
+        self.path = path
+        self.directory = directory
+        self._migrations = None
+
+    def migrations(self) -> List[Migration]:
+        if self._migrations is None:
+            migrations = []
+            for file in sorted(self.directory.glob("[0-9][0-9][0-9][0-9]_*.py")):
+                spec = importlib.util.spec_from_file_location(f"arista_migration_{file.stem}", file)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                migrations.append(Migration(
+                    int(file.stem.split('_', 1)[0]), file.stem,
+                    getattr(module, 'DESCRIPTION', ''), module.upgrade
+                ))
+            versions = [m.version for m in migrations]
+            if len(versions) != len(set(versions)):
+                raise RuntimeError("Duplicate migration version numbers in " + str(self.directory))
+            self._migrations = migrations
+        return self._migrations
+
+    @staticmethod
+    def applied_versions(conn) -> set:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        ).fetchone()
+        if not exists:
+            return set()
+        return {row[0] for row in conn.execute("SELECT version FROM schema_version").fetchall()}
+
+    def current_version(self, conn) -> int:
+        return max(self.applied_versions(conn), default=0)
+
+    def pending(self, conn) -> List[Migration]:
+        applied = self.applied_versions(conn)
+        return [m for m in self.migrations() if m.version not in applied]
+
+    def migrate(self, dry_run: bool = False, target: Optional[int] = None):
+        """Apply pending migrations; returns [(migration, executed statements)]"""
+        conn = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        try:
+            # The exclusive lock makes this the only writer across all workers; anyone
+            # who was waiting re-reads schema_version below and finds nothing to do.
+            conn.execute("BEGIN EXCLUSIVE")
+            try:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                applied = []
+                for migration in self.pending(conn):
+                    if target is not None and migration.version > target:
+                        break
+                    statements = []
+                    conn.set_trace_callback(statements.append)
+                    try:
+                        migration.upgrade(MigrationContext(conn))
+                    finally:
+                        conn.set_trace_callback(None)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                        (migration.version, migration.name)
+                    )
+                    applied.append((migration, statements))
+                    if not dry_run:
+                        print(f"Applied migration {migration.name}")
+                conn.execute("ROLLBACK" if dry_run else "COMMIT")
+                return applied
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+migrator = Migrator()
 
 class Database:
     _initialized = False
+    _pool = None
+    _executor = None
     
     @classmethod
     def initialize(cls):
@@ -42,229 +485,56 @@ class Database:
             return
             
         conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS schools (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    code TEXT UNIQUE NOT NULL,
-                    admin_email TEXT NOT NULL,
-                    address TEXT,
-                    phone TEXT,
-                    website TEXT,
-                    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'inactive', 'suspended')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    school_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    email TEXT NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    role TEXT NOT NULL CHECK (role IN ('admin', 'teacher', 'student', 'student_coordinator')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
-                    UNIQUE(school_id, email)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    school_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    category TEXT,
-                    start_at TIMESTAMP NOT NULL,
-                    end_at TIMESTAMP NOT NULL,
-                    location TEXT,
-                    host TEXT,
-                    notes TEXT,
-                    registration_link TEXT,
-                    max_participants INTEGER,
-                    status TEXT DEFAULT 'upcoming' CHECK (status IN ('upcoming', 'ongoing', 'completed', 'cancelled')),
-                    created_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
-                    FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS participants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'registered' CHECK (status IN ('registered', 'waitlisted', 'cancelled')),
-                    attendance_status TEXT DEFAULT 'absent' CHECK (attendance_status IN ('present', 'absent', 'late')),
-                    FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-                    UNIQUE(event_id, user_id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS teams (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    created_by INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
-                    FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE,
-                    UNIQUE(event_id, name)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS team_members (
-                    team_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    role TEXT DEFAULT 'member' CHECK (role IN ('leader', 'member')),
-                    PRIMARY KEY (team_id, user_id),
-                    FOREIGN KEY (team_id) REFERENCES teams (id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS audit_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    action TEXT NOT NULL,
-                    target_type TEXT NOT NULL,
-                    target_id INTEGER,
-                    meta_json TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS announcements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    school_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    created_by INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
-                    FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
-            cursor.execute("PRAGMA table_info(announcements)")
-            ann_cols = [r[1] for r in cursor.fetchall()]
-            if 'event_id' not in ann_cols:
-                try:
-                    cursor.execute('ALTER TABLE announcements ADD COLUMN event_id INTEGER')
-                except Exception:
-                    pass
-            cursor.execute("PRAGMA table_info(announcements)")
-            ann_cols = [r[1] for r in cursor.fetchall()]
-            if 'body' not in ann_cols and 'content' in ann_cols:
-                try:
-                    cursor.execute('ALTER TABLE announcements ADD COLUMN body TEXT')
-                    cursor.execute("UPDATE announcements SET body = content WHERE body IS NULL AND content IS NOT NULL")
-                except Exception:
-                    pass
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    school_id INTEGER,
-                    event_id INTEGER,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    status TEXT DEFAULT 'pending' CHECK (status IN ('pending','completed','cancelled')),
-                    due_at TIMESTAMP,
-                    due_date TIMESTAMP,
-                    priority TEXT,
-                    created_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
-                    FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
-            cursor.execute("PRAGMA table_info(participants)")
-            cols = [r[1] for r in cursor.fetchall()]
-            if 'school_id' not in cols:
-                try:
-                    cursor.execute('ALTER TABLE participants ADD COLUMN school_id INTEGER')
-                except Exception:
-                    pass
-
-            cursor.execute("PRAGMA table_info(events)")
-            ev_cols = [r[1] for r in cursor.fetchall()]
-            if 'title' not in ev_cols:
-                try:
-                    cursor.execute('ALTER TABLE events ADD COLUMN title TEXT')
-                    if 'name' in ev_cols:
-                        cursor.execute("UPDATE events SET title = name WHERE title IS NULL AND name IS NOT NULL")
-                except Exception:
-                    pass
-
-            if 'start_at' not in ev_cols:
-                try:
-                    cursor.execute('ALTER TABLE events ADD COLUMN start_at TIMESTAMP')
-                    if 'start_time' in ev_cols:
-                        cursor.execute("UPDATE events SET start_at = start_time WHERE start_at IS NULL AND start_time IS NOT NULL")
-                except Exception:
-                    pass
-
-            if 'end_at' not in ev_cols:
-                try:
-                    cursor.execute('ALTER TABLE events ADD COLUMN end_at TIMESTAMP')
-                    if 'end_time' in ev_cols:
-                        cursor.execute("UPDATE events SET end_at = end_time WHERE end_at IS NULL AND end_time IS NOT NULL")
-                except Exception:
-                    pass
-
-            for col_name in ('host', 'notes', 'registration_link'):
-                if col_name not in ev_cols:
-                    try:
-                        cursor.execute(f'ALTER TABLE events ADD COLUMN {col_name} TEXT')
-                    except Exception:
-                        pass
-            
-            conn.commit()
+            profile_name, profile = storage_profile()
+            conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+
+            pending = migrator.pending(conn)
+            if pending:
+                if not AUTO_MIGRATE:
+                    raise RuntimeError(
+                        f"Database schema is {len(pending)} migration(s) behind; run `python manage.py migrate`"
+                    )
+                migrator.migrate()
+
+            schema.refresh(conn)
             cls._initialized = True
-            print("Database tables created successfully")
+            print(f"Database ready at schema version {migrator.current_version(conn)} (storage profile: {profile_name})")
         except Exception as e:
-            conn.rollback()
             print(f"Error initializing database: {str(e)}")
             raise
         finally:
-            cursor.close()
             conn.close()
     
+    @classmethod
+    def pool(cls):
+        if cls._pool is None:
+            cls._pool = ConnectionPool(DB_PATH)
+        return cls._pool
+
+    @classmethod
+    def close_pool(cls):
+        if cls._pool is not None:
+            cls._pool.close()
+
     @staticmethod
     def get_connection():
         if not Database._initialized:
             Database.initialize()
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return Database.pool().acquire()
     
     @staticmethod
-    def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False):
+    def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False, timeout: Optional[float] = None):
         if not Database._initialized:
             Database.initialize()
             
         conn = Database.get_connection()
         cursor = conn.cursor()
+        deadline = None
+        if timeout:
+            # Abort the statement from inside sqlite once it runs past its budget
+            deadline = time.monotonic() + timeout
+            conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 1000)
         try:
             cursor.execute(query, params)
             conn.commit()
@@ -281,13 +551,1427 @@ class Database:
                 return cursor.lastrowid
         except Exception as e:
             conn.rollback()
+            if deadline and isinstance(e, sqlite3.OperationalError) and time.monotonic() > deadline:
+                raise QueryTimeout(f"Query exceeded {timeout}s timeout") from e
             print(f"Database error in execute_query: {str(e)}")
             raise
         finally:
+            if deadline:
+                conn.set_progress_handler(None, 0)
+            cursor.close()
+            conn.close()
+
+    @classmethod
+    def executor(cls):
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="arista-db")
+        return cls._executor
+
+    @classmethod
+    def shutdown_executor(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+
+    @staticmethod
+    async def call(fn, *args, **kwargs):
+        """Run blocking database work on the bounded database executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(Database.executor(), functools.partial(fn, *args, **kwargs))
+
+    @staticmethod
+    async def aexecute(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = False, timeout: Optional[float] = DB_QUERY_TIMEOUT):
+        return await Database.call(
+            Database.execute_query, query, params,
+            fetch_one=fetch_one, fetch_all=fetch_all, timeout=timeout
+        )
+
+    @staticmethod
+    async def astream(query: str, params: tuple = (), batch_size: int = STREAM_BATCH_SIZE):
+        """Yield the result rows in fetchmany batches, holding one pooled connection until exhausted"""
+        conn = await Database.call(Database.get_connection)
+        cursor = None
+        try:
+            cursor = await Database.call(conn.execute, query, params)
+            while True:
+                rows = await Database.call(cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+        finally:
+            if cursor is not None:
+                cursor.close()
+            conn.close()
+
+    @staticmethod
+    def storage_pragmas():
+        conn = Database.get_connection()
+        try:
+            return read_pragmas(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """Pooled connection inside BEGIN IMMEDIATE, committed on success and rolled back on error"""
+        conn = Database.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool (bcrypt releases the GIL) and sheds load with 503s"""
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT, rounds=BCRYPT_ROUNDS):
+        self.workers = max(1, workers)
+        self.queue_limit = max(1, queue_limit)
+        self.rounds = rounds
+        self._executor = None
+        self._pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="arista-hash")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _submit(self, fn, *args):
+        # _pending is only touched from the event loop, so no lock is needed
+        if self._pending >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor(), functools.partial(fn, *args))
+        finally:
+            self._pending -= 1
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify(password: str, password_hash: str) -> bool:
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError:
+            return False
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self._hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._submit(self._verify, password, password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        # bcrypt hashes look like $2b$12$<salt+digest>; the third field is the cost
+        try:
+            return int(password_hash.split('$')[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "queue_limit": self.queue_limit,
+            "rounds": self.rounds,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed
+        }
+
+password_hasher = PasswordHasher()
+
+class BlobStore:
+    """Content-addressed, reference-counted file storage under uploads/blobs/ab/cd/<sha256>"""
+
+    def __init__(self, root=BLOBS_DIR, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    async def receive(self, request: Request, field: str, limit: int, allowed_types) -> tuple:
+        """Stream one file field of a multipart body into a temp blob file, hashing as it copies.
+
+        The body is read straight off the socket rather than spooled first, so an upload is
+        rejected with 413 as soon as it passes limit bytes. Returns (tmp_path, sha256, size,
+        filename, mime); other form fields are ignored.
+        """
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+        part = {}
+        upload = {}
+        pending = []
+
+        def on_part_begin():
+            part.clear()
+            part["headers"] = {}
+            part["name"] = part["value"] = b""
+
+        def on_header_field(data, start, end):
+            part["name"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            part["value"] += data[start:end]
+
+        def on_header_end():
+            part["headers"][part["name"].lower()] = part["value"]
+            part["name"] = part["value"] = b""
+
+        def on_headers_finished():
+            _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+            part["target"] = not upload and disposition.get(b"name") == field.encode() and b"filename" in disposition
+            if part["target"]:
+                upload["filename"] = disposition[b"filename"].decode("utf-8", "replace")
+                upload["mime"] = part["headers"].get(b"content-type", b"").decode("latin-1").strip()
+                if upload["mime"] not in allowed_types:
+                    raise HTTPException(status_code=400, detail="File type not allowed")
+
+        def on_part_data(data, start, end):
+            if part.get("target"):
+                pending.append(data[start:end])
+
+        parser = multipart.MultipartParser(options[b"boundary"], {
+            "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+            "on_header_end": on_header_end, "on_headers_finished": on_headers_finished, "on_part_data": on_part_data
+        })
+
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = tmp_dir / secrets.token_hex(16)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as out:
+                async for chunk in request.stream():
+                    parser.write(chunk)
+                    for data in pending:
+                        size += len(data)
+                        if size > limit:
+                            raise HTTPException(status_code=413, detail=f"File too large (max {limit // (1024 * 1024)}MB)")
+                        hasher.update(data)
+                        await out.write(data)
+                    pending.clear()
+            parser.finalize()
+            if not upload:
+                raise HTTPException(status_code=400, detail=f"{field} is required")
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return tmp_path, hasher.hexdigest(), size, upload["filename"], upload["mime"]
+
+    def attach(self, conn, sha256: str, size: int, tmp_path: Optional[Path] = None) -> bool:
+        """Take a reference on a blob inside the caller's write transaction.
+
+        Returns False when the blob is unknown and no tmp_path was given, so the caller
+        can write the content and try again. Blob files are only created and removed
+        while the SQLite write lock is held, which keeps them in step with refcount.
+        """
+        row = conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is not None and (UPLOADS_DIR / row["path"]).exists():
+            conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?", (sha256,))
+            return True
+        if tmp_path is None:
+            return False
+
+        path = self.path_for(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+        conn.execute(
+            """INSERT INTO blobs (sha256, size, path, refcount) VALUES (?, ?, ?, 1)
+               ON CONFLICT (sha256) DO UPDATE SET refcount = refcount + 1""",
+            (sha256, size, path.relative_to(UPLOADS_DIR).as_posix())
+        )
+        return True
+
+    def release(self, conn, sha256: str):
+        """Drop a reference inside the caller's write transaction, deleting the blob with its last one"""
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?", (sha256,))
+        row = conn.execute("SELECT path, refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is not None and row["refcount"] <= 0:
+            for derivative in conn.execute("SELECT path FROM file_derivatives WHERE blob_sha256 = ?", (sha256,)).fetchall():
+                (UPLOADS_DIR / derivative["path"]).unlink(missing_ok=True)
+            conn.execute("DELETE FROM file_derivatives WHERE blob_sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            (UPLOADS_DIR / row["path"]).unlink(missing_ok=True)
+
+blob_store = BlobStore()
+
+class UploadSweeper:
+    """Deletes resumable upload sessions, and their staged parts, once they sit idle past the TTL"""
+
+    def __init__(self, interval=UPLOAD_SWEEP_INTERVAL, ttl=UPLOAD_SESSION_TTL):
+        self.interval = interval
+        self.ttl = ttl
+        self.swept = 0
+        self._task = None
+
+    def sweep(self) -> int:
+        with Database.transaction() as conn:
+            stale = [
+                row["id"] for row in conn.execute(
+                    "SELECT id FROM upload_sessions WHERE updated_at < datetime('now', ?)",
+                    (f"-{int(self.ttl)} seconds",)
+                )
+            ]
+            conn.executemany("DELETE FROM upload_parts WHERE session_id = ?", [(session_id,) for session_id in stale])
+            conn.executemany("DELETE FROM upload_sessions WHERE id = ?", [(session_id,) for session_id in stale])
+            live = {row["id"] for row in conn.execute("SELECT id FROM upload_sessions")}
+
+        # Also catch directories and temp blobs left behind by a crash mid-request
+        cutoff = time.time() - self.ttl
+        leftovers = [path for path in STAGING_DIR.glob("*") if path.name not in live]
+        leftovers += list((blob_store.root / "tmp").glob("*"))
+        for path in leftovers:
+            try:
+                if path.name not in stale and path.stat().st_mtime >= cutoff:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+        self.swept += len(stale)
+        return len(stale)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                swept = await Database.call(self.sweep)
+                if swept:
+                    print(f"Swept {swept} stale upload session(s)")
+            except Exception as e:
+                print(f"Error sweeping upload sessions: {e}")
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+upload_sweeper = UploadSweeper()
+
+class BackgroundJobs:
+    """Holds references to long-running request follow-ups so they finish, or are cancelled, cleanly at shutdown"""
+
+    def __init__(self):
+        self._tasks = set()
+        self.started = 0
+        self.failed = 0
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        self.started += 1
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            print(f"Error in background job: {task.exception()}")
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {"running": len(self._tasks), "started": self.started, "failed": self.failed}
+
+background_jobs = BackgroundJobs()
+
+class DerivativeGenerator:
+    """Renders resized variants of image blobs on a bounded pool, at most once per blob and variant"""
+
+    def __init__(self, workers=THUMBNAIL_WORKERS, queue_limit=THUMBNAIL_QUEUE_LIMIT, sizes=DERIVATIVE_SIZES):
+        self.workers = max(1, workers)
+        self.queue_limit = max(1, queue_limit)
+        self.sizes = sizes
+        self._executor = None
+        # (sha256, variant) -> future; only touched from the event loop
+        self._inflight = {}
+        self._background = set()
+        self.generated = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def available(self, mime: str) -> bool:
+        return Image is not None and mime in IMAGE_MIME_TYPES
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="arista-thumb")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _lookup(self, conn, sha256: str, variant: str):
+        row = conn.execute(
+            "SELECT * FROM file_derivatives WHERE blob_sha256 = ? AND variant = ?",
+            (sha256, variant)
+        ).fetchone()
+        if row is not None and (UPLOADS_DIR / row["path"]).exists():
+            return dict(row)
+        return None
+
+    def _render(self, sha256: str, variant: str):
+        conn = Database.get_connection()
+        try:
+            existing = self._lookup(conn, sha256, variant)
+        finally:
+            conn.close()
+        if existing is not None:
+            return existing
+
+        size = self.sizes[variant]
+        with Image.open(blob_store.path_for(sha256)) as image:
+            # Lets the JPEG decoder downscale while decoding instead of inflating the full image
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                fmt, mime, ext = "PNG", "image/png", ".png"
+            else:
+                image = image.convert("RGB")
+                fmt, mime, ext = "JPEG", "image/jpeg", ".jpg"
+            tmp_dir = blob_store.root / "tmp"
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = tmp_dir / secrets.token_hex(16)
+            image.save(tmp_path, fmt, quality=82, optimize=True)
+            width, height = image.size
+
+        path = blob_store.path_for(sha256).with_name(f"{sha256}.{variant}{ext}")
+        try:
+            with Database.transaction() as conn:
+                # Same write lock as BlobStore.release, so a derivative never outlives its blob
+                if conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)).fetchone() is None:
+                    return None
+                os.replace(tmp_path, path)
+                conn.execute(
+                    """INSERT OR REPLACE INTO file_derivatives (blob_sha256, variant, path, mime, width, height, size)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (sha256, variant, path.relative_to(UPLOADS_DIR).as_posix(), mime, width, height, path.stat().st_size)
+                )
+                self.generated += 1
+                return self._lookup(conn, sha256, variant)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    async def get(self, sha256: str, variant: str):
+        """Return the derivative row, rendering it first if needed; None when it cannot be produced"""
+        key = (sha256, variant)
+        future = self._inflight.get(key)
+        if future is None:
+            if len(self._inflight) >= self.queue_limit:
+                self.rejected += 1
+                return None
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor(), self._render, sha256, variant)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            # shield() so a client disconnecting does not cancel a render others are waiting on
+            row = await asyncio.shield(future)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error rendering {variant} for blob {sha256}: {e}")
+            return None
+        return row
+
+    def schedule(self, sha256: str, mime: str):
+        """Start rendering every variant of a freshly uploaded image in the background"""
+        if not self.available(mime):
+            return
+        for variant in self.sizes:
+            task = asyncio.create_task(self.get(sha256, variant))
+            # The loop only holds weak references to tasks
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def stats(self):
+        return {
+            "enabled": Image is not None,
+            "workers": self.workers,
+            "pending": len(self._inflight),
+            "queue_limit": self.queue_limit,
+            "generated": self.generated,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+derivatives = DerivativeGenerator()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+class InvalidationChannel:
+    """Propagates cache invalidations to the other workers through the cache_invalidations table"""
+
+    def __init__(self, enabled=CACHE_SYNC_ENABLED, interval=CACHE_SYNC_INTERVAL):
+        self.enabled = enabled
+        self.interval = interval
+        self.caches = {}
+        self._last_id = 0
+        self._task = None
+
+    def register(self, name: str, cache: TTLCache, invalidate=None):
+        """invalidate(key) replaces cache.invalidate for caches whose messages name a group of entries"""
+        self.caches[name] = (cache, invalidate or cache.invalidate)
+
+    def _apply(self, name, key):
+        if name not in self.caches:
+            return
+        cache, invalidate = self.caches[name]
+        if key is None:
+            cache.clear()
+        else:
+            invalidate(key)
+
+    async def invalidate(self, name: str, key=None):
+        key = None if key is None else str(key)
+        self._apply(name, key)
+        if self.enabled:
+            await Database.aexecute(
+                "INSERT INTO cache_invalidations (cache, cache_key) VALUES (?, ?)",
+                (name, key)
+            )
+
+    async def _poll(self):
+        rows = await Database.aexecute(
+            "SELECT id, cache, cache_key FROM cache_invalidations WHERE id > ? ORDER BY id",
+            (self._last_id,), fetch_all=True
+        )
+        for row in rows:
+            self._apply(row["cache"], row["cache_key"])
+            self._last_id = row["id"]
+
+    async def _run(self):
+        polls = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._poll()
+                polls += 1
+                if polls % 600 == 0:
+                    await Database.aexecute(
+                        "DELETE FROM cache_invalidations WHERE created_at < datetime('now', '-1 hour')"
+                    )
+            except Exception as e:
+                print(f"Error polling cache invalidations: {e}")
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        row = await Database.aexecute("SELECT MAX(id) as last_id FROM cache_invalidations", fetch_one=True)
+        self._last_id = (row or {}).get("last_id") or 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+cache_channel = InvalidationChannel()
+cache_channel.register("users", user_cache)
+count_cache = TTLCache(1024, COUNT_CACHE_TTL)
+# Count keys start with the table they count; an invalidation names the table
+cache_channel.register("counts", count_cache, lambda table: invalidate_counts(table))
+dashboard_cache = TTLCache(1024, DASHBOARD_CACHE_TTL)
+cache_channel.register("dashboards", dashboard_cache)
+calendar_cache = TTLCache(1024, CALENDAR_CACHE_TTL)
+cache_channel.register("calendars", calendar_cache)
+# Audit target types whose writes make each cache stale
+CACHE_TARGETS = {
+    "dashboards": {"event", "participant", "team", "task", "announcement"},
+    "calendars": {"event", "team", "schedule"}
+}
+
+class Subscription:
+    def __init__(self, school_id: int, event_id: Optional[int], maxsize: int):
+        self.school_id = school_id
+        self.event_id = event_id
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def wants(self, message: dict) -> bool:
+        # School-wide messages (no event) reach every subscriber of the school
+        return self.event_id is None or message["event_id"] in (None, self.event_id)
+
+class EventHub:
+    """Fans change_feed rows out to streaming subscribers, scoped per school and optionally per event.
+
+    Publishing only inserts a row; every worker polls the table and delivers to its own
+    subscribers, so a write on one gunicorn worker reaches clients connected to any of them.
+    """
+
+    def __init__(self, interval=STREAM_POLL_INTERVAL, queue_size=STREAM_QUEUE_SIZE):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._last_id = 0
+        self._task = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def publish(self, school_id: int, event_id: Optional[int], kind: str, data: dict) -> int:
+        message_id = await Database.aexecute(
+            "INSERT INTO change_feed (school_id, event_id, kind, payload_json) VALUES (?, ?, ?, ?)",
+            (school_id, event_id, kind, json.dumps(data, default=str))
+        )
+        self.published += 1
+        return message_id
+
+    def subscribe(self, school_id: int, event_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(school_id, event_id, self.queue_size)
+        self._subscribers.setdefault(school_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.school_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.school_id]
+
+    @staticmethod
+    def _message(row: dict) -> dict:
+        return {
+            "id": row["id"],
+            "school_id": row["school_id"],
+            "event_id": row["event_id"],
+            "kind": row["kind"],
+            "data": json.loads(row["payload_json"])
+        }
+
+    def _deliver(self, message: dict):
+        for subscription in list(self._subscribers.get(message["school_id"], ())):
+            if not subscription.wants(message):
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Cut off a consumer this far behind instead of buffering for it; the client
+                # reconnects with Last-Event-ID and catches up from the table
+                subscription.overflowed = True
+                self.dropped += 1
+                self.unsubscribe(subscription)
+
+    async def replay(self, school_id: int, event_id: Optional[int], after_id: int) -> list:
+        rows = await Database.aexecute(
+            """SELECT * FROM change_feed
+               WHERE id > ? AND school_id = ? AND (? IS NULL OR event_id IS NULL OR event_id = ?)
+               ORDER BY id LIMIT ?""",
+            (after_id, school_id, event_id, event_id, STREAM_REPLAY_LIMIT),
+            fetch_all=True
+        )
+        return [self._message(row) for row in rows]
+
+    async def _poll(self):
+        rows = await Database.aexecute(
+            "SELECT * FROM change_feed WHERE id > ? ORDER BY id LIMIT 1000",
+            (self._last_id,), fetch_all=True
+        )
+        for row in rows:
+            self._last_id = row["id"]
+            if row["school_id"] in self._subscribers:
+                self._deliver(self._message(row))
+
+    async def _run(self):
+        polls = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._poll()
+                polls += 1
+                if polls % 7200 == 0:
+                    await Database.aexecute(
+                        "DELETE FROM change_feed WHERE created_at < datetime('now', ?)",
+                        (f"-{STREAM_RETENTION_HOURS} hours",)
+                    )
+            except Exception as e:
+                print(f"Error polling change feed: {e}")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        row = await Database.aexecute("SELECT MAX(id) as last_id FROM change_feed", fetch_one=True)
+        self._last_id = (row or {}).get("last_id") or 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "schools": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped
+        }
+
+event_hub = EventHub()
+
+class AuditWriter:
+    """Buffers audit records in memory and inserts them in batches from a background task.
+
+    Records that cannot reach the database (buffer full, failed flush, failed shutdown flush)
+    are appended to a JSONL spool file, which is replayed into audit_log on the next start.
+    In "sync" mode, or before start(), every record is inserted as it is submitted.
+
+    Dashboard nudges ride along: the changes a flush carries become one change_feed message per
+    school (and event) in the same transaction, instead of a write per mutation.
+    """
+
+    COLUMNS = ("user_id", "action", "target_type", "target_id", "meta_json", "created_at", "record_id")
+
+    def __init__(self, mode=AUDIT_MODE, batch_size=AUDIT_BATCH_SIZE, interval=AUDIT_FLUSH_INTERVAL,
+                 capacity=AUDIT_BUFFER_SIZE, spool_path=AUDIT_SPOOL_PATH):
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.capacity = max(1, capacity)
+        self.spool_path = spool_path
+        self._buffer = deque()
+        self._nudges = {}
+        self._wakeup = None
+        self._task = None
+        self._spool_lock = threading.Lock()
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def _insert(self, records: list, nudges: Optional[dict] = None):
+        with Database.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO audit_log ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                records
+            )
+            if nudges:
+                conn.executemany(
+                    "INSERT INTO change_feed (school_id, event_id, kind, payload_json) VALUES (?, ?, 'dashboard', ?)",
+                    [
+                        (school_id, event_id, json.dumps({"changes": count, "target_types": sorted(target_types)}))
+                        for (school_id, event_id), (count, target_types) in nudges.items()
+                    ]
+                )
+                event_hub.published += len(nudges)
+
+    @staticmethod
+    def _nudge(nudges: dict, nudge: tuple):
+        school_id, event_id, target_type = nudge
+        count, target_types = nudges.get((school_id, event_id), (0, set()))
+        target_types.add(target_type)
+        nudges[(school_id, event_id)] = (count + 1, target_types)
+
+    def _spool(self, records: list):
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for record in records:
+                    spool.write(json.dumps(record) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+        self.spooled += len(records)
+
+    def _replay_spool(self):
+        """Insert spooled records, including claims a crashed or failed replay left behind.
+
+        Each file is claimed by renaming it, so workers starting together rarely replay the same
+        one; when they do, record_id makes the second insert a no-op. A file is only deleted once
+        all of it is in, so a replay that fails partway is retried from the start next time.
+        """
+        pattern = f"{self.spool_path.name}.*.replay"
+        for n, path in enumerate([self.spool_path] + sorted(self.spool_path.parent.glob(pattern))):
+            claimed = self.spool_path.with_name(f"{self.spool_path.name}.{os.getpid()}-{n}.replay")
+            try:
+                os.replace(path, claimed)
+                with open(claimed, encoding="utf-8") as spool:
+                    lines = [line for line in spool if line.strip()]
+            except FileNotFoundError:
+                continue
+            records = []
+            for number, line in enumerate(lines):
+                record = tuple(json.loads(line))
+                if len(record) < len(self.COLUMNS):
+                    # Spooled before records carried an id: derive a stable one from the line
+                    record += (hashlib.sha1(f"{number}:{line}".encode("utf-8")).hexdigest(),)
+                records.append(record)
+            for start in range(0, len(records), self.batch_size):
+                self._insert(records[start:start + self.batch_size])
+            claimed.unlink(missing_ok=True)
+            self.replayed += len(records)
+            print(f"Replayed {len(records)} spooled audit record(s)")
+
+    async def submit(self, record: tuple, nudge: Optional[tuple] = None):
+        """Queue an audit record; nudge is (school_id, event_id, target_type) for open dashboards to refetch"""
+        if self._task is None:
+            nudges = {}
+            if nudge:
+                self._nudge(nudges, nudge)
+            await Database.call(self._insert, [record], nudges)
+            self.written += 1
+            await drop_counts("audit_log")
+            return
+        if len(self._buffer) >= self.capacity:
+            await Database.call(self._spool, [record])
+            return
+        if nudge:
+            self._nudge(self._nudges, nudge)
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            nudges, self._nudges = self._nudges, {}
+            started = time.monotonic()
+            try:
+                await Database.call(self._insert, batch, nudges)
+            except Exception as e:
+                self.failures += 1
+                print(f"Error flushing {len(batch)} audit record(s), spooling them: {e}")
+                await Database.call(self._spool, batch)
+                # The changes still happened; let the next flush tell the dashboards
+                for key, (count, target_types) in nudges.items():
+                    for target_type in target_types:
+                        self._nudge(self._nudges, key + (target_type,))
+                continue
+            elapsed = (time.monotonic() - started) * 1000
+            self.flushes += 1
+            self.written += len(batch)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            await drop_counts("audit_log")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error in audit writer: {e}")
+
+    async def start(self):
+        try:
+            await Database.call(self._replay_spool)
+        except Exception as e:
+            print(f"Error replaying audit spool: {e}")
+        if self.mode == "sync" or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "mode": "async" if self._task is not None else "sync",
+            "queue_depth": len(self._buffer),
+            "capacity": self.capacity,
+            "batch_size": self.batch_size,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2)
+        }
+
+audit_writer = AuditWriter()
+
+class AuditArchive:
+    """Moves whole months of audit_log past the retention window into gzip JSONL segments.
+
+    Segments are written once and never modified. audit_segments indexes each one by id and
+    time range and by the users, actions and target types it holds, so a query only opens
+    segments that can match. query() merges live and archived rows in (created_at, id) order.
+    """
+
+    FIELDS = ("id", "user_id", "user_name", "action", "target_type", "target_id", "meta_json", "created_at")
+    FILTERS = ("user_id", "action", "target_type")
+
+    def __init__(self, directory=AUDIT_ARCHIVE_DIR, retention_days=AUDIT_RETENTION_DAYS, keep_days=AUDIT_ARCHIVE_KEEP_DAYS):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.keep_days = keep_days
+        # Decoded segment rows, newest first, keyed by segment id
+        self._segments = TTLCache(8, 300)
+        self.segments_read = 0
+
+    def cutoff(self) -> str:
+        """Start of the oldest month that stays live"""
+        return (datetime.utcnow() - timedelta(days=self.retention_days)).strftime("%Y-%m-01 00:00:00")
+
+    def pending_months(self) -> list:
+        conn = Database.get_connection()
+        try:
+            rows = conn.execute(
+                "SELECT substr(created_at, 1, 7) as month, COUNT(*) as count FROM audit_log "
+                "WHERE created_at < ? GROUP BY month ORDER BY month",
+                (self.cutoff(),)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def archive_month(self, month: str) -> Optional[dict]:
+        year, mon = (int(part) for part in month.split("-"))
+        start = f"{month}-01 00:00:00"
+        end = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01 00:00:00"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f".audit-{month}.{os.getpid()}.tmp"
+        segment = {"row_count": 0, "user_ids": set(), "actions": set(), "target_types": set()}
+        renamed = None
+        conn = Database.get_connection()
+        try:
+            cursor = conn.execute(
+                """SELECT a.id, a.user_id, u.name as user_name, a.action, a.target_type, a.target_id, a.meta_json, a.created_at
+                   FROM audit_log a LEFT JOIN users u ON a.user_id = u.id
+                   WHERE a.created_at >= ? AND a.created_at < ?
+                   ORDER BY a.created_at, a.id""",
+                (start, end)
+            )
+            with open(tmp_path, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as out:
+                    while True:
+                        rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                        if not rows:
+                            break
+                        for row in rows:
+                            record = {field: row[field] for field in self.FIELDS}
+                            out.write((json.dumps(record, separators=(',', ':')) + "\n").encode("utf-8"))
+                            if not segment["row_count"]:
+                                segment["min_created_at"] = record["created_at"]
+                                segment["min_id"] = segment["max_id"] = record["id"]
+                            segment["row_count"] += 1
+                            segment["max_created_at"] = record["created_at"]
+                            segment["min_id"] = min(segment["min_id"], record["id"])
+                            segment["max_id"] = max(segment["max_id"], record["id"])
+                            segment["user_ids"].add(record["user_id"])
+                            segment["actions"].add(record["action"])
+                            segment["target_types"].add(record["target_type"])
+                raw.flush()
+                os.fsync(raw.fileno())
             cursor.close()
+            if not segment["row_count"]:
+                tmp_path.unlink()
+                return None
+            name = f"audit-{month}-{segment['min_id']}-{segment['max_id']}.jsonl.gz"
+            os.replace(tmp_path, self.directory / name)
+            renamed = self.directory / name
+
+            # Rows committed after the read above always get larger ids, so id <= max_id
+            # deletes exactly what went into the segment
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """INSERT INTO audit_segments (month, path, row_count, size_bytes, min_id, max_id, min_created_at,
+                   max_created_at, user_ids_json, actions_json, target_types_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (month, name, segment["row_count"], (self.directory / name).stat().st_size, segment["min_id"],
+                 segment["max_id"], segment["min_created_at"], segment["max_created_at"],
+                 json.dumps(sorted(segment["user_ids"], key=lambda v: (v is None, v))),
+                 json.dumps(sorted(segment["actions"])), json.dumps(sorted(segment["target_types"])))
+            )
+            conn.execute(
+                "DELETE FROM audit_log WHERE created_at >= ? AND created_at < ? AND id <= ?",
+                (start, end, segment["max_id"])
+            )
+            if cache_channel.enabled:
+                # Usually run from manage.py, so serving workers only hear of it through the channel
+                conn.executemany(
+                    "INSERT INTO cache_invalidations (cache, cache_key) VALUES ('counts', ?)",
+                    [("audit_log",), ("audit_segments",)]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            tmp_path.unlink(missing_ok=True)
+            # The rows are still live, so drop the segment rather than leave it unindexed
+            if renamed is not None and not conn.execute(
+                "SELECT 1 FROM audit_segments WHERE path = ?", (renamed.name,)
+            ).fetchone():
+                renamed.unlink(missing_ok=True)
+            raise
+        finally:
             conn.close()
+        invalidate_counts("audit_log", "audit_segments")
+        return {"month": month, "path": name, "rows": segment["row_count"]}
+
+    def purge(self) -> list:
+        """Drop segments whose newest record is older than keep_days"""
+        if self.keep_days <= 0:
+            return []
+        cutoff = (datetime.utcnow() - timedelta(days=self.keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+        with Database.transaction() as conn:
+            segments = [dict(row) for row in conn.execute(
+                "SELECT id, path FROM audit_segments WHERE max_created_at < ?", (cutoff,)
+            ).fetchall()]
+            conn.execute("DELETE FROM audit_segments WHERE max_created_at < ?", (cutoff,))
+        for segment in segments:
+            (self.directory / segment["path"]).unlink(missing_ok=True)
+            self._segments.invalidate(segment["id"])
+        return [segment["path"] for segment in segments]
+
+    def run(self) -> list:
+        archived = []
+        for pending in self.pending_months():
+            result = self.archive_month(pending["month"])
+            if result:
+                archived.append(result)
+        return archived
+
+    def _load(self, segment: dict) -> list:
+        rows = self._segments.get(segment["id"])
+        if rows is None:
+            with gzip.open(self.directory / segment["path"], "rt", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            rows.reverse()
+            self._segments.set(segment["id"], rows)
+            self.segments_read += 1
+        return rows
+
+    def _candidates(self, conn, filters: dict, before: Optional[list]) -> list:
+        clauses, params = [], []
+        if before:
+            clauses.append("min_created_at <= ?")
+            params.append(before[0])
+        if filters.get("since"):
+            clauses.append("max_created_at >= ?")
+            params.append(filters["since"])
+        if filters.get("until"):
+            clauses.append("min_created_at < ?")
+            params.append(filters["until"])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        segments = [dict(row) for row in conn.execute(
+            f"SELECT * FROM audit_segments {where} ORDER BY max_created_at DESC, max_id DESC", params
+        ).fetchall()]
+        return [
+            segment for segment in segments
+            if all(
+                filters.get(key) is None or filters[key] in json.loads(segment[f"{key}s_json"])
+                for key in self.FILTERS
+            )
+        ]
 
-app = FastAPI(title="Arista Event Planning Portal")
+    @staticmethod
+    def _matches(row: dict, filters: dict, before: Optional[list]) -> bool:
+        if before and (row["created_at"], row["id"]) >= (before[0], before[1]):
+            return False
+        if filters.get("since") and row["created_at"] < filters["since"]:
+            return False
+        if filters.get("until") and row["created_at"] >= filters["until"]:
+            return False
+        return all(filters.get(key) is None or row[key] == filters[key] for key in AuditArchive.FILTERS)
+
+    @staticmethod
+    def live_where(filters: dict, before: Optional[list] = None):
+        clauses, params = [], []
+        for key in AuditArchive.FILTERS:
+            if filters.get(key) is not None:
+                clauses.append(f"a.{key} = ?")
+                params.append(filters[key])
+        if filters.get("since"):
+            clauses.append("a.created_at >= ?")
+            params.append(filters["since"])
+        if filters.get("until"):
+            clauses.append("a.created_at < ?")
+            params.append(filters["until"])
+        if before:
+            clauses.append("(a.created_at, a.id) < (?, ?)")
+            params.extend(before)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), tuple(params)
+
+    def query(self, filters: dict, before: Optional[list], need: int) -> list:
+        """Newest `need` records matching filters and older than the (created_at, id) cursor"""
+        where, params = self.live_where(filters, before)
+        conn = Database.get_connection()
+        try:
+            rows = [dict(row) for row in conn.execute(
+                f"""SELECT a.*, u.name as user_name FROM audit_log a LEFT JOIN users u ON a.user_id = u.id
+                    {where} ORDER BY a.created_at DESC, a.id DESC LIMIT ?""",
+                params + (need,)
+            ).fetchall()]
+            segments = self._candidates(conn, filters, before)
+        finally:
+            conn.close()
+
+        order = lambda row: (row["created_at"], row["id"])
+        for segment in segments:
+            if len(rows) >= need:
+                rows.sort(key=order, reverse=True)
+                del rows[need:]
+                # Segments come newest first, so once this one ends before the oldest row
+                # kept, neither it nor any later segment can contribute
+                if segment["max_created_at"] < rows[-1]["created_at"]:
+                    break
+            matched = 0
+            for row in self._load(segment):
+                if self._matches(row, filters, before):
+                    rows.append(row)
+                    matched += 1
+                    if matched >= need:
+                        break
+        rows.sort(key=order, reverse=True)
+        return rows[:need]
+
+    def archived_count(self, filters: dict) -> int:
+        if not any(filters.values()):
+            conn = Database.get_connection()
+            try:
+                row = conn.execute("SELECT TOTAL(row_count) as count FROM audit_segments").fetchone()
+                return int(row["count"])
+            finally:
+                conn.close()
+        conn = Database.get_connection()
+        try:
+            segments = self._candidates(conn, filters, None)
+        finally:
+            conn.close()
+        return sum(1 for segment in segments for row in self._load(segment) if self._matches(row, filters, None))
+
+    def stats(self):
+        return {
+            "retention_days": self.retention_days,
+            "keep_days": self.keep_days,
+            "segments_read": self.segments_read,
+            "segment_cache": self._segments.stats()
+        }
+
+audit_archive = AuditArchive()
+
+class Registrations:
+    """Admits participants to events up to max_participants, waitlisting the rest and promoting them in order.
+
+    Every seat decision reads the seat count and writes the participant under the same BEGIN IMMEDIATE
+    lock, so concurrent registrations for the last seat serialise instead of overselling it.
+    """
+
+    # Events in these states take no new registrations, seats or waitlist places
+    CLOSED_STATUSES = ("completed", "cancelled")
+
+    def __init__(self, key_ttl=IDEMPOTENCY_KEY_TTL):
+        self.key_ttl = key_ttl
+        self.registered = 0
+        self.waitlisted = 0
+        self.promoted = 0
+        self.cancelled = 0
+        self.replayed = 0
+        self._purged_at = 0.0
+
+    @staticmethod
+    def seats(conn, event_id: int) -> tuple:
+        """(max_participants, registered count) for the event; max_participants is None when unlimited"""
+        row = conn.execute(
+            """SELECT e.max_participants,
+                      (SELECT COUNT(*) FROM participants p WHERE p.event_id = e.id AND p.status = 'registered') as taken
+               FROM events e WHERE e.id = ?""",
+            (event_id,)
+        ).fetchone()
+        if row is None:
+            return 0, 0
+        return row["max_participants"], row["taken"]
+
+    @staticmethod
+    def position(conn, participant: dict) -> Optional[int]:
+        if participant["status"] != "waitlisted":
+            return None
+        return conn.execute(
+            """SELECT COUNT(*) FROM participants WHERE event_id = ? AND status = 'waitlisted'
+               AND (registration_date, id) <= (?, ?)""",
+            (participant["event_id"], participant["registration_date"], participant["id"])
+        ).fetchone()[0]
+
+    def promote(self, conn, event_id: int) -> list:
+        """Move waitlisted participants into free seats, first come first served; returns their ids"""
+        capacity, taken = self.seats(conn, event_id)
+        if capacity is not None and taken >= capacity:
+            return []
+        promoted = [
+            row["id"] for row in conn.execute(
+                """UPDATE participants SET status = 'registered', updated_at = CURRENT_TIMESTAMP
+                   WHERE id IN (SELECT id FROM participants WHERE event_id = ? AND status = 'waitlisted'
+                                ORDER BY registration_date, id LIMIT ?)
+                   RETURNING id""",
+                (event_id, -1 if capacity is None else capacity - taken)
+            )
+        ]
+        self.promoted += len(promoted)
+        return promoted
+
+    def promote_event(self, event_id: int) -> list:
+        with Database.transaction() as conn:
+            return self.promote(conn, event_id)
+
+    def register(self, conn, event_id: int, school_id: int, participant: dict, waitlist: bool = True) -> dict:
+        """Give the participant a seat or a waitlist place on the event.
+
+        participant carries "id" to enrol an existing roster entry, or the columns of a new one.
+        """
+        event = conn.execute(
+            "SELECT id, status FROM events WHERE id = ? AND school_id = ?", (event_id, school_id)
+        ).fetchone()
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        if event["status"] in self.CLOSED_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Event is {event['status']}")
+
+        existing = None
+        if participant.get("id"):
+            existing = conn.execute(
+                "SELECT * FROM participants WHERE id = ? AND school_id = ?", (participant["id"], school_id)
+            ).fetchone()
+            if not existing:
+                raise HTTPException(status_code=404, detail="Participant not found")
+        elif participant.get("user_id"):
+            existing = conn.execute(
+                "SELECT * FROM participants WHERE event_id = ? AND user_id = ?", (event_id, participant["user_id"])
+            ).fetchone()
+        if existing and existing["event_id"] not in (None, event_id) and existing["status"] != "cancelled":
+            raise HTTPException(status_code=409, detail="Participant is registered for another event")
+        if existing and existing["event_id"] == event_id and existing["status"] != "cancelled":
+            # Already in: report where they stand rather than taking a second seat
+            existing = dict(existing)
+            return {"participant_id": existing["id"], "status": existing["status"],
+                    "position": self.position(conn, existing), "created": False}
+
+        capacity, taken = self.seats(conn, event_id)
+        status = "registered" if capacity is None or taken < capacity else "waitlisted"
+        if status == "waitlisted" and not waitlist:
+            raise HTTPException(status_code=409, detail="Event is full")
+
+        # Millisecond timestamps keep the waitlist in arrival order
+        if existing:
+            participant_id = existing["id"]
+            conn.execute(
+                """UPDATE participants SET event_id = ?, status = ?,
+                   registration_date = strftime('%Y-%m-%d %H:%M:%f', 'now'), updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?""",
+                (event_id, status, participant_id)
+            )
+        else:
+            columns = ["school_id", "event_id", "status"] + [
+                column for column in ("user_id", "first_name", "last_name", "grade", "section", "email", "phone",
+                                      "guardian_name", "guardian_phone", "medical_notes")
+                if column in participant
+            ]
+            participant_id = conn.execute(
+                f"""INSERT INTO participants (registration_date, {', '.join(columns)})
+                    VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now'), {', '.join('?' * len(columns))})""",
+                [school_id, event_id, status] + [participant[column] for column in columns[3:]]
+            ).lastrowid
+
+        if status == "registered":
+            self.registered += 1
+        else:
+            self.waitlisted += 1
+        row = dict(conn.execute("SELECT * FROM participants WHERE id = ?", (participant_id,)).fetchone())
+        return {"participant_id": participant_id, "status": status, "position": self.position(conn, row), "created": True}
+
+    def cancel(self, conn, participant_id: int, school_id: int, owner_id: Optional[int] = None) -> dict:
+        """Cancel a registration and hand its seat to the head of the waitlist"""
+        participant = conn.execute(
+            "SELECT id, event_id, user_id, status FROM participants WHERE id = ? AND school_id = ?",
+            (participant_id, school_id)
+        ).fetchone()
+        if not participant or (owner_id is not None and participant["user_id"] != owner_id):
+            raise HTTPException(status_code=404, detail="Participant not found")
+        promoted = []
+        if participant["status"] != "cancelled":
+            conn.execute(
+                "UPDATE participants SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (participant_id,)
+            )
+            self.cancelled += 1
+            if participant["status"] == "registered" and participant["event_id"] is not None:
+                promoted = self.promote(conn, participant["event_id"])
+        return {"participant_id": participant_id, "event_id": participant["event_id"], "status": "cancelled",
+                "was": participant["status"], "promoted": promoted}
+
+    def run(self, user_id: int, key: Optional[str], fingerprint: str, fn, *args) -> tuple:
+        """Run fn(conn, *args) in one transaction, or replay the response stored under the idempotency key.
+
+        Returns (response, replayed). The key is stored in the same transaction as the write it
+        guards, so a retry either sees both or neither; failures are not stored and may be retried.
+        """
+        with Database.transaction() as conn:
+            if key:
+                if time.monotonic() - self._purged_at > 60:
+                    conn.execute(
+                        "DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+                        (f"-{int(self.key_ttl)} seconds",)
+                    )
+                    self._purged_at = time.monotonic()
+                stored = conn.execute(
+                    "SELECT fingerprint, response_json FROM idempotency_keys WHERE user_id = ? AND key = ?",
+                    (user_id, key)
+                ).fetchone()
+                if stored:
+                    if stored["fingerprint"] != fingerprint:
+                        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+                    self.replayed += 1
+                    return json.loads(stored["response_json"]), True
+            response = fn(conn, *args)
+            if key:
+                conn.execute(
+                    "INSERT INTO idempotency_keys (user_id, key, fingerprint, response_json) VALUES (?, ?, ?, ?)",
+                    (user_id, key, fingerprint, json.dumps(response))
+                )
+            return response, False
+
+    def stats(self):
+        return {
+            "registered": self.registered,
+            "waitlisted": self.waitlisted,
+            "promoted": self.promoted,
+            "cancelled": self.cancelled,
+            "replayed": self.replayed
+        }
+
+registrations = Registrations()
+
+@asynccontextmanager
+async def lifespan(app):
+    Database.initialize()
+    await cache_channel.start()
+    await event_hub.start()
+    await audit_writer.start()
+    upload_sweeper.start()
+    yield
+    await upload_sweeper.stop()
+    await background_jobs.stop()
+    await audit_writer.stop()
+    await event_hub.stop()
+    await cache_channel.stop()
+    password_hasher.shutdown()
+    derivatives.shutdown()
+    Database.shutdown_executor()
+    Database.close_pool()
+
+app = FastAPI(title="Arista Event Planning Portal", lifespan=lifespan)
 
 FRONTEND_DIR = Path(__file__).parent.parent / "frontend"
 templates = Jinja2Templates(directory=str(FRONTEND_DIR / "html"))
@@ -301,9 +1985,11 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-security = HTTPBearer(auto_error=False)
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(status_code=504, content={"detail": "Database query timed out"})
 
-Database.initialize()
+security = HTTPBearer(auto_error=False)
 
 def verify_token(token: str):
     try:
@@ -340,19 +2026,22 @@ async def get_current_user(
         if not user_id:
             return None
             
-        user = Database.execute_query(
-            """
-            SELECT u.*, s.name as school_name, s.code as school_code 
-            FROM users u 
-            JOIN schools s ON u.school_id = s.id 
-            WHERE u.id = ?
-            """, 
-            (user_id,), 
-            fetch_one=True
-        )
-        
-        if not user:
-            return None
+        user = user_cache.get(str(user_id))
+        if user is None:
+            user = await Database.aexecute(
+                """
+                SELECT u.*, s.name as school_name, s.code as school_code 
+                FROM users u 
+                JOIN schools s ON u.school_id = s.id 
+                WHERE u.id = ?
+                """, 
+                (user_id,), 
+                fetch_one=True
+            )
+            
+            if not user:
+                return None
+            user_cache.set(str(user_id), user)
             
         user_dict = dict(user)
         user_dict["token"] = token
@@ -393,11 +2082,94 @@ def require_role(allowed_roles: List[str]):
         return user
     return role_checker
 
-def log_audit(user_id: int, action: str, target_type: str, target_id: int, meta: dict = None):
-    Database.execute_query(
-        "INSERT INTO audit_log (user_id, action, target_type, target_id, meta_json) VALUES (?, ?, ?, ?, ?)",
-        (user_id, action, target_type, target_id, json.dumps(meta) if meta else None)
+async def require_operator(user = Depends(require_role(["admin"]))) -> dict:
+    """Dependency for endpoints that report on the whole server rather than one school"""
+    if user["id"] not in OPERATOR_USER_IDS:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return user
+
+async def log_audit(user: dict, action: str, target_type: str, target_id: int, meta: dict = None):
+    # Stamped here rather than by the column default so batched records keep their own time
+    created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    nudge = None
+    if target_type in CACHE_TARGETS["dashboards"]:
+        # Open dashboards of the actor's school refetch once the record is flushed
+        nudge = (user["school_id"], target_id if target_type == "event" else None, target_type)
+    await audit_writer.submit(
+        (user["id"], action, target_type, target_id, json.dumps(meta) if meta else None, created_at,
+         secrets.token_hex(16)),
+        nudge
     )
+    # Every mutation is audited, so this is where cached totals for its table go stale
+    await drop_counts(f"{target_type}s")
+    for cache_name, targets in CACHE_TARGETS.items():
+        if target_type in targets:
+            # Dashboards are cached per school; only the actor's school has changed
+            await cache_channel.invalidate(cache_name, user["school_id"] if cache_name == "dashboards" else None)
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def next_page_cursor(rows: list, limit: int, keys: tuple) -> Optional[str]:
+    """rows holds up to limit + 1 items; the extra one only signals that another page exists"""
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor([rows[-1][key] for key in keys])
+
+# Table -> (FTS5 index, bm25 weight per indexed column), created by migration 0010
+SEARCH_INDEXES = {
+    "events": ("events_fts", {"title": 10.0, "description": 2.0, "category": 4.0, "location": 2.0, "host": 2.0}),
+    "participants": ("participants_fts", {"first_name": 5.0, "last_name": 5.0, "email": 2.0}),
+}
+
+def search_available(table: str) -> bool:
+    return bool(schema.columns(SEARCH_INDEXES[table][0]))
+
+def fts_query(text: str) -> Optional[str]:
+    """Free text as an FTS5 query in which every word must match as a prefix"""
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words[:16])
+
+def invalidate_counts(*tables: str):
+    """Drop this worker's cached totals for tables"""
+    count_cache.invalidate_where(lambda key, _: key[0] in tables)
+
+async def drop_counts(*tables: str):
+    """Drop cached totals for tables on every worker"""
+    for table in tables:
+        await cache_channel.invalidate("counts", table)
+
+async def cached_count(table: str, query: str, params: tuple) -> int:
+    key = (table, query, params)
+    total = count_cache.get(key)
+    if total is None:
+        row = await Database.aexecute(query, params, fetch_one=True)
+        total = row["count"] if row else 0
+        count_cache.set(key, total)
+    return total
+
+def make_etag(payload) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
 
 def generate_school_code():
     return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
@@ -407,18 +2179,19 @@ async def register_school(request: Request, response: Response):
     try:
         data = await request.json()
         
+        # Hash first so a busy hashing pool does not leave an orphaned school behind
+        password_hash = await password_hasher.hash(data["password"])
+        
         school_code = generate_school_code()
-        while Database.execute_query("SELECT id FROM schools WHERE code = ?", (school_code,), fetch_one=True):
+        while await Database.aexecute("SELECT id FROM schools WHERE code = ?", (school_code,), fetch_one=True):
             school_code = generate_school_code()
         
-        school_id = Database.execute_query(
+        school_id = await Database.aexecute(
             "INSERT INTO schools (name, code, admin_email, address, phone, website) VALUES (?, ?, ?, ?, ?, ?)",
             (data["name"], school_code, data["admin_email"], data.get("address"), data.get("phone"), data.get("website"))
         )
         
-        password_hash = bcrypt.hashpw(data["password"].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        
-        user_id = Database.execute_query(
+        user_id = await Database.aexecute(
             "INSERT INTO users (school_id, name, email, password_hash, role) VALUES (?, ?, ?, ?, ?)",
             (school_id, "Admin User", data["admin_email"], password_hash, "admin")
         )
@@ -448,6 +2221,8 @@ async def register_school(request: Request, response: Response):
                 "school_id": school_id
             }
         }
+    except (HTTPException, QueryTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -461,7 +2236,7 @@ async def get_current_user_endpoint(request: Request, user = Depends(require_aut
 
 @app.get("/api/schools/validate/{school_code}")
 async def validate_school_code(school_code: str):
-    school = Database.execute_query(
+    school = await Database.aexecute(
         "SELECT name FROM schools WHERE code = ? AND status = 'active'", 
         (school_code,), 
         fetch_one=True
@@ -476,7 +2251,7 @@ async def validate_school_code(school_code: str):
 async def register_student(request: Request):
     data = await request.json()
     
-    school = Database.execute_query(
+    school = await Database.aexecute(
         "SELECT id, name FROM schools WHERE code = ? AND status = 'active'", 
         (data["school_code"],), 
         fetch_one=True
@@ -485,7 +2260,7 @@ async def register_student(request: Request):
     if not school:
         raise HTTPException(status_code=400, detail="Invalid school code")
     
-    existing_user = Database.execute_query(
+    existing_user = await Database.aexecute(
         "SELECT id FROM users WHERE school_id = ? AND email = ?", 
         (school["id"], data["email"]), 
         fetch_one=True
@@ -494,10 +2269,10 @@ async def register_student(request: Request):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered for this school")
     
-    password_hash = bcrypt.hashpw(data["password"].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = await password_hasher.hash(data["password"])
     full_name = f"{data['first_name']} {data['last_name']}"
     
-    Database.execute_query(
+    await Database.aexecute(
         "INSERT INTO users (school_id, name, email, password_hash, role, grade, section, guardian_name, guardian_phone, medical_notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (school["id"], full_name, data["email"], password_hash, "student", data["grade"], data["section"], data["guardian_name"], data["guardian_phone"], data.get("medical_notes"))
     )
@@ -513,14 +2288,24 @@ async def signin(response: Response, request: Request):
     if not email or not password:
         raise HTTPException(status_code=400, detail="Email and password required")
     
-    user = Database.execute_query(
+    user = await Database.aexecute(
         "SELECT u.*, s.name as school_name, s.code as school_code FROM users u JOIN schools s ON u.school_id = s.id WHERE u.email = ?", 
         (email,), 
         fetch_one=True
     )
     
-    if not user or not bcrypt.checkpw(password.encode('utf-8'), user["password_hash"].encode('utf-8')):
+    if not user or not await password_hasher.verify(password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if password_hasher.needs_rehash(user["password_hash"]):
+        # Transparently upgrade hashes created with an older work factor
+        new_hash = await password_hasher.hash(password)
+        await Database.aexecute(
+            "UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (new_hash, user["id"])
+        )
+        password_hasher.rehashed += 1
+        await cache_channel.invalidate("users", user["id"])
     
     access_token = create_access_token(data={"sub": user["id"]})
     
@@ -554,111 +2339,48 @@ async def get_school_dashboard_data(
 ):
     school_id = user.get("school_id")
 
-    stats = {
-        "total_events": 0,
-        "total_participants": 0,
-        "total_teams": 0,
-        "pending_tasks": 0
-    }
-
-    try:
-        ev = Database.execute_query(
-            "SELECT COUNT(*) as count FROM events WHERE school_id = ?",
-            (school_id,), fetch_one=True
-        )
-        stats["total_events"] = ev.get("count", 0) if ev else 0
-    except Exception as e:
-        print(f"Error counting events: {e}")
-
-    try:
-        p = Database.execute_query(
-            "SELECT COUNT(*) as count FROM participants WHERE school_id = ?",
-            (school_id,), fetch_one=True
-        )
-        stats["total_participants"] = p.get("count", 0) if p else 0
-    except Exception:
-        try:
-            p = Database.execute_query(
-                "SELECT COUNT(*) as count FROM participants p JOIN events e ON p.event_id = e.id WHERE e.school_id = ?",
-                (school_id,), fetch_one=True
-            )
-            stats["total_participants"] = p.get("count", 0) if p else 0
-        except Exception as e:
-            print(f"Error counting participants: {e}")
-
-    try:
-        t = Database.execute_query(
-            "SELECT COUNT(*) as count FROM teams t JOIN events e ON t.event_id = e.id WHERE e.school_id = ?",
-            (school_id,), fetch_one=True
+    cached = dashboard_cache.get(str(school_id))
+    if cached is None:
+        stats = await Database.aexecute(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM events WHERE school_id = ?) as total_events,
+                (SELECT COUNT(*) FROM participants WHERE school_id = ?) as total_participants,
+                (SELECT COUNT(*) FROM teams t JOIN events e ON t.event_id = e.id WHERE e.school_id = ?) as total_teams,
+                (SELECT COUNT(*) FROM tasks WHERE school_id = ? AND status = 'pending') as pending_tasks
+            """,
+            (school_id, school_id, school_id, school_id), fetch_one=True
         )
-        stats["total_teams"] = t.get("count", 0) if t else 0
-    except Exception as e:
-        print(f"Error counting teams: {e}")
 
-    try:
-        tt = Database.execute_query(
-            "SELECT COUNT(*) as count FROM tasks WHERE school_id = ? AND status = 'pending'",
-            (school_id,), fetch_one=True
+        upcoming_events = await Database.aexecute(
+            "SELECT * FROM events WHERE school_id = ? AND start_at > datetime('now') ORDER BY start_at LIMIT 5",
+            (school_id,), fetch_all=True
         )
-        stats["pending_tasks"] = tt.get("count", 0) if tt else 0
-    except Exception:
-        try:
-            tt = Database.execute_query(
-                "SELECT COUNT(*) as count FROM tasks t JOIN events e ON t.event_id = e.id WHERE e.school_id = ? AND t.status = 'pending'",
-                (school_id,), fetch_one=True
-            )
-            stats["pending_tasks"] = tt.get("count", 0) if tt else 0
-        except Exception as e:
-            print(f"Error counting pending tasks: {e}")
-
-    upcoming_events = []
-    for col in ("start_time", "start_at"):
-        try:
-            upcoming_events = Database.execute_query(
-                f"SELECT * FROM events WHERE school_id = ? AND {col} > datetime('now') ORDER BY {col} LIMIT 5",
-                (school_id,), fetch_all=True
-            )
-            break
-        except Exception:
-            upcoming_events = []
 
-    announcements = []
-    try:
-        announcements = Database.execute_query(
+        announcements = await Database.aexecute(
             "SELECT * FROM announcements WHERE school_id = ? ORDER BY created_at DESC LIMIT 5",
             (school_id,), fetch_all=True
         )
-    except Exception as e:
-        print(f"Error fetching announcements: {e}")
 
-    tasks = []
-    try:
-        tasks = Database.execute_query(
+        tasks = await Database.aexecute(
             "SELECT * FROM tasks WHERE school_id = ? AND status = 'pending' ORDER BY due_at LIMIT 5",
             (school_id,), fetch_all=True
         )
-    except Exception:
-        try:
-            tasks = Database.execute_query(
-                "SELECT * FROM tasks WHERE school_id = ? AND status = 'pending' ORDER BY due_date LIMIT 5",
-                (school_id,), fetch_all=True
-            )
-        except Exception:
-            try:
-                tasks = Database.execute_query(
-                    "SELECT t.* FROM tasks t JOIN events e ON t.event_id = e.id WHERE e.school_id = ? AND t.status = 'pending' ORDER BY t.due_at LIMIT 5",
-                    (school_id,), fetch_all=True
-                )
-            except Exception as e:
-                print(f"Error fetching tasks: {e}")
-                tasks = []
 
-    return {
-        "stats": stats,
-        "upcoming_events": [dict(event) for event in (upcoming_events or [])],
-        "announcements": [dict(announcement) for announcement in (announcements or [])],
-        "tasks": [dict(task) for task in (tasks or [])]
-    }
+        payload = {
+            "stats": dict(stats),
+            "upcoming_events": [dict(event) for event in (upcoming_events or [])],
+            "announcements": [dict(announcement) for announcement in (announcements or [])],
+            "tasks": [dict(task) for task in (tasks or [])]
+        }
+        cached = (make_etag(payload), payload)
+        dashboard_cache.set(str(school_id), cached)
+
+    etag, payload = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
 
 @app.get("/api/dashboard/student")
 async def get_student_dashboard_data(user = Depends(require_role(["student"]))):
@@ -666,27 +2388,27 @@ async def get_student_dashboard_data(user = Depends(require_role(["student"]))):
     user_id = user["id"]
     
     stats = {}
-    stats["enrolled_events"] = Database.execute_query(
+    stats["enrolled_events"] = (await Database.aexecute(
         "SELECT COUNT(*) as count FROM participants p JOIN events e ON p.event_id = e.id WHERE p.user_id = ? AND e.school_id = ?", 
         (user_id, school_id), fetch_one=True
-    )["count"]
+    ))["count"]
     
-    stats["team_memberships"] = Database.execute_query(
+    stats["team_memberships"] = (await Database.aexecute(
         "SELECT COUNT(*) as count FROM team_members tm JOIN teams t ON tm.team_id = t.id JOIN events e ON t.event_id = e.id WHERE tm.participant_id IN (SELECT id FROM participants WHERE user_id = ?) AND e.school_id = ?", 
         (user_id, school_id), fetch_one=True
-    )["count"]
+    ))["count"]
     
-    upcoming_events = Database.execute_query(
-        "SELECT e.* FROM events e JOIN participants p ON e.id = p.event_id WHERE p.user_id = ? AND e.school_id = ? AND e.start_time > datetime('now') ORDER BY e.start_time LIMIT 5",
+    upcoming_events = await Database.aexecute(
+        "SELECT e.* FROM events e JOIN participants p ON e.id = p.event_id WHERE p.user_id = ? AND e.school_id = ? AND e.start_at > datetime('now') ORDER BY e.start_at LIMIT 5",
         (user_id, school_id), fetch_all=True
     )
     
-    announcements = Database.execute_query(
+    announcements = await Database.aexecute(
         "SELECT * FROM announcements WHERE school_id = ? ORDER BY created_at DESC LIMIT 5",
         (school_id,), fetch_all=True
     )
     
-    teams = Database.execute_query(
+    teams = await Database.aexecute(
         """SELECT t.*, e.title as event_title 
            FROM teams t 
            JOIN events e ON t.event_id = e.id 
@@ -721,6 +2443,35 @@ async def get_me(request: Request, user = Depends(require_auth)):
         raise HTTPException(status_code=401, detail="Not authenticated")
     return {"user": user}
 
+@app.get("/api/admin/metrics")
+async def get_metrics(user = Depends(require_operator)):
+    return {
+        "user_cache": user_cache.stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "calendar_cache": calendar_cache.stats(),
+        "event_hub": event_hub.stats(),
+        "audit_writer": audit_writer.stats(),
+        "background_jobs": background_jobs.stats(),
+        "audit_archive": audit_archive.stats(),
+        "registrations": registrations.stats(),
+        "db_pool": Database.pool().stats(),
+        "password_hasher": password_hasher.stats(),
+        "derivatives": derivatives.stats()
+    }
+
+@app.get("/api/admin/storage")
+async def get_storage_settings(user = Depends(require_operator)):
+    profile_name, profile = storage_profile()
+
+    effective = await Database.call(Database.storage_pragmas)
+
+    return {
+        "profile": profile_name,
+        "configured": profile,
+        "effective": effective,
+        "pool": Database.pool().stats()
+    }
+
 @app.post("/api/announcements")
 async def create_announcement_top(request: Request, user = Depends(require_role(["admin", "teacher"]))):
     data = await request.json()
@@ -731,55 +2482,32 @@ async def create_announcement_top(request: Request, user = Depends(require_role(
     if not title or not body:
         raise HTTPException(status_code=400, detail='Title and body are required')
 
-    conn = Database.get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(announcements)")
-        ann_info = cur.fetchall()
-        ann_cols = [r[1] for r in ann_info]
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-        conn.close()
-
-    cols = []
-    vals = []
-
-    if 'school_id' in ann_cols:
-        cols.append('school_id')
-        vals.append(user.get('school_id'))
-
-    if 'event_id' in ann_cols:
-        cols.append('event_id')
-        vals.append(data.get('event_id'))
-
-    if 'title' in ann_cols:
-        cols.append('title')
-        vals.append(title)
-
-    if 'body' in ann_cols:
-        cols.append('body')
-        vals.append(body)
-    if 'content' in ann_cols:
-        cols.append('content')
-        vals.append(body)
-
-    if 'created_by' in ann_cols:
-        cols.append('created_by')
-        vals.append(user.get('id'))
-
-    if not cols:
+    sql, cols = schema.insert_statement(
+        'announcements', ('school_id', 'event_id', 'title', 'body', 'content', 'created_by')
+    )
+    if not sql:
         raise HTTPException(status_code=500, detail='No valid announcement columns available to insert')
 
-    placeholders = ', '.join(['?'] * len(cols))
-    sql = f"INSERT INTO announcements ({', '.join(cols)}) VALUES ({placeholders})"
+    values = {
+        'school_id': user.get('school_id'),
+        'event_id': data.get('event_id'),
+        'title': title,
+        'body': body,
+        'content': body,
+        'created_by': user.get('id')
+    }
+    vals = [values[c] for c in cols]
 
     try:
-        announcement_id = Database.execute_query(sql, tuple(vals))
-        log_audit(user['id'], 'create', 'announcement', announcement_id)
+        announcement_id = await Database.aexecute(sql, tuple(vals))
+        await event_hub.publish(user['school_id'], data.get('event_id'), 'announcement', {
+            "id": announcement_id, "event_id": data.get('event_id'), "title": title, "body": body,
+            "author_name": user.get('name')
+        })
+        await log_audit(user, 'create', 'announcement', announcement_id)
         return {"id": announcement_id, "message": "Announcement created"}
+    except QueryTimeout:
+        raise
     except Exception as e:
         print(f"Error creating announcement: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -791,6 +2519,8 @@ async def get_events(
     status: Optional[str] = None,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
     user = Depends(get_current_user)
 ):
     offset = (page - 1) * limit
@@ -805,52 +2535,76 @@ async def get_events(
         where_conditions.append("category = ?")
         params.append(category)
     
-    if search:
-        where_conditions.append("(name LIKE ? OR title LIKE ? OR description LIKE ?)")
-        params.extend([f"%{search}%", f"%{search}%", f"%{search}%"])
+    match = fts_query(search)
+    if match and search_available("events"):
+        where_conditions.append("id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)")
+        params.append(match)
+    elif search:
+        search_cols = [c for c in ('name', 'title', 'description') if schema.has('events', c)]
+        where_conditions.append("(" + " OR ".join(f"{c} LIKE ?" for c in search_cols) + ")")
+        params.extend([f"%{search}%"] * len(search_cols))
     
     where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
     
+    # Totals are opt-in for cursor paging; the page/limit API keeps returning them
+    if include_total is None:
+        include_total = cursor is None
+    
     try:
-        events = []
-        total = 0
-        for col in ("start_time", "start_at"):
-            try:
-                rows = Database.execute_query(
-                    f"SELECT * FROM events{where_clause} ORDER BY {col} DESC LIMIT ? OFFSET ?",
-                    tuple(params + [limit, offset]),
-                    fetch_all=True
-                )
-                total_row = Database.execute_query(
-                    f"SELECT COUNT(*) as count FROM events{where_clause}",
-                    tuple(params),
-                    fetch_one=True
-                )
-                total = total_row.get('count', 0) if total_row else 0
-                events = [dict(r) for r in (rows or [])]
-                for ev in events:
-                    if 'title' not in ev and 'name' in ev:
-                        ev['title'] = ev['name']
-                break
-            except Exception:
-                events = []
-                total = 0
+        if cursor:
+            after = decode_cursor(cursor, 2)
+            page_where = where_clause + (" AND " if where_clause else " WHERE ") + "(start_at, id) < (?, ?)"
+            page_params = params + after + [limit + 1]
+            limit_clause = "LIMIT ?"
+        else:
+            page_where = where_clause
+            page_params = params + [limit + 1, offset]
+            limit_clause = "LIMIT ? OFFSET ?"
+        rows = await Database.aexecute(
+            f"SELECT * FROM events{page_where} ORDER BY start_at DESC, id DESC {limit_clause}",
+            tuple(page_params),
+            fetch_all=True
+        )
+        events = [dict(r) for r in (rows or [])]
+        next_cursor = next_page_cursor(events, limit, ("start_at", "id"))
+        total = None
+        if include_total:
+            total = await cached_count("events", f"SELECT COUNT(*) as count FROM events{where_clause}", tuple(params))
+        for ev in events:
+            if 'title' not in ev and 'name' in ev:
+                ev['title'] = ev['name']
 
         return {
             "events": events,
             "total": total,
             "page": page,
-            "limit": limit
+            "limit": limit,
+            "next_cursor": next_cursor
         }
+    except (HTTPException, QueryTimeout):
+        raise
     except Exception as e:
         print(f"Error in get_events: {e}")
         return {
             "events": [],
             "total": 0,
             "page": page,
-            "limit": limit
+            "limit": limit,
+            "next_cursor": None
         }
 
+def event_capacity(value) -> Optional[int]:
+    """max_participants from a request body; empty means unlimited"""
+    if value is None or value == "":
+        return None
+    try:
+        capacity = int(value)
+    except (TypeError, ValueError):
+        capacity = -1
+    if capacity < 0:
+        raise HTTPException(status_code=400, detail="max_participants must be a non-negative number")
+    return capacity
+
 @app.post("/api/events")
 async def create_event(request: Request, user = Depends(require_role(["admin", "teacher"]))):
     data = await request.json()
@@ -860,72 +2614,38 @@ async def create_event(request: Request, user = Depends(require_role(["admin", "
         if not data.get(field):
             raise HTTPException(status_code=400, detail=f"{field} is required")
     
-    conn = Database.get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(events)")
-        ev_cols = [r[1] for r in cur.fetchall()]
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-        conn.close()
-
-    cols = []
-    vals = []
-
-    if 'school_id' in ev_cols:
-        cols.append('school_id')
-        vals.append(user['school_id'])
-
-    if 'name' in ev_cols:
-        cols.append('name')
-        vals.append(data['title'])
-
-    if 'title' in ev_cols:
-        cols.append('title')
-        vals.append(data['title'])
-
-    for c in ('host', 'location', 'category', 'description', 'notes', 'registration_link'):
-        if c in ev_cols:
-            cols.append(c)
-            vals.append(data.get(c, ""))
-
-    if 'start_at' in ev_cols:
-        cols.append('start_at')
-        vals.append(data.get('start_at'))
-    if 'end_at' in ev_cols:
-        cols.append('end_at')
-        vals.append(data.get('end_at'))
-    if 'start_time' in ev_cols and 'start_at' not in ev_cols:
-        cols.append('start_time')
-        vals.append(data.get('start_at'))
-    if 'end_time' in ev_cols and 'end_at' not in ev_cols:
-        cols.append('end_time')
-        vals.append(data.get('end_at'))
-
-    if 'created_by' in ev_cols:
-        cols.append('created_by')
-        vals.append(user.get('id'))
-
-    if not cols:
+    sql, cols = schema.insert_statement(
+        'events',
+        ('school_id', 'name', 'title', 'host', 'location', 'category', 'description', 'notes', 'registration_link',
+         'max_participants', 'start_at', 'end_at', 'created_by')
+    )
+    if not sql:
         raise HTTPException(status_code=500, detail="No valid event columns available to insert")
 
-    placeholders = ', '.join(['?'] * len(cols))
-    sql = f"INSERT INTO events ({', '.join(cols)}) VALUES ({placeholders})"
+    values = {
+        'school_id': user['school_id'],
+        'name': data['title'],
+        'title': data['title'],
+        'start_at': data.get('start_at'),
+        'end_at': data.get('end_at'),
+        'max_participants': event_capacity(data.get('max_participants')),
+        'created_by': user.get('id')
+    }
+    vals = [values[c] if c in values else data.get(c, "") for c in cols]
 
     try:
-        event_id = Database.execute_query(sql, tuple(vals))
-        log_audit(user["id"], "create", "event", event_id)
+        event_id = await Database.aexecute(sql, tuple(vals))
+        await log_audit(user, "create", "event", event_id)
         return {"id": event_id, "message": "Event created"}
+    except QueryTimeout:
+        raise
     except Exception as e:
         print(f"Error creating event: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/events/{event_id}")
 async def get_event(event_id: int, user = Depends(require_auth)):
-    event = Database.execute_query(
+    event = await Database.aexecute(
         "SELECT * FROM events WHERE id = ?",
         (event_id,),
         fetch_one=True
@@ -940,7 +2660,7 @@ async def get_event(event_id: int, user = Depends(require_auth)):
 async def update_event(event_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
     data = await request.json()
     
-    event = Database.execute_query(
+    event = await Database.aexecute(
         "SELECT * FROM events WHERE id = ?",
         (event_id,),
         fetch_one=True
@@ -952,25 +2672,39 @@ async def update_event(event_id: int, request: Request, user = Depends(require_r
     update_fields = []
     params = []
     
+    for field in ("title", "start_at", "end_at"):
+        if field in data and not data[field]:
+            raise HTTPException(status_code=400, detail=f"{field} cannot be empty")
+    
     for field in ["title", "host", "location", "start_at", "end_at", "category", "status", "description", "notes", "registration_link"]:
         if field in data:
             update_fields.append(f"{field} = ?")
             params.append(data[field])
+    if "max_participants" in data:
+        update_fields.append("max_participants = ?")
+        params.append(event_capacity(data["max_participants"]))
     
     if update_fields:
         params.append(event_id)
-        Database.execute_query(
+        await Database.aexecute(
             f"UPDATE events SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
             tuple(params)
         )
         
-        log_audit(user["id"], "update", "event", event_id, data)
+        await log_audit(user, "update", "event", event_id, data)
+        
+        # A larger capacity frees seats for the waitlist; a smaller one only stops new admissions
+        if "max_participants" in data:
+            promoted = await Database.call(registrations.promote_event, event_id)
+            if promoted:
+                await drop_counts("participants")
+                await log_audit(user, "promote_waitlist", "event", event_id, {"participant_ids": promoted})
     
     return {"message": "Event updated"}
 
 @app.delete("/api/events/{event_id}")
 async def delete_event(event_id: int, user = Depends(require_role(["admin"]))):
-    event = Database.execute_query(
+    event = await Database.aexecute(
         "SELECT * FROM events WHERE id = ?",
         (event_id,),
         fetch_one=True
@@ -979,11 +2713,14 @@ async def delete_event(event_id: int, user = Depends(require_role(["admin"]))):
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    Database.execute_query("DELETE FROM events WHERE id = ?", (event_id,))
-    log_audit(user["id"], "delete", "event", event_id)
+    await Database.aexecute("DELETE FROM events WHERE id = ?", (event_id,))
+    await log_audit(user, "delete", "event", event_id)
     
     return {"message": "Event deleted"}
 
+# Shared by create_participant and the bulk CSV import
+PARTICIPANT_REQUIRED_FIELDS = ["first_name", "last_name", "grade", "section", "guardian_name", "guardian_phone"]
+
 @app.get("/api/participants")
 async def get_participants(
     page: int = 1,
@@ -991,6 +2728,8 @@ async def get_participants(
     grade: Optional[int] = None,
     section: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
     user = Depends(require_auth)
 ):
     offset = (page - 1) * limit
@@ -1005,56 +2744,83 @@ async def get_participants(
         where_conditions.append("section = ?")
         params.append(section)
     
-    if search:
+    match = fts_query(search)
+    if match and search_available("participants"):
+        where_conditions.append("id IN (SELECT rowid FROM participants_fts WHERE participants_fts MATCH ?)")
+        params.append(match)
+    elif search:
         where_conditions.append("(first_name LIKE ? OR last_name LIKE ? OR email LIKE ?)")
         params.extend([f"%{search}%", f"%{search}%", f"%{search}%"])
     
     where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
     
-    participants = Database.execute_query(
-        f"SELECT * FROM participants{where_clause} ORDER BY last_name, first_name LIMIT ? OFFSET ?",
-        tuple(params + [limit, offset]),
+    if include_total is None:
+        include_total = cursor is None
+    
+    if cursor:
+        after = decode_cursor(cursor, 3)
+        page_where = where_clause + (" AND " if where_clause else " WHERE ") + "(last_name, first_name, id) > (?, ?, ?)"
+        page_params = params + after + [limit + 1]
+        limit_clause = "LIMIT ?"
+    else:
+        page_where = where_clause
+        page_params = params + [limit + 1, offset]
+        limit_clause = "LIMIT ? OFFSET ?"
+    
+    participants = await Database.aexecute(
+        f"SELECT * FROM participants{page_where} ORDER BY last_name, first_name, id {limit_clause}",
+        tuple(page_params),
         fetch_all=True
     )
+    next_cursor = next_page_cursor(participants, limit, ("last_name", "first_name", "id"))
     
-    total = Database.execute_query(
-        f"SELECT COUNT(*) as count FROM participants{where_clause}",
-        tuple(params),
-        fetch_one=True
-    )
+    total = None
+    if include_total:
+        total = await cached_count("participants", f"SELECT COUNT(*) as count FROM participants{where_clause}", tuple(params))
     
     return {
         "participants": [dict(p) for p in participants],
-        "total": total["count"],
+        "total": total,
         "page": page,
-        "pages": (total["count"] + limit - 1) // limit
+        "pages": (total + limit - 1) // limit if total is not None else None,
+        "next_cursor": next_cursor
     }
 
 @app.post("/api/participants")
 async def create_participant(request: Request, user = Depends(require_role(["admin", "teacher", "student_coordinator"]))):
     data = await request.json()
     
-    required_fields = ["first_name", "last_name", "grade", "section", "guardian_name", "guardian_phone"]
-    for field in required_fields:
+    for field in PARTICIPANT_REQUIRED_FIELDS:
         if not data.get(field):
             raise HTTPException(status_code=400, detail=f"{field} is required")
     
-    participant_id = Database.execute_query(
-        """INSERT INTO participants (first_name, last_name, grade, section, email, 
+    if data.get("event_id"):
+        # Entering someone straight onto an event takes a seat like any other registration
+        fields = {field: data.get(field, "") for field in ("email", "phone", "medical_notes")}
+        fields.update({field: data[field] for field in PARTICIPANT_REQUIRED_FIELDS})
+        result, _ = await Database.call(
+            registrations.run, user["id"], None, "", registrations.register, data["event_id"], user["school_id"], fields
+        )
+        await log_audit(user, "create", "participant", result["participant_id"], {"status": result["status"]})
+        return {"id": result["participant_id"], "status": result["status"], "position": result["position"],
+                "message": "Participant created"}
+    
+    participant_id = await Database.aexecute(
+        """INSERT INTO participants (school_id, event_id, first_name, last_name, grade, section, email, 
            phone, guardian_name, guardian_phone, medical_notes) 
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (data["first_name"], data["last_name"], data["grade"], data["section"],
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (user["school_id"], None, data["first_name"], data["last_name"], data["grade"], data["section"],
          data.get("email", ""), data.get("phone", ""), data["guardian_name"],
          data["guardian_phone"], data.get("medical_notes", ""))
     )
     
-    log_audit(user["id"], "create", "participant", participant_id)
+    await log_audit(user, "create", "participant", participant_id)
     
     return {"id": participant_id, "message": "Participant created"}
 
 @app.get("/api/participants/{participant_id}")
 async def get_participant(participant_id: int, user = Depends(require_auth)):
-    participant = Database.execute_query(
+    participant = await Database.aexecute(
         "SELECT * FROM participants WHERE id = ?",
         (participant_id,),
         fetch_one=True
@@ -1069,7 +2835,7 @@ async def get_participant(participant_id: int, user = Depends(require_auth)):
 async def update_participant(participant_id: int, request: Request, user = Depends(require_role(["admin", "teacher", "student_coordinator"]))):
     data = await request.json()
     
-    participant = Database.execute_query(
+    participant = await Database.aexecute(
         "SELECT * FROM participants WHERE id = ?",
         (participant_id,),
         fetch_one=True
@@ -1088,18 +2854,18 @@ async def update_participant(participant_id: int, request: Request, user = Depen
     
     if update_fields:
         params.append(participant_id)
-        Database.execute_query(
+        await Database.aexecute(
             f"UPDATE participants SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
             tuple(params)
         )
         
-        log_audit(user["id"], "update", "participant", participant_id, data)
+        await log_audit(user, "update", "participant", participant_id, data)
     
     return {"message": "Participant updated"}
 
 @app.delete("/api/participants/{participant_id}")
 async def delete_participant(participant_id: int, user = Depends(require_role(["admin"]))):
-    participant = Database.execute_query(
+    participant = await Database.aexecute(
         "SELECT * FROM participants WHERE id = ?",
         (participant_id,),
         fetch_one=True
@@ -1108,14 +2874,19 @@ async def delete_participant(participant_id: int, user = Depends(require_role(["
     if not participant:
         raise HTTPException(status_code=404, detail="Participant not found")
     
-    Database.execute_query("DELETE FROM participants WHERE id = ?", (participant_id,))
-    log_audit(user["id"], "delete", "participant", participant_id)
+    await Database.aexecute("DELETE FROM participants WHERE id = ?", (participant_id,))
+    await log_audit(user, "delete", "participant", participant_id)
+    
+    if participant["status"] == "registered" and participant["event_id"] is not None:
+        promoted = await Database.call(registrations.promote_event, participant["event_id"])
+        if promoted:
+            await log_audit(user, "promote_waitlist", "event", participant["event_id"], {"participant_ids": promoted})
     
     return {"message": "Participant deleted"}
 
 @app.get("/api/events/{event_id}/teams")
 async def get_event_teams(event_id: int, user = Depends(require_auth)):
-    teams = Database.execute_query(
+    teams = await Database.aexecute(
         """SELECT t.*, u.name as coach_name 
            FROM teams t 
            LEFT JOIN users u ON t.coach_user_id = u.id 
@@ -1133,19 +2904,19 @@ async def create_team(event_id: int, request: Request, user = Depends(require_ro
     if not data.get("name"):
         raise HTTPException(status_code=400, detail="Team name is required")
     
-    team_id = Database.execute_query(
-        "INSERT INTO teams (event_id, name, coach_user_id, max_size, notes) VALUES (?, ?, ?, ?, ?)",
+    team_id = await Database.aexecute(
+        "INSERT INTO teams (event_id, name, coach_user_id, max_size, notes, created_by) VALUES (?, ?, ?, ?, ?, ?)",
         (event_id, data["name"], data.get("coach_user_id"), 
-         data.get("max_size", 10), data.get("notes", ""))
+         data.get("max_size", 10), data.get("notes", ""), user["id"])
     )
     
-    log_audit(user["id"], "create", "team", team_id)
+    await log_audit(user, "create", "team", team_id)
     
     return {"id": team_id, "message": "Team created"}
 
 @app.get("/api/teams/{team_id}/members")
 async def get_team_members(team_id: int, user = Depends(require_auth)):
-    members = Database.execute_query(
+    members = await Database.aexecute(
         """SELECT p.*, tm.role 
            FROM participants p 
            JOIN team_members tm ON p.id = tm.participant_id 
@@ -1166,7 +2937,7 @@ async def add_team_member(team_id: int, request: Request, user = Depends(require
     if not participant_id:
         raise HTTPException(status_code=400, detail="Participant ID is required")
     
-    existing = Database.execute_query(
+    existing = await Database.aexecute(
         "SELECT * FROM team_members WHERE team_id = ? AND participant_id = ?",
         (team_id, participant_id),
         fetch_one=True
@@ -1175,26 +2946,30 @@ async def add_team_member(team_id: int, request: Request, user = Depends(require
     if existing:
         raise HTTPException(status_code=400, detail="Participant already in team")
     
-    Database.execute_query(
+    await Database.aexecute(
         "INSERT INTO team_members (team_id, participant_id, role) VALUES (?, ?, ?)",
         (team_id, participant_id, role)
     )
     
-    log_audit(user["id"], "add_member", "team", team_id, {"participant_id": participant_id})
+    await log_audit(user, "add_member", "team", team_id, {"participant_id": participant_id})
     
     return {"message": "Member added to team"}
 
 @app.delete("/api/teams/{team_id}/members/{participant_id}")
 async def remove_team_member(team_id: int, participant_id: int, user = Depends(require_role(["admin", "teacher"]))):
-    Database.execute_query(
+    await Database.aexecute(
         "DELETE FROM team_members WHERE team_id = ? AND participant_id = ?",
         (team_id, participant_id)
     )
     
-    log_audit(user["id"], "remove_member", "team", team_id, {"participant_id": participant_id})
+    await log_audit(user, "remove_member", "team", team_id, {"participant_id": participant_id})
     
     return {"message": "Member removed from team"}
 
+# routes.py imports from this module, so it is pulled in once everything above exists
+from routes import router
+app.include_router(router)
+
 css_dir = FRONTEND_DIR / "css"
 js_dir = FRONTEND_DIR / "js"
 static_dir = FRONTEND_DIR
@@ -1249,7 +3024,7 @@ async def read_school_dashboard(
     user: dict = Depends(require_auth)
 ):
     try:
-        school = Database.execute_query(
+        school = await Database.aexecute(
             """
             SELECT 
                 id, name, code, admin_email, 
@@ -1280,6 +3055,8 @@ async def read_school_dashboard(
                 "school": school_data
             }
         )
+    except QueryTimeout:
+        raise
     except Exception as e:
         import traceback
         print(f"Error in read_school_dashboard: {str(e)}")
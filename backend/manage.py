@@ -0,0 +1,604 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+import random
+import sqlite3
+import sys
+import time
+
+from main import DB_PATH, Database, QueryTimeout, app, password_hasher, migrator, audit_archive, registrations, SEARCH_INDEXES, fts_query
+from routes import SCHEDULE_COLUMNS, schedule_conflicts, overlap_sweep, shift_time
+
+# Representative statements for the hot endpoints, with sample parameters.
+# Keep this in step with the queries in main.py and routes.py.
+HOT_QUERIES = [
+    ("get_events", "SELECT * FROM events ORDER BY start_at DESC, id DESC LIMIT ? OFFSET ?", (11, 0)),
+    ("get_events status", "SELECT * FROM events WHERE status = ? ORDER BY start_at DESC, id DESC LIMIT ? OFFSET ?", ("upcoming", 11, 0)),
+    ("get_events category", "SELECT * FROM events WHERE category = ? ORDER BY start_at DESC, id DESC LIMIT ? OFFSET ?", ("sports", 11, 0)),
+    ("get_events cursor", "SELECT * FROM events WHERE (start_at, id) < (?, ?) ORDER BY start_at DESC, id DESC LIMIT ?", ("2030-01-01", 1, 11)),
+    ("get_event", "SELECT * FROM events WHERE id = ?", (1,)),
+    ("dashboard stats", "SELECT (SELECT COUNT(*) FROM events WHERE school_id = ?) as total_events, (SELECT COUNT(*) FROM participants WHERE school_id = ?) as total_participants, (SELECT COUNT(*) FROM teams t JOIN events e ON t.event_id = e.id WHERE e.school_id = ?) as total_teams, (SELECT COUNT(*) FROM tasks WHERE school_id = ? AND status = 'pending') as pending_tasks", (1, 1, 1, 1)),
+    ("dashboard upcoming events", "SELECT * FROM events WHERE school_id = ? AND start_at > datetime('now') ORDER BY start_at LIMIT 5", (1,)),
+    ("dashboard announcements", "SELECT * FROM announcements WHERE school_id = ? ORDER BY created_at DESC LIMIT 5", (1,)),
+    ("dashboard tasks", "SELECT * FROM tasks WHERE school_id = ? AND status = 'pending' ORDER BY due_at LIMIT 5", (1,)),
+    ("get_participants", "SELECT * FROM participants ORDER BY last_name, first_name, id LIMIT ? OFFSET ?", (21, 0)),
+    ("get_participants cursor", "SELECT * FROM participants WHERE (last_name, first_name, id) > (?, ?, ?) ORDER BY last_name, first_name, id LIMIT ?", ("A", "B", 1, 21)),
+    ("participants export", "SELECT * FROM participants WHERE school_id = ? ORDER BY last_name, first_name, id", (1,)),
+    ("participants export event", "SELECT * FROM participants WHERE school_id = ? AND event_id = ? ORDER BY last_name, first_name, id", (1, 1)),
+    ("events export", "SELECT * FROM events WHERE school_id = ? ORDER BY start_at DESC, id DESC", (1,)),
+    ("events export status", "SELECT * FROM events WHERE school_id = ? AND status = ? ORDER BY start_at DESC, id DESC", (1, "upcoming")),
+    ("event participants", "SELECT * FROM participants WHERE event_id = ?", (1,)),
+    ("team members", "SELECT p.*, tm.role FROM participants p JOIN team_members tm ON p.id = tm.participant_id WHERE tm.team_id = ?", (1,)),
+    ("student teams", "SELECT t.*, e.title as event_title FROM teams t JOIN events e ON t.event_id = e.id JOIN team_members tm ON t.id = tm.team_id JOIN participants p ON tm.participant_id = p.id WHERE p.user_id = ? AND e.school_id = ?", (1, 1)),
+    ("event teams", "SELECT * FROM teams WHERE event_id = ?", (1,)),
+    ("event tasks", "SELECT * FROM tasks WHERE event_id = ? ORDER BY due_at", (1,)),
+    ("event announcements", "SELECT * FROM announcements WHERE event_id = ? OR event_id IS NULL ORDER BY created_at DESC", (1,)),
+    ("event schedules", "SELECT * FROM schedules WHERE event_id = ? ORDER BY start_at", (1,)),
+    ("participant calendar", "SELECT s.*, e.title as event_title FROM schedules s JOIN events e ON s.event_id = e.id WHERE e.school_id = ? AND s.event_id IN (SELECT t.event_id FROM teams t JOIN team_members tm ON tm.team_id = t.id WHERE tm.participant_id = ?) ORDER BY s.start_at, s.id", (1, 1)),
+    ("school calendar validators", "SELECT COUNT(*) as count, TOTAL(s.id) as id_sum, MAX(s.updated_at) as schedules_at, MAX(e.updated_at) as events_at FROM schedules s JOIN events e ON s.event_id = e.id WHERE e.school_id = ?", (1,)),
+    ("schedule venue slot", "SELECT id FROM schedules WHERE school_id = ? AND venue = ? AND start_at >= ? AND start_at < ? AND id != ? ORDER BY start_at LIMIT ?", (1, "Hall", "2030-01-01T09:00:00", "2030-01-01T10:00:00", 0, 20)),
+    ("schedule venue previous", "SELECT id FROM schedules WHERE school_id = ? AND venue = ? AND start_at < ? AND id != ? ORDER BY start_at DESC LIMIT 1", (1, "Hall", "2030-01-01T09:00:00", 0)),
+    ("schedule team slot", "SELECT id FROM schedules WHERE team_id = ? AND start_at >= ? AND start_at < ? AND id != ? ORDER BY start_at LIMIT ?", (1, "2030-01-01T09:00:00", "2030-01-01T10:00:00", 0, 20)),
+    ("schedule overlap flag", "SELECT 1 FROM schedule_overlap_scopes WHERE school_id = ? AND kind = ? AND scope_key = ?", (1, "venue", "Hall")),
+    ("schedule venue flagged scan", "SELECT id FROM schedules WHERE school_id = ? AND venue = ? AND start_at < ? AND end_at > ? AND id != ? ORDER BY start_at LIMIT ?", (1, "Hall", "2030-01-01T10:00:00", "2030-01-01T09:00:00", 0, 20)),
+    ("schedule conflicts report", "SELECT id FROM schedules WHERE school_id = ? AND event_id = ? ORDER BY venue, start_at", (1, 1)),
+    ("event seats", "SELECT e.max_participants, (SELECT COUNT(*) FROM participants p WHERE p.event_id = e.id AND p.status = 'registered') as taken FROM events e WHERE e.id = ?", (1,)),
+    ("waitlist head", "SELECT id FROM participants WHERE event_id = ? AND status = 'waitlisted' ORDER BY registration_date, id LIMIT ?", (1, 5)),
+    ("waitlist position", "SELECT COUNT(*) FROM participants WHERE event_id = ? AND status = 'waitlisted' AND (registration_date, id) <= (?, ?)", (1, "2030-01-01 00:00:00", 1)),
+    ("idempotency key", "SELECT fingerprint, response_json FROM idempotency_keys WHERE user_id = ? AND key = ?", (1, "key")),
+    ("event logistics", "SELECT * FROM logistics WHERE event_id = ? ORDER BY created_at", (1,)),
+    ("audit log", "SELECT a.*, u.name as user_name FROM audit_log a LEFT JOIN users u ON a.user_id = u.id ORDER BY a.created_at DESC, a.id DESC LIMIT ?", (51,)),
+    ("audit log cursor", "SELECT a.*, u.name as user_name FROM audit_log a LEFT JOIN users u ON a.user_id = u.id WHERE (a.created_at, a.id) < (?, ?) ORDER BY a.created_at DESC, a.id DESC LIMIT ?", ("2030-01-01", 1, 51)),
+    ("audit log user", "SELECT a.*, u.name as user_name FROM audit_log a LEFT JOIN users u ON a.user_id = u.id WHERE a.user_id = ? AND a.created_at >= ? ORDER BY a.created_at DESC, a.id DESC LIMIT ?", (1, "2025-01-01", 51)),
+    ("audit segments", "SELECT * FROM audit_segments WHERE min_created_at <= ? ORDER BY max_created_at DESC, max_id DESC", ("2030-01-01",)),
+    ("audit archive months", "SELECT substr(created_at, 1, 7) as month, COUNT(*) as count FROM audit_log WHERE created_at < ? GROUP BY month ORDER BY month", ("2025-01-01 00:00:00",)),
+    ("get_events search", "SELECT * FROM events WHERE id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?) ORDER BY start_at DESC, id DESC LIMIT ? OFFSET ?", ('"sci"*', 11, 0)),
+    ("get_participants search", "SELECT * FROM participants WHERE id IN (SELECT rowid FROM participants_fts WHERE participants_fts MATCH ?) ORDER BY last_name, first_name, id LIMIT ? OFFSET ?", ('"smi"*', 21, 0)),
+    ("search events", "SELECT e.id, bm25(events_fts) as score FROM events_fts JOIN events e ON e.id = events_fts.rowid WHERE events_fts MATCH ? AND e.school_id = ? ORDER BY score LIMIT ?", ('"sci"*', 1, 10)),
+    ("search participants", "SELECT e.id, bm25(participants_fts) as score FROM participants_fts JOIN participants e ON e.id = participants_fts.rowid WHERE participants_fts MATCH ? AND e.school_id = ? ORDER BY score LIMIT ?", ('"smi"*', 1, 10)),
+    ("current user", "SELECT u.*, s.name as school_name, s.code as school_code FROM users u JOIN schools s ON u.school_id = s.id WHERE u.id = ?", (1,)),
+    ("validate school code", "SELECT name FROM schools WHERE code = ? AND status = 'active'", ("ABCDEFGH",)),
+]
+
+def explain(queries=HOT_QUERIES):
+    """Return (name, plan rows, full table scans) for every query"""
+    conn = Database.get_connection()
+    try:
+        results = []
+        for name, query, params in queries:
+            plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+            # "SCAN t USING INDEX ..." walks an index in order and stops at the LIMIT;
+            # a bare "SCAN t" reads the whole table. SCAN CONSTANT ROW is a FROM-less SELECT,
+            # and "VIRTUAL TABLE INDEX" is an FTS5 MATCH lookup.
+            scans = [
+                detail for detail in plan
+                if detail.startswith("SCAN ") and " USING " not in detail and detail != "SCAN CONSTANT ROW"
+                and " VIRTUAL TABLE INDEX " not in detail
+            ]
+            results.append((name, plan, scans))
+        return results
+    finally:
+        conn.close()
+
+def cmd_explain(args):
+    failures = 0
+    for name, plan, scans in explain():
+        if scans:
+            failures += 1
+        if scans or args.verbose:
+            print(f"{'SCAN' if scans else 'ok  '}  {name}")
+            for detail in plan:
+                print(f"        {detail}")
+    print(f"{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} queries use an index")
+    return 1 if failures else 0
+
+def cmd_status(args):
+    conn = sqlite3.connect(migrator.path)
+    try:
+        print(f"Current schema version: {migrator.current_version(conn)}")
+        pending = migrator.pending(conn)
+    finally:
+        conn.close()
+    for migration in pending:
+        print(f"  pending  {migration.name}: {migration.description}")
+    if not pending:
+        print("Schema is up to date")
+    return 0
+
+def cmd_migrate(args):
+    applied = migrator.migrate(dry_run=args.dry_run, target=args.target)
+    if not applied:
+        print("Schema is up to date")
+    for migration, statements in applied:
+        if args.dry_run:
+            print(f"-- {migration.name}: {migration.description}")
+            for statement in statements:
+                # Skip the introspection the migrations do to decide what to change
+                if statement.lstrip().upper().startswith(("PRAGMA", "SELECT")):
+                    continue
+                print(" ".join(statement.split()) + ";")
+    if args.dry_run:
+        print(f"Dry run: {len(applied)} migration(s) would be applied, nothing was changed")
+    return 0
+
+def cmd_archive_audit(args):
+    if args.retention_days is not None:
+        audit_archive.retention_days = args.retention_days
+    pending = audit_archive.pending_months()
+    print(f"Archiving audit records older than {audit_archive.cutoff()} to {audit_archive.directory}")
+    for month in pending:
+        if args.dry_run:
+            print(f"  would archive  {month['month']}: {month['count']} record(s)")
+            continue
+        result = audit_archive.archive_month(month["month"])
+        if result:
+            print(f"  archived  {result['month']}: {result['rows']} record(s) -> {result['path']}")
+    if not pending:
+        print("Nothing to archive")
+    if not args.dry_run:
+        for path in audit_archive.purge():
+            print(f"  purged  {path}")
+    return 0
+
+def cmd_rebuild_fts(args):
+    conn = Database.get_connection()
+    try:
+        for table, (fts, _) in SEARCH_INDEXES.items():
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone():
+                print(f"  missing  {fts}: run migrate on a SQLite build with FTS5")
+                continue
+            started = time.monotonic()
+            conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+            conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+            conn.commit()
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            print(f"  rebuilt  {fts}: {count} row(s) in {(time.monotonic() - started) * 1000:.0f} ms")
+    finally:
+        conn.close()
+    return 0
+
+# The LIKE filters the list endpoints used before the FTS indexes existed
+LIKE_SEARCHES = {
+    "events": "SELECT id FROM events WHERE (title LIKE ? OR description LIKE ?) ORDER BY start_at DESC, id DESC LIMIT 11",
+    "participants": "SELECT id FROM participants WHERE (first_name LIKE ? OR last_name LIKE ? OR email LIKE ?) ORDER BY last_name, first_name, id LIMIT 21",
+}
+FTS_SEARCHES = {
+    "events": "SELECT id FROM events WHERE id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?) ORDER BY start_at DESC, id DESC LIMIT 11",
+    "participants": "SELECT id FROM participants WHERE id IN (SELECT rowid FROM participants_fts WHERE participants_fts MATCH ?) ORDER BY last_name, first_name, id LIMIT 21",
+}
+
+def cmd_bench_search(args):
+    match = fts_query(args.query)
+    if not match:
+        print("Query has no searchable words")
+        return 1
+    conn = Database.get_connection()
+    try:
+        for table in SEARCH_INDEXES:
+            like = LIKE_SEARCHES[table]
+            timings = {}
+            for label, query, params in (
+                ("like", like, (f"%{args.query}%",) * like.count("?")),
+                ("fts", FTS_SEARCHES[table], (match,))
+            ):
+                started = time.monotonic()
+                for _ in range(args.runs):
+                    rows = conn.execute(query, params).fetchall()
+                timings[label] = ((time.monotonic() - started) * 1000 / args.runs, len(rows))
+            print(
+                f"{table:<13} like {timings['like'][0]:8.2f} ms ({timings['like'][1]} rows)"
+                f"   fts {timings['fts'][0]:8.2f} ms ({timings['fts'][1]} rows)"
+            )
+    finally:
+        conn.close()
+    return 0
+
+def cmd_bench_schedules(args):
+    """Time conflict checks against a synthetic timetable, inserted in a transaction that is rolled back"""
+    rng = random.Random(args.seed)
+    venues = [f"Bench venue {n}" for n in range(args.venues)]
+    conn = Database.get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        school = conn.execute("SELECT id FROM schools ORDER BY id LIMIT 1").fetchone()
+        school_id = school["id"] if school else 1
+        # One-hour bookings back to back with random gaps, so nothing overlaps within a venue
+        clock = {venue: "2030-01-01T08:00:00" for venue in venues}
+        values = []
+        for n in range(args.rows):
+            venue = venues[n % args.venues]
+            start = shift_time(clock[venue], rng.choice((0, 0, 1800, 3600)))
+            clock[venue] = shift_time(start, 3600)
+            values.append((0, school_id, "Bench", venue, start, clock[venue]))
+        started = time.monotonic()
+        conn.executemany(
+            "INSERT INTO schedules (event_id, school_id, title, venue, start_at, end_at) VALUES (?, ?, ?, ?, ?, ?)",
+            values
+        )
+        print(f"inserted {args.rows} schedules over {args.venues} venues in {(time.monotonic() - started) * 1000:.0f} ms")
+
+        probes = []
+        for _ in range(args.checks):
+            _, _, _, venue, start, _ = rng.choice(values)
+            start = shift_time(start, rng.choice((-1800, 0, 900)))
+            probes.append((venue, start, shift_time(start, 3600)))
+
+        started = time.monotonic()
+        found = sum(len(schedule_conflicts(conn, school_id, venue, None, start, end)) for venue, start, end in probes)
+        indexed = (time.monotonic() - started) * 1000 / args.checks
+        started = time.monotonic()
+        scanned = 0
+        for venue, start, end in probes:
+            scanned += len(conn.execute(
+                "SELECT id FROM schedules NOT INDEXED WHERE school_id = ? AND venue = ? AND start_at < ? AND end_at > ?",
+                (school_id, venue, end, start)
+            ).fetchall())
+        scan = (time.monotonic() - started) * 1000 / args.checks
+        print(f"conflict check  indexed {indexed:8.3f} ms   table scan {scan:8.3f} ms   ({found}/{scanned} conflicts over {args.checks} checks)")
+
+        started = time.monotonic()
+        everything = [dict(row) for row in conn.execute(
+            f"SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE school_id = ? ORDER BY venue, start_at", (school_id,)
+        )]
+        pairs = overlap_sweep(everything, "venue")
+        print(f"conflict report {(time.monotonic() - started) * 1000:8.1f} ms for {len(everything)} schedules ({len(pairs)} overlaps)")
+    finally:
+        conn.rollback()
+        conn.close()
+    return 0
+
+# A request's worth of reads for the pool benchmark: an event page for a signed-in user
+POOL_MIX = ("current user", "get_event", "event schedules", "event participants", "dashboard stats")
+
+def connect_per_query(query, params):
+    """How execute_query ran before the pool: a fresh connection for every statement"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(query, params)
+        conn.commit()
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def pooled_query(query, params):
+    return Database.execute_query(query, params, fetch_all=True)
+
+def cmd_bench_pool(args):
+    """Compare query throughput with a connection per query and through the connection pool"""
+    Database.initialize()
+    queries = {name: (query, params) for name, query, params in HOT_QUERIES}
+    mix = [queries[name] for name in POOL_MIX] * (args.requests // len(POOL_MIX))
+    rates = {}
+    for label, run in (("connect per query", connect_per_query), ("pooled", pooled_query)):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            # Warm up, so the pooled run does not pay for opening its connections
+            list(executor.map(lambda q: run(*q), mix[:args.concurrency * 2]))
+            started = time.monotonic()
+            list(executor.map(lambda q: run(*q), mix))
+            elapsed = time.monotonic() - started
+        rates[label] = len(mix) / elapsed
+        print(f"{label:<18} {len(mix)} queries on {args.concurrency} threads in {elapsed:.2f} s ({rates[label]:,.0f} queries/s)")
+    Database.close_pool()
+    print(f"pool speedup {rates['pooled'] / rates['connect per query']:.1f}x")
+    return 0
+
+# Counts forever, so it only ends when the query timeout aborts it
+RUNAWAY_QUERY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+async def watch_loop(stop, interval=0.005):
+    """Sleep in short ticks and record how late each one wakes up: the time the loop was blocked"""
+    lags = []
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - started - interval) * 1000)
+    return lags
+
+async def run_timeouts(args):
+    query, params = next((query, params) for name, query, params in HOT_QUERIES if name == "get_event")
+    if args.inline:
+        async def execute(query, params, timeout):
+            return Database.execute_query(query, params, fetch_all=True, timeout=timeout)
+    else:
+        async def execute(query, params, timeout):
+            return await Database.aexecute(query, params, fetch_all=True, timeout=timeout)
+
+    async def runaway():
+        try:
+            await execute(RUNAWAY_QUERY, (), args.timeout)
+            return False
+        except QueryTimeout:
+            return True
+
+    async def fast(latencies, stop):
+        while not stop.is_set():
+            started = time.monotonic()
+            await execute(query, params, None)
+            latencies.append((time.monotonic() - started) * 1000)
+            await asyncio.sleep(0)
+
+    stop = asyncio.Event()
+    latencies = []
+    watcher = asyncio.create_task(watch_loop(stop))
+    clients = [asyncio.create_task(fast(latencies, stop)) for _ in range(args.fast)]
+    started = time.monotonic()
+    timed_out = await asyncio.gather(*(runaway() for _ in range(args.slow)))
+    elapsed = time.monotonic() - started
+    stop.set()
+    await asyncio.gather(*clients)
+    return sum(timed_out), elapsed, latencies, await watcher
+
+def cmd_bench_timeouts(args):
+    """Run runaway queries alongside fast ones and report event loop lag and fast query latency"""
+    Database.initialize()
+    try:
+        timed_out, elapsed, latencies, lags = asyncio.run(run_timeouts(args))
+    finally:
+        Database.shutdown_executor()
+        Database.close_pool()
+    mode = "inline on the event loop" if args.inline else "on the database executor"
+    print(f"{args.slow} runaway queries ({args.timeout}s timeout) and {args.fast} fast clients {mode}, {elapsed:.2f} s")
+    print(f"timed out       {timed_out}/{args.slow}")
+    print(f"fast queries    {len(latencies)}   p50 {percentile(latencies, 0.5):7.2f} ms   p99 {percentile(latencies, 0.99):7.2f} ms")
+    print(f"event loop lag  p50 {percentile(lags, 0.5):7.2f} ms   p99 {percentile(lags, 0.99):7.2f} ms   max {max(lags, default=0):7.2f} ms")
+
+    response = asyncio.run(app.exception_handlers[QueryTimeout](None, QueryTimeout("bench")))
+    print(f"QueryTimeout -> HTTP {response.status_code}")
+    problems = []
+    if timed_out != args.slow:
+        problems.append(f"{args.slow - timed_out} of {args.slow} runaway queries finished without a QueryTimeout")
+    if not args.inline and max(lags, default=0) > args.max_lag:
+        problems.append(f"event loop stalled for {max(lags):.0f} ms, over the {args.max_lag:.0f} ms budget")
+    if response.status_code != 504:
+        problems.append(f"QueryTimeout maps to {response.status_code}, expected 504")
+    for problem in problems:
+        print(f"FAIL  {problem}")
+    return 1 if problems else 0
+
+async def asgi_post(path, payload):
+    """POST a JSON body straight into the ASGI app and return the response status"""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    statuses = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+async def run_logins(args, email, password):
+    peak = 0
+
+    async def watch_pending(stop):
+        nonlocal peak
+        while not stop.is_set():
+            peak = max(peak, password_hasher.stats()["pending"])
+            await asyncio.sleep(0.001)
+
+    stop = asyncio.Event()
+    watchers = [asyncio.create_task(watch_loop(stop)), asyncio.create_task(watch_pending(stop))]
+    started = time.monotonic()
+    statuses = await asyncio.gather(*(
+        asgi_post("/api/auth/signin", {"email": email, "password": password}) for _ in range(args.requests)
+    ))
+    elapsed = time.monotonic() - started
+    stop.set()
+    lags, _ = await asyncio.gather(*watchers)
+    return statuses, elapsed, lags, peak
+
+def cmd_stress_logins(args):
+    """Fire a burst of signins at a scratch user and check the hash pool sheds the excess with 503s"""
+    password = secrets.token_urlsafe(12)
+    email = f"stress-login-{secrets.token_hex(4)}@example.invalid"
+    with Database.transaction() as conn:
+        school_id = conn.execute(
+            "INSERT INTO schools (name, code, admin_email) VALUES ('Login stress test', ?, ?)",
+            (f"STRESS-{secrets.token_hex(4)}", email)
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO users (school_id, name, email, password_hash, role) VALUES (?, 'Login stress test', ?, ?, 'student')",
+            (school_id, email, password_hasher._hash(password))
+        )
+    try:
+        statuses, elapsed, lags, peak = asyncio.run(run_logins(args, email, password))
+    finally:
+        with Database.transaction() as conn:
+            conn.execute("DELETE FROM users WHERE school_id = ?", (school_id,))
+            conn.execute("DELETE FROM schools WHERE id = ?", (school_id,))
+        password_hasher.shutdown()
+        Database.shutdown_executor()
+        Database.close_pool()
+
+    counts = {status: statuses.count(status) for status in sorted(set(statuses))}
+    limit = password_hasher.queue_limit
+    print(f"{args.requests} concurrent signins in {elapsed:.2f} s "
+          f"({password_hasher.workers} hash workers, queue limit {limit}, {password_hasher.rounds} rounds)")
+    print("responses       " + "   ".join(f"{status}: {count}" for status, count in counts.items()))
+    print(f"peak pending    {peak}")
+    print(f"event loop lag  p50 {percentile(lags, 0.5):7.2f} ms   p99 {percentile(lags, 0.99):7.2f} ms   max {max(lags, default=0):7.2f} ms")
+    problems = []
+    if set(counts) - {200, 503}:
+        problems.append(f"unexpected responses {sorted(set(counts) - {200, 503})}")
+    if args.requests > limit and not counts.get(503):
+        problems.append(f"{args.requests} signins over a queue limit of {limit} were all queued, none shed")
+    if peak > limit:
+        problems.append(f"{peak} hashes pending, over the queue limit of {limit}")
+    if max(lags, default=0) > args.max_lag:
+        problems.append(f"event loop stalled for {max(lags):.0f} ms, over the {args.max_lag:.0f} ms budget")
+    for problem in problems:
+        print(f"FAIL  {problem}")
+    if not problems:
+        print("OK    excess signins were shed with 503")
+    return 1 if problems else 0
+
+def registration_worker(job):
+    """One stress-registrations worker: register (retrying some keys), cancel some, report what it saw"""
+    worker, event_id, school_id, attempts, naive = job
+    rng = random.Random(worker)
+    seen = {}
+    mismatched = 0
+    for attempt in range(attempts):
+        participant = {"first_name": f"Stress {worker}", "last_name": str(attempt), "grade": "1", "section": "A",
+                       "guardian_name": "-", "guardian_phone": "-"}
+        if naive:
+            # Check-then-insert without a write lock: the count can be stale by the time the row lands
+            conn = Database.get_connection()
+            try:
+                capacity, taken = registrations.seats(conn, event_id)
+                status = "registered" if taken < capacity else "waitlisted"
+                conn.execute(
+                    "INSERT INTO participants (school_id, event_id, first_name, last_name, status) VALUES (?, ?, ?, ?, ?)",
+                    (school_id, event_id, participant["first_name"], participant["last_name"], status)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            continue
+        key = f"stress-{worker}-{attempt}"
+        for _ in range(2 if rng.random() < 0.3 else 1):
+            result, _ = registrations.run(0, key, key, registrations.register, event_id, school_id, participant)
+            if seen.setdefault(key, result["participant_id"]) != result["participant_id"]:
+                mismatched += 1
+        if rng.random() < 0.1:
+            registrations.run(0, None, "", registrations.cancel, seen[key], school_id)
+    return len(seen), mismatched
+
+def cmd_stress_registrations(args):
+    """Race workers for the seats of a scratch event, then check nothing was oversold"""
+    with Database.transaction() as conn:
+        school = conn.execute("SELECT id FROM schools ORDER BY id LIMIT 1").fetchone()
+        school_id = school["id"] if school else 1
+        event_id = conn.execute(
+            "INSERT INTO events (school_id, title, host, location, category, start_at, end_at, max_participants) "
+            "VALUES (?, 'Registration stress test', '-', '-', 'other', '2030-01-01T09:00:00', '2030-01-01T10:00:00', ?)",
+            (school_id, args.capacity)
+        ).lastrowid
+    try:
+        started = time.monotonic()
+        with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+            results = pool.map(
+                registration_worker,
+                [(worker, event_id, school_id, args.attempts, args.naive) for worker in range(args.workers)]
+            )
+        elapsed = time.monotonic() - started
+        conn = Database.get_connection()
+        try:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM participants WHERE event_id = ? GROUP BY status", (event_id,)
+            ).fetchall())
+        finally:
+            conn.close()
+    finally:
+        with Database.transaction() as conn:
+            conn.execute("DELETE FROM participants WHERE event_id = ?", (event_id,))
+            conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+            conn.execute("DELETE FROM idempotency_keys WHERE user_id = 0 AND key LIKE 'stress-%'")
+
+    registered, waitlisted = counts.get("registered", 0), counts.get("waitlisted", 0)
+    rows = sum(counts.values())
+    attempts = args.workers * args.attempts
+    print(f"{attempts} registrations from {args.workers} workers in {elapsed:.2f} s ({attempts / elapsed:.0f}/s)")
+    print(f"capacity {args.capacity}: registered {registered}, waitlisted {waitlisted}, cancelled {counts.get('cancelled', 0)}")
+    problems = []
+    if registered > args.capacity:
+        problems.append(f"oversold by {registered - args.capacity}")
+    if waitlisted and registered < args.capacity:
+        problems.append(f"{args.capacity - registered} free seat(s) with people still waiting")
+    if not args.naive:
+        if rows != attempts:
+            problems.append(f"{rows} participant rows for {attempts} idempotency keys")
+        if any(mismatched for _, mismatched in results):
+            problems.append("a retried key returned a different participant")
+    for problem in problems:
+        print(f"FAIL  {problem}")
+    if not problems:
+        print("OK    no overbooking")
+    return 1 if problems else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Arista maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    explain_parser = commands.add_parser("explain", help="Flag hot queries that fall back to full table scans")
+    explain_parser.add_argument("-v", "--verbose", action="store_true", help="Print every query plan")
+    explain_parser.set_defaults(func=cmd_explain)
+
+    status_parser = commands.add_parser("status", help="Show the schema version and pending migrations")
+    status_parser.set_defaults(func=cmd_status)
+
+    migrate_parser = commands.add_parser("migrate", help="Apply pending migrations")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="Print the SQL each pending migration would run, then roll back")
+    migrate_parser.add_argument("--target", type=int, help="Stop after this schema version")
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    archive_parser = commands.add_parser("archive-audit", help="Move old audit months into compressed archive segments")
+    archive_parser.add_argument("--retention-days", type=int, help="Keep this many days live (default ARISTA_AUDIT_RETENTION_DAYS)")
+    archive_parser.add_argument("--dry-run", action="store_true", help="List the months that would be archived")
+    archive_parser.set_defaults(func=cmd_archive_audit)
+
+    rebuild_parser = commands.add_parser("rebuild-fts", help="Rebuild and optimize the full-text search indexes")
+    rebuild_parser.set_defaults(func=cmd_rebuild_fts)
+
+    bench_parser = commands.add_parser("bench-search", help="Time a search through LIKE and through the FTS indexes")
+    bench_parser.add_argument("query", help="Search text, as typed into a search box")
+    bench_parser.add_argument("--runs", type=int, default=20, help="Repetitions per query")
+    bench_parser.set_defaults(func=cmd_bench_search)
+
+    schedules_parser = commands.add_parser("bench-schedules", help="Time schedule conflict checks on a synthetic timetable")
+    schedules_parser.add_argument("--rows", type=int, default=100_000, help="Schedules to generate")
+    schedules_parser.add_argument("--venues", type=int, default=50, help="Venues to spread them over")
+    schedules_parser.add_argument("--checks", type=int, default=2000, help="Conflict checks to time")
+    schedules_parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    schedules_parser.set_defaults(func=cmd_bench_schedules)
+
+    pool_parser = commands.add_parser("bench-pool", help="Compare query throughput with and without the connection pool")
+    pool_parser.add_argument("--requests", type=int, default=20_000, help="Queries to run in each mode")
+    pool_parser.add_argument("--concurrency", type=int, default=8, help="Threads issuing queries")
+    pool_parser.set_defaults(func=cmd_bench_pool)
+
+    timeouts_parser = commands.add_parser("bench-timeouts", help="Measure event loop lag while runaway queries hit their timeout")
+    timeouts_parser.add_argument("--slow", type=int, default=4, help="Runaway queries to start")
+    timeouts_parser.add_argument("--fast", type=int, default=4, help="Clients issuing fast queries meanwhile")
+    timeouts_parser.add_argument("--timeout", type=float, default=2.0, help="Timeout for the runaway queries, in seconds")
+    timeouts_parser.add_argument("--max-lag", type=float, default=100.0, help="Fail if the event loop stalls longer than this, in ms")
+    timeouts_parser.add_argument("--inline", action="store_true", help="Run queries on the event loop, to show the stall the executor avoids")
+    timeouts_parser.set_defaults(func=cmd_bench_timeouts)
+
+    logins_parser = commands.add_parser("stress-logins", help="Burst signins at a scratch user and check the hash pool sheds load")
+    logins_parser.add_argument("--requests", type=int, default=200, help="Concurrent signins to fire")
+    logins_parser.add_argument("--max-lag", type=float, default=100.0, help="Fail if the event loop stalls longer than this, in ms")
+    logins_parser.set_defaults(func=cmd_stress_logins)
+
+    stress_parser = commands.add_parser("stress-registrations", help="Race concurrent registrations for a scratch event and check capacity held")
+    stress_parser.add_argument("--workers", type=int, default=16, help="Worker processes")
+    stress_parser.add_argument("--attempts", type=int, default=100, help="Registrations per worker")
+    stress_parser.add_argument("--capacity", type=int, default=50, help="Seats on the scratch event")
+    stress_parser.add_argument("--naive", action="store_true", help="Use an unlocked check-then-insert, to show what it oversells")
+    stress_parser.set_defaults(func=cmd_stress_registrations)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
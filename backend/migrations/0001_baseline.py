@@ -0,0 +1,166 @@
+DESCRIPTION = "Baseline schema previously created by Database.initialize"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schools (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            code TEXT UNIQUE NOT NULL,
+            admin_email TEXT NOT NULL,
+            address TEXT,
+            phone TEXT,
+            website TEXT,
+            status TEXT DEFAULT 'active' CHECK (status IN ('active', 'inactive', 'suspended')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('admin', 'teacher', 'student', 'student_coordinator')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
+            UNIQUE(school_id, email)
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            category TEXT,
+            start_at TIMESTAMP NOT NULL,
+            end_at TIMESTAMP NOT NULL,
+            location TEXT,
+            host TEXT,
+            notes TEXT,
+            registration_link TEXT,
+            max_participants INTEGER,
+            status TEXT DEFAULT 'upcoming' CHECK (status IN ('upcoming', 'ongoing', 'completed', 'cancelled')),
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'registered' CHECK (status IN ('registered', 'waitlisted', 'cancelled')),
+            attendance_status TEXT DEFAULT 'absent' CHECK (attendance_status IN ('present', 'absent', 'late')),
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            UNIQUE(event_id, user_id)
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS teams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE,
+            UNIQUE(event_id, name)
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS team_members (
+            team_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            role TEXT DEFAULT 'member' CHECK (role IN ('leader', 'member')),
+            PRIMARY KEY (team_id, user_id),
+            FOREIGN KEY (team_id) REFERENCES teams (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action TEXT NOT NULL,
+            target_type TEXT NOT NULL,
+            target_id INTEGER,
+            meta_json TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS announcements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    db.add_column('announcements', 'event_id', 'INTEGER')
+    if db.add_column('announcements', 'body', 'TEXT'):
+        db.execute("UPDATE announcements SET body = content WHERE body IS NULL AND content IS NOT NULL")
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER,
+            event_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            status TEXT DEFAULT 'pending' CHECK (status IN ('pending','completed','cancelled')),
+            due_at TIMESTAMP,
+            due_date TIMESTAMP,
+            priority TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache TEXT NOT NULL,
+            cache_key TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    db.add_column('participants', 'school_id', 'INTEGER')
+
+    # Very old databases named these columns name/start_time/end_time
+    ev_cols = db.columns('events')
+    if db.add_column('events', 'title', 'TEXT') and 'name' in ev_cols:
+        db.execute("UPDATE events SET title = name WHERE title IS NULL AND name IS NOT NULL")
+    if db.add_column('events', 'start_at', 'TIMESTAMP') and 'start_time' in ev_cols:
+        db.execute("UPDATE events SET start_at = start_time WHERE start_at IS NULL AND start_time IS NOT NULL")
+    if db.add_column('events', 'end_at', 'TIMESTAMP') and 'end_time' in ev_cols:
+        db.execute("UPDATE events SET end_at = end_time WHERE end_at IS NULL AND end_time IS NOT NULL")
+    for col_name in ('host', 'notes', 'registration_link'):
+        db.add_column('events', col_name, 'TEXT')
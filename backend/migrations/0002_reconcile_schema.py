@@ -0,0 +1,123 @@
+DESCRIPTION = "Reconcile tables and columns the handlers rely on"
+
+def upgrade(db):
+    # register_student stores the student profile on the user row
+    for col_name in ('grade', 'section', 'guardian_name', 'guardian_phone', 'medical_notes'):
+        db.add_column('users', col_name, 'TEXT')
+
+    # Participants are roster entries that may or may not be tied to a user
+    # account or an event yet, so user_id and event_id become nullable.
+    db.rebuild_table('participants', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            user_id INTEGER,
+            school_id INTEGER,
+            first_name TEXT,
+            last_name TEXT,
+            grade TEXT,
+            section TEXT,
+            email TEXT,
+            phone TEXT,
+            guardian_name TEXT,
+            guardian_phone TEXT,
+            medical_notes TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'registered' CHECK (status IN ('registered', 'waitlisted', 'cancelled')),
+            attendance_status TEXT DEFAULT 'absent' CHECK (attendance_status IN ('present', 'absent', 'late')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
+            UNIQUE(event_id, user_id)
+        )
+    ''', '''
+        INSERT INTO {new} (id, event_id, user_id, school_id, first_name, last_name, grade, section,
+                           email, guardian_name, guardian_phone, medical_notes,
+                           registration_date, status, attendance_status)
+        SELECT p.id, p.event_id, p.user_id, COALESCE(p.school_id, e.school_id, u.school_id),
+               CASE WHEN instr(u.name, ' ') > 0 THEN substr(u.name, 1, instr(u.name, ' ') - 1) ELSE u.name END,
+               CASE WHEN instr(u.name, ' ') > 0 THEN substr(u.name, instr(u.name, ' ') + 1) ELSE '' END,
+               u.grade, u.section, u.email, u.guardian_name, u.guardian_phone, u.medical_notes,
+               p.registration_date, p.status, p.attendance_status
+        FROM {old} p
+        LEFT JOIN events e ON e.id = p.event_id
+        LEFT JOIN users u ON u.id = p.user_id
+    ''')
+
+    # Team membership is keyed by participant, not by user account
+    if 'participant_id' in db.columns('team_members'):
+        copy_sql = '''
+            INSERT INTO {new} (team_id, participant_id, joined_at, role)
+            SELECT team_id, participant_id, joined_at, role FROM {old}
+        '''
+    else:
+        copy_sql = '''
+            INSERT OR IGNORE INTO {new} (team_id, participant_id, joined_at, role)
+            SELECT tm.team_id, p.id, tm.joined_at, tm.role
+            FROM {old} tm
+            JOIN teams t ON t.id = tm.team_id
+            JOIN participants p ON p.user_id = tm.user_id AND p.event_id = t.event_id
+        '''
+    db.rebuild_table('team_members', '''
+        CREATE TABLE {table} (
+            team_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            role TEXT DEFAULT 'member' CHECK (role IN ('leader', 'member')),
+            PRIMARY KEY (team_id, participant_id),
+            FOREIGN KEY (team_id) REFERENCES teams (id) ON DELETE CASCADE,
+            FOREIGN KEY (participant_id) REFERENCES participants (id) ON DELETE CASCADE
+        )
+    ''', copy_sql)
+
+    db.add_column('teams', 'coach_user_id', 'INTEGER REFERENCES users (id) ON DELETE SET NULL')
+    db.add_column('teams', 'max_size', 'INTEGER DEFAULT 10')
+    db.add_column('teams', 'notes', 'TEXT')
+
+    db.add_column('tasks', 'assignee_user_id', 'INTEGER REFERENCES users (id) ON DELETE SET NULL')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            venue TEXT NOT NULL,
+            start_at TIMESTAMP NOT NULL,
+            end_at TIMESTAMP NOT NULL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS logistics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            details_json TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            owner_type TEXT NOT NULL DEFAULT 'event',
+            owner_id INTEGER,
+            filename TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            uploaded_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE,
+            FOREIGN KEY (uploaded_by) REFERENCES users (id) ON DELETE SET NULL
+        )
+    ''')
@@ -0,0 +1,24 @@
+DESCRIPTION = "Secondary indexes for hot endpoint filters and sort orders"
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_events_school_start ON events (school_id, start_at)",
+    "CREATE INDEX IF NOT EXISTS idx_events_start ON events (start_at)",
+    "CREATE INDEX IF NOT EXISTS idx_events_status ON events (status)",
+    "CREATE INDEX IF NOT EXISTS idx_events_category ON events (category)",
+    "CREATE INDEX IF NOT EXISTS idx_participants_school ON participants (school_id)",
+    "CREATE INDEX IF NOT EXISTS idx_participants_name ON participants (last_name, first_name)",
+    "CREATE INDEX IF NOT EXISTS idx_team_members_participant ON team_members (participant_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_school_status_due ON tasks (school_id, status, due_at)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_event ON tasks (event_id)",
+    "CREATE INDEX IF NOT EXISTS idx_announcements_school_created ON announcements (school_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_announcements_event ON announcements (event_id)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_schedules_event_start ON schedules (event_id, start_at)",
+    "CREATE INDEX IF NOT EXISTS idx_logistics_event ON logistics (event_id)",
+    "CREATE INDEX IF NOT EXISTS idx_files_event ON files (event_id)",
+    "CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created ON cache_invalidations (created_at)"
+]
+
+def upgrade(db):
+    for statement in INDEXES:
+        db.execute(statement)
@@ -0,0 +1,7 @@
+DESCRIPTION = "Index participants by school in roster order for streamed exports"
+
+def upgrade(db):
+    # Lets the school-scoped participant export walk the index in ORDER BY order
+    # instead of sorting every row in a temp b-tree. It also covers school_id lookups.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_participants_school_name ON participants (school_id, last_name, first_name)")
+    db.execute("DROP INDEX IF EXISTS idx_participants_school")
@@ -0,0 +1,15 @@
+DESCRIPTION = "Content-addressed blob storage referenced by files"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Files uploaded before this migration keep their own path and have no blob
+    db.add_column('files', 'blob_sha256', 'TEXT REFERENCES blobs (sha256)')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_files_blob ON files (blob_sha256)")
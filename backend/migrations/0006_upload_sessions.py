@@ -0,0 +1,31 @@
+DESCRIPTION = "Resumable upload sessions and their received parts"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            event_id INTEGER,
+            owner_type TEXT NOT NULL DEFAULT 'event',
+            owner_id INTEGER,
+            filename TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            total_size INTEGER NOT NULL,
+            part_size INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'completing')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS upload_parts (
+            session_id TEXT NOT NULL,
+            part_number INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, part_number),
+            FOREIGN KEY (session_id) REFERENCES upload_sessions (id) ON DELETE CASCADE
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions (updated_at)")
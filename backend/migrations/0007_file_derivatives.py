@@ -0,0 +1,18 @@
+DESCRIPTION = "Resized image variants stored next to their blobs"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS file_derivatives (
+            blob_sha256 TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (blob_sha256, variant),
+            FOREIGN KEY (blob_sha256) REFERENCES blobs (sha256) ON DELETE CASCADE
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_files_owner ON files (owner_type, owner_id)")
@@ -0,0 +1,14 @@
+DESCRIPTION = "Change feed that carries server-pushed updates between workers"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS change_feed (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER NOT NULL,
+            event_id INTEGER,
+            kind TEXT NOT NULL,
+            payload_json TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_change_feed_created ON change_feed (created_at)")
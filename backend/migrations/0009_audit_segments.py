@@ -0,0 +1,22 @@
+DESCRIPTION = "Index of compressed audit log archive segments, and a per-user audit index"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS audit_segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT NOT NULL,
+            path TEXT UNIQUE NOT NULL,
+            row_count INTEGER NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            min_created_at TIMESTAMP NOT NULL,
+            max_created_at TIMESTAMP NOT NULL,
+            user_ids_json TEXT NOT NULL,
+            actions_json TEXT NOT NULL,
+            target_types_json TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_audit_segments_created ON audit_segments (max_created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_audit_user_created ON audit_log (user_id, created_at)")
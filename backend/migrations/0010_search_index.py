@@ -0,0 +1,43 @@
+import sqlite3
+
+DESCRIPTION = "FTS5 search indexes over events and participants, kept in sync by triggers"
+
+# table -> (fts table, indexed columns)
+INDEXES = {
+    "events": ("events_fts", ("title", "description", "category", "location", "host")),
+    "participants": ("participants_fts", ("first_name", "last_name", "email")),
+}
+
+def upgrade(db):
+    for table, (fts, columns) in INDEXES.items():
+        cols = ", ".join(columns)
+        old = ", ".join(f"old.{c}" for c in columns)
+        new = ", ".join(f"new.{c}" for c in columns)
+        try:
+            db.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {cols}, content='{table}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; searches keep using LIKE
+            print(f"Skipping {fts}: {e}")
+            continue
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new});
+            END
+        ''')
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            END
+        ''')
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new});
+            END
+        ''')
+        db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
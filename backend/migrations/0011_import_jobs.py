@@ -0,0 +1,23 @@
+DESCRIPTION = "Progress and error reports for bulk participant imports"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id TEXT PRIMARY KEY,
+            school_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            filename TEXT,
+            status TEXT DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+            processed_rows INTEGER DEFAULT 0,
+            imported_rows INTEGER DEFAULT 0,
+            failed_rows INTEGER DEFAULT 0,
+            errors_json TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (school_id) REFERENCES schools (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
@@ -0,0 +1,17 @@
+DESCRIPTION = "Schedule school and team columns, canonical times, and the indexes the conflict checks walk"
+
+def upgrade(db):
+    db.add_column('schedules', 'school_id', 'INTEGER')
+    db.add_column('schedules', 'team_id', 'INTEGER REFERENCES teams (id) ON DELETE SET NULL')
+    db.execute('''
+        UPDATE schedules SET school_id = (SELECT e.school_id FROM events e WHERE e.id = schedules.event_id)
+        WHERE school_id IS NULL
+    ''')
+    # Conflict checks compare times as text, so store them all as YYYY-MM-DDTHH:MM:SS
+    db.execute('''
+        UPDATE schedules
+        SET start_at = strftime('%Y-%m-%dT%H:%M:%S', start_at), end_at = strftime('%Y-%m-%dT%H:%M:%S', end_at)
+        WHERE strftime('%Y-%m-%dT%H:%M:%S', start_at) IS NOT NULL AND strftime('%Y-%m-%dT%H:%M:%S', end_at) IS NOT NULL
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_venue_start ON schedules (school_id, venue, start_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_team_start ON schedules (team_id, start_at)")
@@ -0,0 +1,18 @@
+DESCRIPTION = "Idempotency keys for retried writes and the index behind event capacity and waitlist order"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            response_json TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, key)
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)")
+    # Seat counts read (event_id, status); promotion walks the waitlist in (registration_date, id) order
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_participants_event_status ON participants (event_id, status, registration_date, id)"
+    )
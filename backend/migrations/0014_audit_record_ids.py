@@ -0,0 +1,5 @@
+DESCRIPTION = "Unique audit record ids so replaying a spool twice inserts each record once"
+
+def upgrade(db):
+    db.add_column('audit_log', 'record_id', 'TEXT')
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_record_id ON audit_log (record_id)")
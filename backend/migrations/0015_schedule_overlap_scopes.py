@@ -0,0 +1,23 @@
+DESCRIPTION = "Flag venues and teams whose stored schedules already overlap, so conflict checks scan them"
+
+def upgrade(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_overlap_scopes (
+            school_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('venue', 'team')),
+            scope_key TEXT NOT NULL,
+            flagged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (school_id, kind, scope_key)
+        )
+    ''')
+    # A booking overlaps an earlier one when it starts before the latest end seen so far
+    for kind, column in (('venue', 'venue'), ('team', 'team_id')):
+        db.execute(f'''
+            INSERT OR IGNORE INTO schedule_overlap_scopes (school_id, kind, scope_key)
+            SELECT DISTINCT school_id, '{kind}', CAST({column} AS TEXT) FROM (
+                SELECT school_id, {column}, start_at,
+                       MAX(end_at) OVER (PARTITION BY school_id, {column} ORDER BY start_at, id
+                                         ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS reach
+                FROM schedules WHERE school_id IS NOT NULL AND {column} IS NOT NULL
+            ) WHERE start_at < reach
+        ''')
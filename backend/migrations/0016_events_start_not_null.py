@@ -0,0 +1,19 @@
+DESCRIPTION = "Backfill events with no start_at and refuse new ones, so (start_at, id) cursors see every event"
+
+def upgrade(db):
+    # Databases created by 0001 already declare start_at NOT NULL. Ones upgraded from the
+    # start_time era added it as a nullable column, and a NULL start_at makes the row-value
+    # cursor comparison NULL, so those events would never appear after the first page.
+    notnull = {row[1]: row[3] for row in db.execute("PRAGMA table_info(events)").fetchall()}
+    if notnull.get('start_at'):
+        return
+    db.execute("UPDATE events SET start_at = COALESCE(end_at, created_at, CURRENT_TIMESTAMP) WHERE start_at IS NULL")
+    for when in ('INSERT', 'UPDATE OF start_at'):
+        name = 'events_start_at_insert' if when == 'INSERT' else 'events_start_at_update'
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} BEFORE {when} ON events
+            WHEN NEW.start_at IS NULL
+            BEGIN
+                SELECT RAISE(ABORT, 'NOT NULL constraint failed: events.start_at');
+            END
+        ''')
@@ -1,21 +1,43 @@
 from fastapi import APIRouter, HTTPException, Depends, Request, UploadFile, File
-from fastapi.responses import StreamingResponse, Response
+from fastapi.responses import StreamingResponse, Response, FileResponse
 import sqlite3
 import json
+import aiofiles
+import anyio
+import asyncio
+import codecs
 import csv
+import functools
+import hashlib
+import html
 import io
-from datetime import datetime, timedelta
+import itertools
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
+from urllib.parse import quote
 import mimetypes
 import os
+import re
+import secrets
+import shutil
+import zlib
 from typing import Optional, List
-from .main import Database, require_auth, require_role, log_audit, UPLOADS_DIR
+from main import (
+    Database, require_auth, require_role, log_audit, UPLOADS_DIR, decode_cursor, next_page_cursor, cached_count,
+    etag_matches, blob_store, MAX_UPLOAD_SIZE, MAX_RESUMABLE_UPLOAD_SIZE, UPLOAD_PART_SIZE, UPLOAD_CHUNK_SIZE,
+    STAGING_DIR, FILE_ACCEL_MODE, FILE_ACCEL_PREFIX, DERIVATIVE_SIZES, derivatives, make_etag, calendar_cache,
+    CALENDAR_CACHE_MAX_BYTES, event_hub, STREAM_HEARTBEAT, audit_archive, AUDIT_MAX_OFFSET, count_cache,
+    SEARCH_INDEXES, search_available, fts_query, PARTICIPANT_REQUIRED_FIELDS, IMPORT_CHUNK_SIZE, IMPORT_MAX_ERRORS,
+    background_jobs, TEAM_PLAN_TIME_BUDGET, registrations
+)
+from balancing import plan_teams
 
 router = APIRouter()
 
 @router.get("/api/events/{event_id}/schedules")
 async def get_event_schedules(event_id: int, user = Depends(require_auth)):
-    schedules = Database.execute_query(
+    schedules = await Database.aexecute(
         "SELECT * FROM schedules WHERE event_id = ? ORDER BY start_at",
         (event_id,),
         fetch_all=True
@@ -23,27 +45,255 @@ async def get_event_schedules(event_id: int, user = Depends(require_auth)):
     
     return [dict(schedule) for schedule in schedules]
 
+SCHEDULE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+SCHEDULE_COLUMNS = "id, event_id, title, venue, team_id, start_at, end_at"
+# How many blocked slots the free-slot search steps over in each direction before giving up
+SCHEDULE_SLOT_STEPS = 50
+
+def schedule_time(value, name: str) -> str:
+    if not value:
+        raise HTTPException(status_code=400, detail=f"{name} is required")
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected an ISO 8601 datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime(SCHEDULE_TIME_FORMAT)
+
+def schedule_conflicts(conn, school_id: int, venue: Optional[str], team_id: Optional[int],
+                       start_at: str, end_at: str, exclude_id: int = 0, limit: int = 20) -> list:
+    """Bookings of the venue or the team that overlap [start_at, end_at), found with index seeks.
+
+    Bookings that passed this check never overlap one another, so their ends are ordered like
+    their starts: the only one starting before start_at that can reach into the slot is the
+    latest such booking. Everything else that overlaps starts inside the slot. Venues and teams
+    with overlaps stored before the check existed are listed in schedule_overlap_scopes; for
+    those the ordering does not hold, so every earlier booking is scanned instead.
+    """
+    conflicts = {}
+    for column, scope, value in (("venue", "school_id = ? AND venue = ?", (school_id, venue)),
+                                 ("team", "team_id = ?", (team_id,))):
+        if value[-1] is None:
+            continue
+        flagged = conn.execute(
+            "SELECT 1 FROM schedule_overlap_scopes WHERE school_id = ? AND kind = ? AND scope_key = ?",
+            (school_id, column, str(value[-1]))
+        ).fetchone()
+        if flagged:
+            rows = conn.execute(
+                f"""SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE {scope} AND start_at < ? AND end_at > ? AND id != ?
+                    ORDER BY start_at LIMIT ?""",
+                value + (end_at, start_at, exclude_id, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"""SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE {scope} AND start_at < ? AND id != ?
+                    ORDER BY start_at DESC LIMIT 1""",
+                value + (start_at, exclude_id)
+            ).fetchall() + conn.execute(
+                f"""SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE {scope} AND start_at >= ? AND start_at < ? AND id != ?
+                    ORDER BY start_at LIMIT ?""",
+                value + (start_at, end_at, exclude_id, limit)
+            ).fetchall()
+        for row in rows:
+            if row["end_at"] > start_at and row["start_at"] < end_at:
+                conflict = conflicts.setdefault(row["id"], {**dict(row), "conflicts_on": []})
+                conflict["conflicts_on"].append(column)
+    return sorted(conflicts.values(), key=lambda row: row["start_at"])
+
+def shift_time(value: str, seconds: float) -> str:
+    return (datetime.strptime(value, SCHEDULE_TIME_FORMAT) + timedelta(seconds=seconds)).strftime(SCHEDULE_TIME_FORMAT)
+
+def nearest_free_slot(conn, school_id: int, venue: str, team_id: Optional[int], start_at: str, end_at: str,
+                      exclude_id: int = 0) -> Optional[dict]:
+    """Closest slot of the same length, earlier or later, that is free for both the venue and the team"""
+    duration = (datetime.strptime(end_at, SCHEDULE_TIME_FORMAT) - datetime.strptime(start_at, SCHEDULE_TIME_FORMAT)).total_seconds()
+    options = []
+    for direction in (1, -1):
+        start = start_at
+        for _ in range(SCHEDULE_SLOT_STEPS):
+            end = shift_time(start, duration)
+            blocking = schedule_conflicts(conn, school_id, venue, team_id, start, end, exclude_id)
+            if not blocking:
+                options.append({"start_at": start, "end_at": end})
+                break
+            # Jump just past (or just before) everything in the way and look again
+            if direction > 0:
+                start = max(row["end_at"] for row in blocking)
+            else:
+                start = shift_time(min(row["start_at"] for row in blocking), -duration)
+    if not options:
+        return None
+    requested = datetime.strptime(start_at, SCHEDULE_TIME_FORMAT)
+    return min(options, key=lambda slot: abs((datetime.strptime(slot["start_at"], SCHEDULE_TIME_FORMAT) - requested).total_seconds()))
+
+def book_schedule(school_id: int, values: dict, schedule_id: Optional[int] = None) -> int:
+    """Insert or update a schedule unless it clashes, checked and written under one write lock"""
+    with Database.transaction() as conn:
+        conflicts = schedule_conflicts(
+            conn, school_id, values["venue"], values["team_id"], values["start_at"], values["end_at"], schedule_id or 0
+        )
+        if conflicts:
+            raise HTTPException(status_code=409, detail={
+                "message": "Schedule conflicts with existing bookings",
+                "conflicts": conflicts,
+                "suggestion": nearest_free_slot(
+                    conn, school_id, values["venue"], values["team_id"], values["start_at"], values["end_at"], schedule_id or 0
+                )
+            })
+        if schedule_id is None:
+            cursor = conn.execute(
+                "INSERT INTO schedules (event_id, school_id, team_id, title, venue, start_at, end_at, notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (values["event_id"], school_id, values["team_id"], values["title"], values["venue"],
+                 values["start_at"], values["end_at"], values["notes"])
+            )
+            return cursor.lastrowid
+        conn.execute(
+            """UPDATE schedules SET team_id = ?, title = ?, venue = ?, start_at = ?, end_at = ?, notes = ?,
+               updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+            (values["team_id"], values["title"], values["venue"], values["start_at"], values["end_at"],
+             values["notes"], schedule_id)
+        )
+        return schedule_id
+
+async def schedule_values(event_id: int, data: dict, user: dict) -> dict:
+    for field in ("title", "venue"):
+        if not data.get(field):
+            raise HTTPException(status_code=400, detail=f"{field} is required")
+    values = {
+        "event_id": event_id,
+        "title": data["title"],
+        "venue": data["venue"],
+        "team_id": data.get("team_id"),
+        "notes": data.get("notes", ""),
+        "start_at": schedule_time(data.get("start_at"), "start_at"),
+        "end_at": schedule_time(data.get("end_at"), "end_at")
+    }
+    if values["end_at"] <= values["start_at"]:
+        raise HTTPException(status_code=400, detail="end_at must be after start_at")
+    event = await Database.aexecute(
+        "SELECT id FROM events WHERE id = ? AND school_id = ?", (event_id, user["school_id"]), fetch_one=True
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if values["team_id"] is not None and not await Database.aexecute(
+        "SELECT 1 FROM teams WHERE id = ? AND event_id = ?", (values["team_id"], event_id), fetch_one=True
+    ):
+        raise HTTPException(status_code=400, detail="Team not found for this event")
+    return values
+
 @router.post("/api/events/{event_id}/schedules")
 async def create_schedule(event_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
     data = await request.json()
     
-    required_fields = ["title", "venue", "start_at", "end_at"]
-    for field in required_fields:
-        if not data.get(field):
-            raise HTTPException(status_code=400, detail=f"{field} is required")
+    values = await schedule_values(event_id, data, user)
+    schedule_id = await Database.call(book_schedule, user["school_id"], values)
+    
+    await log_audit(user, "create", "schedule", schedule_id)
+    
+    return {"id": schedule_id, "message": "Schedule created"}
+
+@router.put("/api/schedules/{schedule_id}")
+async def update_schedule(schedule_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
+    data = await request.json()
     
-    schedule_id = Database.execute_query(
-        "INSERT INTO schedules (event_id, title, venue, start_at, end_at, notes) VALUES (?, ?, ?, ?, ?, ?)",
-        (event_id, data["title"], data["venue"], data["start_at"], data["end_at"], data.get("notes", ""))
+    schedule = await Database.aexecute(
+        "SELECT * FROM schedules WHERE id = ? AND school_id = ?", (schedule_id, user["school_id"]), fetch_one=True
     )
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
     
-    log_audit(user["id"], "create", "schedule", schedule_id)
+    values = await schedule_values(schedule["event_id"], {**schedule, **data}, user)
+    await Database.call(book_schedule, user["school_id"], values, schedule_id)
     
-    return {"id": schedule_id, "message": "Schedule created"}
+    await log_audit(user, "update", "schedule", schedule_id, data)
+    
+    return {"id": schedule_id, "message": "Schedule updated"}
+
+def overlap_sweep(rows: list, key: str) -> list:
+    """Overlapping pairs among rows sharing the same key, in one pass over rows sorted by (key, start_at)"""
+    pairs = []
+    active = []
+    current = object()
+    for row in rows:
+        if row[key] is None:
+            continue
+        if row[key] != current:
+            current, active = row[key], []
+        # Drop bookings that ended before this one starts; the rest all overlap it
+        active = [other for other in active if other["end_at"] > row["start_at"]]
+        for other in active:
+            pairs.append({key: current, "first": other, "second": row})
+        active.append(row)
+    return pairs
+
+def conflict_report(school_id: int, event_id: Optional[int], since: Optional[str], until: Optional[str]) -> dict:
+    clauses, params = ["school_id = ?"], [school_id]
+    if event_id is not None:
+        clauses.append("event_id = ?")
+        params.append(event_id)
+    if since:
+        clauses.append("end_at > ?")
+        params.append(since)
+    if until:
+        clauses.append("start_at < ?")
+        params.append(until)
+    where = " AND ".join(clauses)
+    conn = Database.get_connection()
+    try:
+        by_venue = [dict(row) for row in conn.execute(
+            f"SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE {where} ORDER BY venue, start_at", params
+        )]
+    finally:
+        conn.close()
+    by_team = sorted((row for row in by_venue if row["team_id"] is not None), key=lambda row: (row["team_id"], row["start_at"]))
+    report = {
+        "schedules": len(by_venue),
+        "venue_conflicts": overlap_sweep(by_venue, "venue"),
+        "team_conflicts": overlap_sweep(by_team, "team_id")
+    }
+    flag_overlap_scopes(school_id, report, complete=event_id is None and not since and not until)
+    return report
+
+def flag_overlap_scopes(school_id: int, report: dict, complete: bool):
+    """Keep schedule_overlap_scopes in step with what a conflict report found.
+
+    Every venue or team with an overlap is flagged. A report over the whole school also
+    unflags the ones whose overlaps have since been resolved.
+    """
+    found = {("venue", pair["venue"]) for pair in report["venue_conflicts"]}
+    found |= {("team", str(pair["team_id"])) for pair in report["team_conflicts"]}
+    if not found and not complete:
+        return
+    with Database.transaction() as conn:
+        if complete:
+            flagged = {(row["kind"], row["scope_key"]) for row in conn.execute(
+                "SELECT kind, scope_key FROM schedule_overlap_scopes WHERE school_id = ?", (school_id,)
+            )}
+            conn.executemany(
+                "DELETE FROM schedule_overlap_scopes WHERE school_id = ? AND kind = ? AND scope_key = ?",
+                [(school_id, kind, key) for kind, key in flagged - found]
+            )
+        conn.executemany(
+            "INSERT OR IGNORE INTO schedule_overlap_scopes (school_id, kind, scope_key) VALUES (?, ?, ?)",
+            [(school_id, kind, key) for kind, key in found]
+        )
+
+@router.get("/api/schedules/conflicts")
+async def get_schedule_conflicts(
+    event_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    user = Depends(require_auth)
+):
+    since = schedule_time(since, "since") if since else None
+    until = schedule_time(until, "until") if until else None
+    return await Database.call(conflict_report, user["school_id"], event_id, since, until)
 
 @router.get("/api/events/{event_id}/logistics")
 async def get_event_logistics(event_id: int, user = Depends(require_auth)):
-    logistics = Database.execute_query(
+    logistics = await Database.aexecute(
         "SELECT * FROM logistics WHERE event_id = ? ORDER BY created_at",
         (event_id,),
         fetch_all=True
@@ -65,18 +315,18 @@ async def create_logistics(event_id: int, request: Request, user = Depends(requi
     if not data.get("type") or not data.get("details"):
         raise HTTPException(status_code=400, detail="Type and details are required")
     
-    logistics_id = Database.execute_query(
+    logistics_id = await Database.aexecute(
         "INSERT INTO logistics (event_id, type, details_json) VALUES (?, ?, ?)",
         (event_id, data["type"], json.dumps(data["details"]))
     )
     
-    log_audit(user["id"], "create", "logistics", logistics_id)
+    await log_audit(user, "create", "logistics", logistics_id)
     
     return {"id": logistics_id, "message": "Logistics created"}
 
 @router.get("/api/events/{event_id}/tasks")
 async def get_event_tasks(event_id: int, user = Depends(require_auth)):
-    tasks = Database.execute_query(
+    tasks = await Database.aexecute(
         """SELECT t.*, u.name as assignee_name 
            FROM tasks t 
            LEFT JOIN users u ON t.assignee_user_id = u.id 
@@ -94,13 +344,13 @@ async def create_task(event_id: int, request: Request, user = Depends(require_ro
     if not data.get("title"):
         raise HTTPException(status_code=400, detail="Title is required")
     
-    task_id = Database.execute_query(
-        "INSERT INTO tasks (event_id, title, assignee_user_id, status, due_at, description) VALUES (?, ?, ?, ?, ?, ?)",
-        (event_id, data["title"], data.get("assignee_user_id"), 
-         data.get("status", "pending"), data.get("due_at"), data.get("description", ""))
+    task_id = await Database.aexecute(
+        "INSERT INTO tasks (school_id, event_id, title, assignee_user_id, status, due_at, description, created_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (user["school_id"], event_id, data["title"], data.get("assignee_user_id"), 
+         data.get("status", "pending"), data.get("due_at"), data.get("description", ""), user["id"])
     )
     
-    log_audit(user["id"], "create", "task", task_id)
+    await log_audit(user, "create", "task", task_id)
     
     return {"id": task_id, "message": "Task created"}
 
@@ -108,7 +358,7 @@ async def create_task(event_id: int, request: Request, user = Depends(require_ro
 async def update_task(task_id: int, request: Request, user = Depends(require_auth)):
     data = await request.json()
     
-    task = Database.execute_query(
+    task = await Database.aexecute(
         "SELECT * FROM tasks WHERE id = ?",
         (task_id,),
         fetch_one=True
@@ -127,18 +377,18 @@ async def update_task(task_id: int, request: Request, user = Depends(require_aut
     
     if update_fields:
         params.append(task_id)
-        Database.execute_query(
+        await Database.aexecute(
             f"UPDATE tasks SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
             tuple(params)
         )
         
-        log_audit(user["id"], "update", "task", task_id, data)
+        await log_audit(user, "update", "task", task_id, data)
     
     return {"message": "Task updated"}
 
 @router.get("/api/events/{event_id}/announcements")
 async def get_event_announcements(event_id: int, user = Depends(require_auth)):
-    announcements = Database.execute_query(
+    announcements = await Database.aexecute(
         """SELECT a.*, u.name as author_name 
            FROM announcements a 
            JOIN users u ON a.created_by = u.id 
@@ -157,50 +407,266 @@ async def create_announcement(event_id: int, request: Request, user = Depends(re
     if not data.get("title") or not data.get("body"):
         raise HTTPException(status_code=400, detail="Title and body are required")
     
-    announcement_id = Database.execute_query(
-        "INSERT INTO announcements (event_id, title, body, created_by) VALUES (?, ?, ?, ?)",
-        (event_id, data["title"], data["body"], user["id"])
+    announcement_id = await Database.aexecute(
+        "INSERT INTO announcements (school_id, event_id, title, body, content, created_by) VALUES (?, ?, ?, ?, ?, ?)",
+        (user["school_id"], event_id, data["title"], data["body"], data["body"], user["id"])
     )
     
-    log_audit(user["id"], "create", "announcement", announcement_id)
+    await event_hub.publish(user["school_id"], event_id, "announcement", {
+        "id": announcement_id, "event_id": event_id, "title": data["title"], "body": data["body"],
+        "author_name": user["name"]
+    })
+    await log_audit(user, "create", "announcement", announcement_id)
     
     return {"id": announcement_id, "message": "Announcement created"}
 
+ALLOWED_UPLOAD_TYPES = ["image/jpeg", "image/png", "image/gif", "application/pdf", "text/csv", "application/vnd.ms-excel"]
+
+def record_file(sha256: str, size: int, tmp_path: Optional[Path], details: dict) -> Optional[int]:
+    """Attach the blob and insert the files row in one transaction; None means the content must be written first"""
+    with Database.transaction() as conn:
+        if not blob_store.attach(conn, sha256, size, tmp_path):
+            return None
+        cursor = conn.execute(
+            "INSERT INTO files (event_id, owner_type, owner_id, filename, mime, size, path, uploaded_by, blob_sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (details["event_id"], details["owner_type"], details["owner_id"], details["filename"], details["mime"],
+             size, str(blob_store.path_for(sha256)), details["uploaded_by"], sha256)
+        )
+        return cursor.lastrowid
+
 @router.post("/api/files/upload")
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     event_id: Optional[int] = None,
     owner_type: str = "event",
     owner_id: int = 0,
     user = Depends(require_auth)
 ):
-    if file.size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large (max 10MB)")
+    """Upload one file from the multipart field "file", streamed to disk and deduplicated by content"""
+    tmp_path, sha256, size, filename, mime = await blob_store.receive(request, "file", MAX_UPLOAD_SIZE, ALLOWED_UPLOAD_TYPES)
+    details = {
+        "event_id": event_id, "owner_type": owner_type, "owner_id": owner_id,
+        "filename": filename, "mime": mime, "uploaded_by": user["id"]
+    }
+    
+    # Known content only gains a reference and the temp copy is dropped; new content is renamed into place
+    try:
+        file_id = await Database.call(record_file, sha256, size, tmp_path, details)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    
+    derivatives.schedule(sha256, mime)
+    await log_audit(user, "upload", "file", file_id)
+    
+    return {"id": file_id, "filename": filename, "size": size, "sha256": sha256, "message": "File uploaded"}
+
+async def get_upload_session(upload_id: str, user: dict) -> dict:
+    session = await Database.aexecute(
+        "SELECT * FROM upload_sessions WHERE id = ?",
+        (upload_id,),
+        fetch_one=True
+    )
+    if not session or session["user_id"] != user["id"]:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def upload_part_count(session: dict) -> int:
+    return max(1, -(-session["total_size"] // session["part_size"]))
+
+def expected_part_size(session: dict, part_number: int) -> int:
+    if part_number < upload_part_count(session):
+        return session["part_size"]
+    return session["total_size"] - session["part_size"] * (part_number - 1)
+
+async def upload_status(session: dict) -> dict:
+    parts = await Database.aexecute(
+        "SELECT part_number, size FROM upload_parts WHERE session_id = ? ORDER BY part_number",
+        (session["id"],),
+        fetch_all=True
+    )
+    received = {part["part_number"] for part in parts}
+    return {
+        "upload_id": session["id"],
+        "filename": session["filename"],
+        "size": session["total_size"],
+        "part_size": session["part_size"],
+        "parts": upload_part_count(session),
+        "received_parts": sorted(received),
+        "missing_parts": [n for n in range(1, upload_part_count(session) + 1) if n not in received],
+        "received_bytes": sum(part["size"] for part in parts),
+        "status": session["status"]
+    }
+
+@router.post("/api/files/uploads")
+async def create_upload(request: Request, user = Depends(require_auth)):
+    data = await request.json()
     
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "application/pdf", "text/csv", "application/vnd.ms-excel"]
-    if file.content_type not in allowed_types:
+    if not data.get("filename") or not isinstance(data.get("size"), int) or data["size"] <= 0:
+        raise HTTPException(status_code=400, detail="filename and size are required")
+    if data.get("mime") not in ALLOWED_UPLOAD_TYPES:
         raise HTTPException(status_code=400, detail="File type not allowed")
+    if data["size"] > MAX_RESUMABLE_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File too large (max {MAX_RESUMABLE_UPLOAD_SIZE // (1024 * 1024)}MB)")
+    
+    upload_id = secrets.token_urlsafe(16)
+    await Database.aexecute(
+        "INSERT INTO upload_sessions (id, user_id, event_id, owner_type, owner_id, filename, mime, total_size, part_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (upload_id, user["id"], data.get("event_id"), data.get("owner_type", "event"), data.get("owner_id", 0),
+         data["filename"], data["mime"], data["size"], UPLOAD_PART_SIZE)
+    )
+    
+    return await upload_status(await get_upload_session(upload_id, user))
+
+@router.get("/api/files/uploads/{upload_id}")
+async def get_upload(upload_id: str, user = Depends(require_auth)):
+    return await upload_status(await get_upload_session(upload_id, user))
+
+@router.put("/api/files/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(upload_id: str, part_number: int, request: Request, user = Depends(require_auth)):
+    session = await get_upload_session(upload_id, user)
+    if session["status"] != "open":
+        raise HTTPException(status_code=409, detail="Upload is being finalized")
+    if not 1 <= part_number <= upload_part_count(session):
+        raise HTTPException(status_code=400, detail="Part number out of range")
+    
+    expected = expected_part_size(session, part_number)
+    staging = STAGING_DIR / upload_id
+    staging.mkdir(parents=True, exist_ok=True)
+    part_path = staging / f"{part_number:05d}"
+    tmp_path = staging / f"{part_number:05d}.{secrets.token_hex(4)}.tmp"
+    
+    # Stream the body straight to disk; a retried part replaces the earlier attempt atomically
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > expected:
+                    raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+                await out.write(chunk)
+        if size != expected:
+            raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+        os.replace(tmp_path, part_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
     
-    file_ext = Path(file.filename).suffix
-    safe_filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-    file_path = UPLOADS_DIR / safe_filename
+    def record_part():
+        with Database.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO upload_parts (session_id, part_number, size) VALUES (?, ?, ?)",
+                (upload_id, part_number, size)
+            )
+            conn.execute("UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = ?", (upload_id,))
     
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    await Database.call(record_part)
     
-    file_id = Database.execute_query(
-        "INSERT INTO files (event_id, owner_type, owner_id, filename, mime, size, path, uploaded_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (event_id, owner_type, owner_id, file.filename, file.content_type, file.size, str(file_path), user["id"])
+    return {"upload_id": upload_id, "part": part_number, "size": size}
+
+def assemble_parts(staging: Path, parts: int, chunk_size: int) -> tuple:
+    """Concatenate staged parts into a temp blob file, hashing as it copies"""
+    tmp_dir = blob_store.root / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir / secrets.token_hex(16)
+    hasher = hashlib.sha256()
+    size = 0
+    with open(tmp_path, "wb") as out:
+        for part_number in range(1, parts + 1):
+            with open(staging / f"{part_number:05d}", "rb") as part:
+                while chunk := part.read(chunk_size):
+                    hasher.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+    return tmp_path, hasher.hexdigest(), size
+
+def claim_upload(upload_id: str) -> bool:
+    with Database.transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE upload_sessions SET status = 'completing', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'open'",
+            (upload_id,)
+        )
+        return cursor.rowcount == 1
+
+@router.post("/api/files/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, user = Depends(require_auth)):
+    session = await get_upload_session(upload_id, user)
+    status = await upload_status(session)
+    if status["missing_parts"]:
+        raise HTTPException(status_code=409, detail=f"Missing parts: {status['missing_parts'][:20]}")
+    
+    claimed = await Database.call(claim_upload, upload_id)
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    
+    staging = STAGING_DIR / upload_id
+    details = {
+        "event_id": session["event_id"], "owner_type": session["owner_type"], "owner_id": session["owner_id"],
+        "filename": session["filename"], "mime": session["mime"], "uploaded_by": user["id"]
+    }
+    try:
+        tmp_path, sha256, size = await anyio.to_thread.run_sync(
+            assemble_parts, staging, status["parts"], UPLOAD_CHUNK_SIZE
+        )
+        try:
+            file_id = await Database.call(record_file, sha256, size, tmp_path, details)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    except Exception as e:
+        # Hand the session back so the client can re-send parts and retry
+        await Database.aexecute("UPDATE upload_sessions SET status = 'open' WHERE id = ?", (upload_id,))
+        if isinstance(e, OSError):
+            raise HTTPException(status_code=409, detail="Staged parts are incomplete, re-send them and retry")
+        raise
+    
+    def finish():
+        with Database.transaction() as conn:
+            conn.execute("DELETE FROM upload_parts WHERE session_id = ?", (upload_id,))
+            conn.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+    
+    await Database.call(finish)
+    await anyio.to_thread.run_sync(functools.partial(shutil.rmtree, staging, ignore_errors=True))
+    
+    derivatives.schedule(sha256, session["mime"])
+    await log_audit(user, "upload", "file", file_id, {"upload_id": upload_id, "parts": status["parts"]})
+    
+    return {"id": file_id, "filename": session["filename"], "size": size, "sha256": sha256, "message": "File uploaded"}
+
+@router.get("/api/files")
+async def list_files(
+    event_id: Optional[int] = None,
+    owner_type: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    user = Depends(require_auth)
+):
+    conditions, params = [], []
+    for column, value in (("event_id", event_id), ("owner_type", owner_type), ("owner_id", owner_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Filter by event_id or owner_type/owner_id")
+    
+    files = await Database.aexecute(
+        f"SELECT id, event_id, owner_type, owner_id, filename, mime, size, uploaded_by, created_at FROM files WHERE {' AND '.join(conditions)} ORDER BY created_at DESC, id DESC",
+        tuple(params),
+        fetch_all=True
     )
     
-    log_audit(user["id"], "upload", "file", file_id)
+    result = []
+    for file in files:
+        file_dict = dict(file)
+        file_dict["url"] = f"/api/files/{file['id']}"
+        # Galleries should load these instead of the full-size original
+        file_dict["variants"] = (
+            {variant: f"/api/files/{file['id']}?size={variant}" for variant in DERIVATIVE_SIZES}
+            if derivatives.available(file["mime"]) else {}
+        )
+        result.append(file_dict)
     
-    return {"id": file_id, "filename": file.filename, "message": "File uploaded"}
+    return result
 
-@router.get("/api/files/{file_id}")
-async def download_file(file_id: int, user = Depends(require_auth)):
-    file_record = Database.execute_query(
+@router.delete("/api/files/{file_id}")
+async def delete_file(file_id: int, user = Depends(require_auth)):
+    file_record = await Database.aexecute(
         "SELECT * FROM files WHERE id = ?",
         (file_id,),
         fetch_one=True
@@ -208,133 +674,1054 @@ async def download_file(file_id: int, user = Depends(require_auth)):
     
     if not file_record:
         raise HTTPException(status_code=404, detail="File not found")
+    if file_record["uploaded_by"] != user["id"] and user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
     
-    file_path = Path(file_record["path"])
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found on disk")
+    def remove():
+        with Database.transaction() as conn:
+            conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            if file_record["blob_sha256"]:
+                blob_store.release(conn, file_record["blob_sha256"])
     
-    return StreamingResponse(
-        io.BytesIO(file_path.read_bytes()),
-        media_type=file_record["mime"],
-        headers={"Content-Disposition": f"attachment; filename={file_record['filename']}"}
-    )
+    await Database.call(remove)
+    if not file_record["blob_sha256"]:
+        # Uploaded before blob storage, so the file is not shared
+        Path(file_record["path"]).unlink(missing_ok=True)
+    
+    await log_audit(user, "delete", "file", file_id)
+    
+    return {"message": "File deleted"}
 
-@router.get("/api/reports/participants/csv")
-async def export_participants_csv(user = Depends(require_auth)):
-    participants = Database.execute_query(
-        "SELECT * FROM participants ORDER BY last_name, first_name",
-        fetch_all=True
+class FileRangeResponse(FileResponse):
+    """FileResponse that can send a single byte range, using zero-copy sendfile when the server offers it"""
+
+    def __init__(self, path, byte_range: tuple, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start, self.end = byte_range
+        size = self.stat_result.st_size
+        self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.wrapped.fileno(),
+                    "offset": self.start,
+                    "count": remaining,
+                    "more_body": False
+                })
+                return
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def file_validators(stat_result: os.stat_result) -> tuple:
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    return etag, formatdate(stat_result.st_mtime, usegmt=True)
+
+def not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if request.headers.get("if-none-match"):
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def requested_range(request: Request, size: int, etag: str, last_modified: str) -> Optional[tuple]:
+    """Parse a single-range Range header; None means send the whole file"""
+    header = request.headers.get("range")
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            start, end = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416, detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+@router.api_route("/api/files/{file_id}", methods=["GET", "HEAD"])
+async def download_file(file_id: int, request: Request, size: Optional[str] = None, user = Depends(require_auth)):
+    if size is not None and size not in DERIVATIVE_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(DERIVATIVE_SIZES)}")
+    
+    file_record = await Database.aexecute(
+        "SELECT * FROM files WHERE id = ?",
+        (file_id,),
+        fetch_one=True
     )
     
-    output = io.StringIO()
-    writer = csv.writer(output)
+    if not file_record:
+        raise HTTPException(status_code=404, detail="File not found")
     
-    writer.writerow(["ID", "First Name", "Last Name", "Grade", "Section", "Email", "Phone", "Guardian Name", "Guardian Phone", "Medical Notes"])
+    file_path = Path(file_record["path"])
+    mime, filename, disposition = file_record["mime"], file_record["filename"], "attachment"
+    if size and file_record["blob_sha256"] and derivatives.available(mime):
+        # Variants are best effort; the original is served when one cannot be rendered
+        derivative = await derivatives.get(file_record["blob_sha256"], size)
+        if derivative:
+            file_path = UPLOADS_DIR / derivative["path"]
+            mime, disposition = derivative["mime"], "inline"
+            filename = f"{Path(filename).stem}-{size}{file_path.suffix}"
+    try:
+        stat_result = await anyio.to_thread.run_sync(file_path.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found on disk")
     
-    for p in participants:
-        writer.writerow([
-            p["id"], p["first_name"], p["last_name"], p["grade"], p["section"],
-            p["email"], p["phone"], p["guardian_name"], p["guardian_phone"], p["medical_notes"]
-        ])
+    etag, last_modified = file_validators(stat_result)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+    if not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
     
-    output.seek(0)
+    if FILE_ACCEL_MODE:
+        # The proxy streams the file and answers Range requests itself
+        if FILE_ACCEL_MODE == "x-accel-redirect":
+            headers["X-Accel-Redirect"] = FILE_ACCEL_PREFIX.rstrip("/") + "/" + quote(file_path.relative_to(UPLOADS_DIR).as_posix())
+        else:
+            headers["X-Sendfile"] = str(file_path)
+        headers["Content-Disposition"] = f"{disposition}; filename*=utf-8''{quote(filename)}"
+        return Response(media_type=mime, headers=headers)
     
+    options = {
+        "media_type": mime,
+        "filename": filename,
+        "content_disposition_type": disposition,
+        "stat_result": stat_result,
+        "method": request.method,
+        "headers": headers
+    }
+    byte_range = requested_range(request, stat_result.st_size, etag, last_modified)
+    if byte_range:
+        return FileRangeResponse(file_path, byte_range, **options)
+    return FileResponse(file_path, **options)
+
+def wants_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "").lower()
+
+async def csv_stream(batches, header: list, columns: list, compress: bool):
+    """Encode row batches from Database.astream as CSV, one chunk per batch"""
+    gzip_stream = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    async for rows in batches:
+        writer.writerows([row[column] for column in columns] for row in rows)
+        chunk = output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+        if gzip_stream:
+            chunk = gzip_stream.compress(chunk)
+        if chunk:
+            yield chunk
+    chunk = output.getvalue().encode()
+    if gzip_stream:
+        chunk = gzip_stream.compress(chunk) + gzip_stream.flush()
+    if chunk:
+        yield chunk
+
+def csv_response(request: Request, batches, header: list, columns: list, filename: str):
+    compress = wants_gzip(request)
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
     return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
+        csv_stream(batches, header, columns, compress),
         media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=participants.csv"}
+        headers=headers
+    )
+
+@router.get("/api/reports/participants/csv")
+async def export_participants_csv(request: Request, event_id: Optional[int] = None, user = Depends(require_auth)):
+    query = "SELECT * FROM participants WHERE school_id = ?"
+    params = [user["school_id"]]
+    if event_id is not None:
+        query += " AND event_id = ?"
+        params.append(event_id)
+    query += " ORDER BY last_name, first_name, id"
+
+    return csv_response(
+        request,
+        Database.astream(query, tuple(params)),
+        ["ID", "First Name", "Last Name", "Grade", "Section", "Email", "Phone", "Guardian Name", "Guardian Phone", "Medical Notes"],
+        ["id", "first_name", "last_name", "grade", "section", "email", "phone", "guardian_name", "guardian_phone", "medical_notes"],
+        "participants.csv"
     )
 
 @router.get("/api/reports/events/csv")
-async def export_events_csv(user = Depends(require_auth)):
-    events = Database.execute_query(
-        "SELECT * FROM events ORDER BY start_at DESC",
-        fetch_all=True
+async def export_events_csv(request: Request, status: Optional[str] = None, user = Depends(require_auth)):
+    query = "SELECT * FROM events WHERE school_id = ?"
+    params = [user["school_id"]]
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    query += " ORDER BY start_at DESC, id DESC"
+
+    return csv_response(
+        request,
+        Database.astream(query, tuple(params)),
+        ["ID", "Title", "Host", "Location", "Start Date", "End Date", "Category", "Status", "Description"],
+        ["id", "title", "host", "location", "start_at", "end_at", "category", "status", "description"],
+        "events.csv"
     )
+
+def ics_text(value) -> str:
+    return str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def ics_datetime(value: str) -> str:
+    # Stored as ISO 8601 ("2030-01-01T10:00:00" or "2030-01-01 10:00:00"); reshaping the string
+    # is much cheaper than a datetime round trip per row
+    if len(value) >= 19 and value[10] in "T ":
+        return value[:10].replace("-", "") + "T" + value[11:19].replace(":", "")
+    return datetime.fromisoformat(value).strftime("%Y%m%dT%H%M%S")
+
+def ics_line(line: str) -> str:
+    """Fold long content lines as RFC 5545 requires"""
+    if len(line) <= 75:
+        return line + "\r\n"
+    return "\r\n ".join(line[i:i + 74] for i in range(0, len(line), 74)) + "\r\n"
+
+def ics_event(schedule: dict) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{schedule['id']}@arista.school",
+        f"DTSTAMP:{ics_datetime(schedule['updated_at'] or schedule['start_at'])}Z",
+        f"DTSTART:{ics_datetime(schedule['start_at'])}",
+        f"DTEND:{ics_datetime(schedule['end_at'])}",
+        f"SUMMARY:{ics_text(schedule['title'])} - {ics_text(schedule['event_title'])}",
+        f"LOCATION:{ics_text(schedule['venue'])}"
+    ]
+    if schedule["notes"]:
+        lines.append(f"DESCRIPTION:{ics_text(schedule['notes'])}")
+    lines.append("END:VEVENT")
+    return "".join(ics_line(line) for line in lines)
+
+ICS_HEADER = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Arista//Event Schedule//EN\r\nCALSCALE:GREGORIAN\r\n"
+ICS_FOOTER = "END:VCALENDAR\r\n"
+
+async def ics_feed(request: Request, cache_key: str, where: str, params: tuple, filename: str):
+    """Serve a calendar of the schedules matching where, revalidated against the rows it covers"""
+    source = f"FROM schedules s JOIN events e ON s.event_id = e.id WHERE {where}"
     
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow(["ID", "Title", "Host", "Location", "Start Date", "End Date", "Category", "Status", "Description"])
+    # The count and id sum change when a schedule enters or leaves the feed (e.g. a team
+    # change); the timestamps change when one of them is edited
+    validators = await Database.aexecute(
+        f"SELECT COUNT(*) as count, TOTAL(s.id) as id_sum, MAX(s.updated_at) as schedules_at, MAX(e.updated_at) as events_at {source}",
+        params,
+        fetch_one=True
+    )
+    changed_at = max(filter(None, (validators["schedules_at"], validators["events_at"])), default=None)
+    etag = make_etag([cache_key, validators["count"], validators["id_sum"], changed_at])
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    mtime = None
+    if changed_at:
+        mtime = datetime.fromisoformat(changed_at).replace(tzinfo=timezone.utc).timestamp()
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    if not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
     
-    for e in events:
-        writer.writerow([
-            e["id"], e["title"], e["host"], e["location"], e["start_at"], 
-            e["end_at"], e["category"], e["status"], e["description"]
-        ])
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    cached = calendar_cache.get(cache_key)
+    if cached is not None and cached[0] == etag:
+        return Response(content=cached[1], media_type="text/calendar", headers=headers)
     
-    output.seek(0)
+    async def generate():
+        parts = [ICS_HEADER.encode()]
+        size = len(parts[0])
+        yield parts[0]
+        async for rows in Database.astream(f"SELECT s.*, e.title as event_title {source} ORDER BY s.start_at, s.id", params):
+            chunk = "".join(ics_event(row) for row in rows).encode()
+            size += len(chunk)
+            if parts is not None:
+                if size <= CALENDAR_CACHE_MAX_BYTES:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+        footer = ICS_FOOTER.encode()
+        yield footer
+        if parts is not None:
+            calendar_cache.set(cache_key, (etag, b"".join(parts) + footer))
     
-    return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=events.csv"}
-    )
+    return StreamingResponse(generate(), media_type="text/calendar", headers=headers)
 
 @router.get("/api/schedules/{participant_id}/ics")
-async def export_participant_schedule_ics(participant_id: int, user = Depends(require_auth)):
-    schedules = Database.execute_query(
-        """SELECT s.*, e.title as event_title 
-           FROM schedules s 
-           JOIN events e ON s.event_id = e.id 
-           JOIN teams t ON t.event_id = e.id 
-           JOIN team_members tm ON tm.team_id = t.id 
-           WHERE tm.participant_id = ? 
-           ORDER BY s.start_at""",
-        (participant_id,),
-        fetch_all=True
+async def export_participant_schedule_ics(participant_id: int, request: Request, user = Depends(require_auth)):
+    return await ics_feed(
+        request,
+        f"participant:{participant_id}",
+        """e.school_id = ? AND s.event_id IN (
+               SELECT t.event_id FROM teams t JOIN team_members tm ON tm.team_id = t.id WHERE tm.participant_id = ?
+           )""",
+        (user["school_id"], participant_id),
+        "schedule.ics"
     )
+
+@router.get("/api/events/{event_id}/schedules/ics")
+async def export_event_schedule_ics(event_id: int, request: Request, user = Depends(require_auth)):
+    return await ics_feed(
+        request,
+        f"event:{event_id}",
+        "e.school_id = ? AND s.event_id = ?",
+        (user["school_id"], event_id),
+        f"event-{event_id}.ics"
+    )
+
+@router.get("/api/school/schedules/ics")
+async def export_school_schedule_ics(request: Request, user = Depends(require_auth)):
+    return await ics_feed(
+        request,
+        f"school:{user['school_id']}",
+        "e.school_id = ?",
+        (user["school_id"],),
+        "school-schedule.ics"
+    )
+
+def sse_message(message: dict) -> str:
+    return f"id: {message['id']}\nevent: {message['kind']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
+
+@router.get("/api/stream")
+async def stream_updates(request: Request, event_id: Optional[int] = None, user = Depends(require_auth)):
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
     
-    ics_content = "BEGIN:VCALENDAR\nVERSION:2.0\nPRODID:-//Arista//Event Schedule//EN\n"
-    
-    for schedule in schedules:
-        start_dt = datetime.fromisoformat(schedule["start_at"]).strftime("%Y%m%dT%H%M%S")
-        end_dt = datetime.fromisoformat(schedule["end_at"]).strftime("%Y%m%dT%H%M%S")
-        
-        ics_content += f"BEGIN:VEVENT\n"
-        ics_content += f"UID:{schedule['id']}@arista.school\n"
-        ics_content += f"DTSTART:{start_dt}\n"
-        ics_content += f"DTEND:{end_dt}\n"
-        ics_content += f"SUMMARY:{schedule['title']} - {schedule['event_title']}\n"
-        ics_content += f"LOCATION:{schedule['venue']}\n"
-        if schedule["notes"]:
-            ics_content += f"DESCRIPTION:{schedule['notes']}\n"
-        ics_content += f"END:VEVENT\n"
-    
-    ics_content += "END:VCALENDAR\n"
+    async def generate():
+        subscription = event_hub.subscribe(user["school_id"], event_id)
+        try:
+            yield "retry: 3000\n\n"
+            # Subscribe before replaying so nothing published in between is missed
+            seen = 0
+            if last_event_id and last_event_id.isdigit():
+                for message in await event_hub.replay(user["school_id"], event_id, int(last_event_id)):
+                    seen = message["id"]
+                    yield sse_message(message)
+            while not (subscription.overflowed and subscription.queue.empty()):
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message["id"] > seen:
+                    yield sse_message(message)
+        finally:
+            event_hub.unsubscribe(subscription)
     
-    return Response(
-        content=ics_content,
-        media_type="text/calendar",
-        headers={"Content-Disposition": "attachment; filename=schedule.ics"}
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+def audit_time(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected an ISO 8601 date or datetime")
+
 @router.get("/api/audit")
 async def get_audit_log(
     page: int = 1,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
+    user_id: Optional[int] = None,
+    action: Optional[str] = None,
+    target_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
     user = Depends(require_role(["admin"]))
 ):
     offset = (page - 1) * limit
+    if not cursor and offset > AUDIT_MAX_OFFSET:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page only reaches the newest {AUDIT_MAX_OFFSET} records; follow next_cursor to read further"
+        )
     
-    logs = Database.execute_query(
-        """SELECT a.*, u.name as user_name 
-           FROM audit_log a 
-           JOIN users u ON a.user_id = u.id 
-           ORDER BY a.created_at DESC 
-           LIMIT ? OFFSET ?""",
-        (limit, offset),
-        fetch_all=True
+    if include_total is None:
+        include_total = cursor is None
+    
+    # Live rows and archived segments are merged, so both pagination styles span the archive
+    filters = {
+        "user_id": user_id,
+        "action": action,
+        "target_type": target_type,
+        "since": audit_time(since, "since"),
+        "until": audit_time(until, "until")
+    }
+    if cursor:
+        after = decode_cursor(cursor, 2)
+        logs = await Database.call(audit_archive.query, filters, after, limit + 1)
+    else:
+        logs = (await Database.call(audit_archive.query, filters, None, offset + limit + 1))[offset:]
+    next_cursor = next_page_cursor(logs, limit, ("created_at", "id"))
+    
+    total = None
+    if include_total:
+        where, params = audit_archive.live_where(filters)
+        total = await cached_count("audit_log", f"SELECT COUNT(*) as count FROM audit_log a {where}", params)
+        archived_key = ("audit_segments", "archived", tuple(sorted(filters.items())))
+        archived = count_cache.get(archived_key)
+        if archived is None:
+            archived = await Database.call(audit_archive.archived_count, filters)
+            count_cache.set(archived_key, archived)
+        total += archived
+    
+    return {
+        "logs": logs,
+        "total": total,
+        "page": page,
+        "pages": (total + limit - 1) // limit if total is not None else None,
+        "next_cursor": next_cursor
+    }
+
+# Match delimiters for snippet()/highlight(); control characters never occur in indexed
+# text, so the text can be HTML-escaped first and the markers turned into <mark> after
+MARK_OPEN, MARK_CLOSE = "\x02", "\x03"
+SEARCH_COLUMNS = {
+    "events": "e.id, e.title, e.category, e.location, e.start_at, e.end_at, e.status",
+    "participants": "e.id, e.event_id, e.first_name, e.last_name, e.grade, e.section, e.email"
+}
+
+def search_statement(table: str) -> str:
+    fts, weights = SEARCH_INDEXES[table]
+    return f"""SELECT {SEARCH_COLUMNS[table]},
+               highlight({fts}, 0, ?, ?) as headline,
+               snippet({fts}, -1, ?, ?, '…', 12) as snippet,
+               bm25({fts}, {', '.join(str(w) for w in weights.values())}) as score
+               FROM {fts} JOIN {table} e ON e.id = {fts}.rowid
+               WHERE {fts} MATCH ? AND e.school_id = ?
+               ORDER BY score LIMIT ?"""
+
+def marked_html(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    return html.escape(text).replace(MARK_OPEN, "<mark>").replace(MARK_CLOSE, "</mark>")
+
+@router.get("/api/search")
+async def search(q: str, type: Optional[str] = None, limit: int = 10, user = Depends(require_auth)):
+    tables = [type] if type else list(SEARCH_INDEXES)
+    if any(table not in SEARCH_INDEXES for table in tables):
+        raise HTTPException(status_code=400, detail=f"type must be one of: {', '.join(SEARCH_INDEXES)}")
+    if not all(search_available(table) for table in tables):
+        raise HTTPException(status_code=503, detail="Search index is not available")
+    limit = max(1, min(limit, 50))
+    
+    results = {table: [] for table in tables}
+    match = fts_query(q)
+    if match:
+        for table in tables:
+            rows = await Database.aexecute(
+                search_statement(table),
+                (MARK_OPEN, MARK_CLOSE, MARK_OPEN, MARK_CLOSE, match, user["school_id"], limit),
+                fetch_all=True
+            )
+            for row in rows:
+                row["headline"] = marked_html(row["headline"])
+                row["snippet"] = marked_html(row["snippet"])
+                # bm25() is lower-is-better; flip it so clients can sort descending
+                row["score"] = -row["score"]
+            results[table] = rows
+    
+    return {"query": q, **results}
+
+def import_header(name: str) -> str:
+    """"First Name" and "first-name" both become first_name"""
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+async def stage_import(file: UploadFile, path: Path) -> str:
+    """Copy an upload to path within MAX_UPLOAD_SIZE and return the encoding to read it with"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    encoding = "utf-8-sig"
+    size = 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        async with aiofiles.open(path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not size and chunk.startswith(b"PK\x03\x04"):
+                    raise HTTPException(status_code=400, detail="Save the spreadsheet as CSV before importing it")
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB)")
+                if encoding == "utf-8-sig":
+                    try:
+                        decoder.decode(chunk)
+                    except UnicodeDecodeError:
+                        # Excel on Windows writes CSV in the ANSI code page
+                        encoding = "cp1252"
+                await out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return encoding
+
+def open_import(path: Path, encoding: str):
+    handle = open(path, encoding=encoding, errors="replace", newline="")
+    sample = handle.read(8192)
+    handle.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return handle, csv.reader(handle, dialect)
+
+def read_import_chunk(reader, columns: list, size: int) -> tuple:
+    """Up to size records as (line, values by column), skipping blank ones, plus the number consumed"""
+    rows = []
+    consumed = 0
+    for record in itertools.islice(reader, size):
+        consumed += 1
+        if any(value.strip() for value in record):
+            rows.append((reader.line_num, dict(zip(columns, (value.strip() for value in record)))))
+    return rows, consumed
+
+def participant_import_record(values: dict, school_id: int, event_id: Optional[int], event_statuses: dict) -> tuple:
+    missing = [field for field in PARTICIPANT_REQUIRED_FIELDS if not values.get(field)]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}")
+    if values.get("event_id"):
+        try:
+            event_id = int(values["event_id"])
+        except ValueError:
+            raise ValueError("event_id must be a number")
+    if event_id is not None and event_id not in event_statuses:
+        raise ValueError(f"Event {event_id} not found")
+    if event_id is not None and event_statuses[event_id] in registrations.CLOSED_STATUSES:
+        raise ValueError(f"Event {event_id} is {event_statuses[event_id]}")
+    return (
+        school_id, event_id, values["first_name"], values["last_name"], values["grade"], values["section"],
+        values.get("email", ""), values.get("phone", ""), values["guardian_name"], values["guardian_phone"],
+        values.get("medical_notes", "")
+    )
+
+def write_import_chunk(job_id: str, records: list, totals: dict, errors: list):
+    """Insert one chunk and record the job's progress in the same transaction"""
+    with Database.transaction() as conn:
+        # Rows for an event join its waitlist in file order, then take whatever seats are free
+        conn.executemany(
+            """INSERT INTO participants (school_id, event_id, first_name, last_name, grade, section, email,
+               phone, guardian_name, guardian_phone, medical_notes, status, registration_date)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))""",
+            [record + ("registered" if record[1] is None else "waitlisted",) for record in records]
+        )
+        for event_id in {record[1] for record in records if record[1] is not None}:
+            registrations.promote(conn, event_id)
+        conn.execute(
+            """UPDATE import_jobs SET status = 'running', processed_rows = ?, imported_rows = ?, failed_rows = ?,
+               errors_json = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+            (totals["processed"], totals["imported"], totals["failed"], json.dumps(errors), job_id)
+        )
+
+async def run_participant_import(job_id: str, path: Path, encoding: str, user: dict, event_id: Optional[int]):
+    totals = {"processed": 0, "imported": 0, "failed": 0}
+    errors = []
+    status, error = "failed", None
+    handle = None
+    try:
+        events = await Database.aexecute(
+            "SELECT id, status FROM events WHERE school_id = ?", (user["school_id"],), fetch_all=True
+        )
+        event_statuses = {row["id"]: row["status"] for row in events}
+        handle, reader = await anyio.to_thread.run_sync(open_import, path, encoding)
+        columns = [import_header(name) for name in await anyio.to_thread.run_sync(next, reader)]
+        while True:
+            rows, consumed = await anyio.to_thread.run_sync(read_import_chunk, reader, columns, IMPORT_CHUNK_SIZE)
+            records = []
+            for line, values in rows:
+                try:
+                    records.append(participant_import_record(values, user["school_id"], event_id, event_statuses))
+                except ValueError as e:
+                    totals["failed"] += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({"line": line, "error": str(e)})
+            totals["processed"] += len(rows)
+            totals["imported"] += len(records)
+            await Database.call(write_import_chunk, job_id, records, totals, errors)
+            if consumed < IMPORT_CHUNK_SIZE:
+                break
+        status = "completed"
+    except asyncio.CancelledError:
+        error = "Interrupted by server shutdown"
+        raise
+    except Exception as e:
+        error = str(e)
+        print(f"Error importing participants: {e}")
+    finally:
+        if handle is not None:
+            handle.close()
+        path.unlink(missing_ok=True)
+        # Chunks that committed stay imported, whatever happened afterwards
+        await Database.aexecute(
+            """UPDATE import_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP,
+               updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+            (status, error, job_id)
+        )
+        await log_audit(user, "import", "participant", None, {"job_id": job_id, "status": status, **totals})
+
+@router.post("/api/participants/import", status_code=202)
+async def import_participants(
+    file: UploadFile = File(...),
+    event_id: Optional[int] = None,
+    user = Depends(require_role(["admin", "teacher", "student_coordinator"]))
+):
+    if event_id is not None:
+        event = await Database.aexecute(
+            "SELECT status FROM events WHERE id = ? AND school_id = ?", (event_id, user["school_id"]), fetch_one=True
+        )
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        if event["status"] in registrations.CLOSED_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Event is {event['status']}")
+    
+    job_id = secrets.token_urlsafe(12)
+    path = STAGING_DIR / f"import-{job_id}.csv"
+    encoding = await stage_import(file, path)
+    
+    handle, reader = await anyio.to_thread.run_sync(open_import, path, encoding)
+    try:
+        columns = [import_header(name) for name in next(reader, [])]
+    finally:
+        handle.close()
+    missing = [field for field in PARTICIPANT_REQUIRED_FIELDS if field not in columns]
+    if missing:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=f"CSV is missing column(s): {', '.join(missing)}")
+    
+    await Database.aexecute(
+        "INSERT INTO import_jobs (id, school_id, user_id, kind, filename) VALUES (?, ?, ?, 'participants', ?)",
+        (job_id, user["school_id"], user["id"], file.filename)
     )
+    background_jobs.spawn(run_participant_import(job_id, path, encoding, user, event_id))
     
-    total = Database.execute_query(
-        "SELECT COUNT(*) as count FROM audit_log",
+    return {"job_id": job_id, "status": "queued", "status_url": f"/api/participants/imports/{job_id}"}
+
+@router.get("/api/participants/imports/{job_id}")
+async def get_participant_import(job_id: str, user = Depends(require_auth)):
+    job = await Database.aexecute(
+        "SELECT * FROM import_jobs WHERE id = ? AND school_id = ?",
+        (job_id, user["school_id"]),
         fetch_one=True
     )
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
     
+    job["errors"] = json.loads(job.pop("errors_json") or "[]")
+    return job
+
+ROSTER_BATCH_LIMIT = 5000
+TEAM_ROLES = ("leader", "member")
+
+def roster_ops(data: dict) -> list:
+    """Flatten the add/move/remove lists of a roster request into (op, team_id, participant_id, role) rows"""
+    ops = []
+    for op in ("remove", "move", "add"):
+        items = data.get(op) or []
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail=f"{op} must be a list")
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get("participant_id"), int):
+                raise HTTPException(status_code=400, detail=f"Every {op} entry needs an integer participant_id")
+            team_id = item.get("to_team_id" if op == "move" else "team_id")
+            if op != "remove" and not isinstance(team_id, int):
+                raise HTTPException(status_code=400, detail=f"Every {op} entry needs an integer {'to_team_id' if op == 'move' else 'team_id'}")
+            role = item.get("role")
+            if role is not None and role not in TEAM_ROLES:
+                raise HTTPException(status_code=400, detail=f"role must be one of: {', '.join(TEAM_ROLES)}")
+            ops.append((op, team_id, item["participant_id"], role))
+    if not ops:
+        raise HTTPException(status_code=400, detail="Nothing to change")
+    moving = [participant_id for op, _, participant_id, _ in ops if op == "move"]
+    if len(moving) != len(set(moving)):
+        raise HTTPException(status_code=400, detail="A participant can only be moved to one team per request")
+    if len(ops) > ROSTER_BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {ROSTER_BATCH_LIMIT} changes per request")
+    return ops
+
+def roster_snapshot(conn, event_id: int) -> dict:
+    """(team_id, participant_id) -> role for the event's memberships of the participants in temp.roster_ops"""
+    rows = conn.execute(
+        """SELECT tm.team_id, tm.participant_id, tm.role FROM team_members tm
+           JOIN teams t ON t.id = tm.team_id
+           WHERE t.event_id = ? AND tm.participant_id IN (SELECT participant_id FROM temp.roster_ops)""",
+        (event_id,)
+    ).fetchall()
+    return {(row["team_id"], row["participant_id"]): row["role"] for row in rows}
+
+def apply_roster(event_id: int, school_id: int, ops: list) -> dict:
+    """Apply removes, then moves, then adds in one transaction and return what changed"""
+    with Database.transaction() as conn:
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS roster_ops (op TEXT NOT NULL, team_id INTEGER, participant_id INTEGER NOT NULL, role TEXT)"
+        )
+        try:
+            conn.executemany("INSERT INTO temp.roster_ops (op, team_id, participant_id, role) VALUES (?, ?, ?, ?)", ops)
+            
+            unknown_teams = [row[0] for row in conn.execute(
+                """SELECT DISTINCT team_id FROM temp.roster_ops
+                   WHERE team_id IS NOT NULL AND team_id NOT IN (SELECT id FROM teams WHERE event_id = ?)""",
+                (event_id,)
+            )]
+            unknown_participants = [row[0] for row in conn.execute(
+                """SELECT DISTINCT participant_id FROM temp.roster_ops
+                   WHERE participant_id NOT IN (SELECT id FROM participants WHERE school_id = ?)""",
+                (school_id,)
+            )]
+            if unknown_teams or unknown_participants:
+                raise HTTPException(status_code=400, detail={
+                    "message": "Unknown teams or participants for this event",
+                    "team_ids": sorted(unknown_teams),
+                    "participant_ids": sorted(unknown_participants)
+                })
+            
+            before = roster_snapshot(conn, event_id)
+            # A remove without team_id leaves every team of the event; a move leaves all but its target
+            conn.execute(
+                """DELETE FROM team_members
+                   WHERE team_id IN (SELECT id FROM teams WHERE event_id = ?)
+                   AND EXISTS (
+                       SELECT 1 FROM temp.roster_ops o
+                       WHERE o.participant_id = team_members.participant_id
+                       AND ((o.op = 'remove' AND (o.team_id IS NULL OR o.team_id = team_members.team_id))
+                            OR (o.op = 'move' AND o.team_id != team_members.team_id))
+                   )""",
+                (event_id,)
+            )
+            conn.execute(
+                """INSERT INTO team_members (team_id, participant_id, role)
+                   SELECT team_id, participant_id, COALESCE(role, 'member') FROM temp.roster_ops
+                   WHERE op IN ('move', 'add')
+                   ON CONFLICT (team_id, participant_id) DO NOTHING"""
+            )
+            # Existing members only change role when the request names one
+            conn.execute(
+                """UPDATE team_members SET role = o.role FROM temp.roster_ops o
+                   WHERE o.op IN ('move', 'add') AND o.role IS NOT NULL
+                   AND team_members.team_id = o.team_id AND team_members.participant_id = o.participant_id
+                   AND team_members.role != o.role"""
+            )
+            after = roster_snapshot(conn, event_id)
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.roster_ops")
+    
+    removed = {key: role for key, role in before.items() if key not in after}
+    added = {key: role for key, role in after.items() if key not in before}
+    moved = []
+    for (team_id, participant_id), role in list(added.items()):
+        source = next((key for key in removed if key[1] == participant_id), None)
+        if source is not None:
+            moved.append({"participant_id": participant_id, "from_team_id": source[0], "to_team_id": team_id, "role": role})
+            del removed[source]
+            del added[(team_id, participant_id)]
     return {
-        "logs": [dict(log) for log in logs],
-        "total": total["count"],
-        "page": page,
-        "pages": (total["count"] + limit - 1) // limit
+        "added": [{"team_id": t, "participant_id": p, "role": role} for (t, p), role in added.items()],
+        "moved": moved,
+        "removed": [{"team_id": t, "participant_id": p, "role": role} for (t, p), role in removed.items()],
+        "role_changed": [
+            {"team_id": t, "participant_id": p, "from": before[(t, p)], "to": role}
+            for (t, p), role in after.items() if (t, p) in before and before[(t, p)] != role
+        ]
+    }
+
+@router.post("/api/events/{event_id}/roster")
+async def update_event_roster(event_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
+    data = await request.json()
+    ops = roster_ops(data)
+    
+    event = await Database.aexecute(
+        "SELECT id FROM events WHERE id = ? AND school_id = ?", (event_id, user["school_id"]), fetch_one=True
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    diff = await Database.call(apply_roster, event_id, user["school_id"], ops)
+    counts = {key: len(changes) for key, changes in diff.items()}
+    if any(counts.values()):
+        await log_audit(user, "update_roster", "team", None, {"event_id": event_id, **counts})
+    
+    return {**diff, "requested": len(ops), "changed": sum(counts.values())}
+
+TEAM_BALANCE_KEYS = ("grade", "section")
+
+async def team_plan_pool(event_id: int, user: dict, replace: bool) -> list:
+    """Registered participants of the event who may be placed; with replace=False, only those on no team yet"""
+    event = await Database.aexecute(
+        "SELECT id FROM events WHERE id = ? AND school_id = ?", (event_id, user["school_id"]), fetch_one=True
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    unassigned = "" if replace else """AND p.id NOT IN (
+        SELECT tm.participant_id FROM team_members tm JOIN teams t ON t.id = tm.team_id WHERE t.event_id = ?
+    )"""
+    return await Database.aexecute(
+        f"""SELECT p.id, p.grade, p.section FROM participants p
+            WHERE p.event_id = ? AND p.school_id = ? AND p.status = 'registered' {unassigned}
+            ORDER BY p.id""",
+        (event_id, user["school_id"]) + (() if replace else (event_id,)),
+        fetch_all=True
+    )
+
+@router.post("/api/events/{event_id}/teams/generate")
+async def generate_teams(event_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
+    """Preview a balanced split of the event's participants; nothing is written"""
+    data = await request.json()
+    
+    balance_by = data.get("balance_by", list(TEAM_BALANCE_KEYS))
+    if not isinstance(balance_by, list) or any(key not in TEAM_BALANCE_KEYS for key in balance_by):
+        raise HTTPException(status_code=400, detail=f"balance_by may contain: {', '.join(TEAM_BALANCE_KEYS)}")
+    for key in ("team_count", "team_size", "seed"):
+        if data.get(key) is not None and not isinstance(data[key], int):
+            raise HTTPException(status_code=400, detail=f"{key} must be an integer")
+    for key in ("keep_together", "keep_apart"):
+        groups = data.get(key) or []
+        if not isinstance(groups, list) or not all(isinstance(group, list) for group in groups):
+            raise HTTPException(status_code=400, detail=f"{key} must be a list of participant id lists")
+    
+    participants = await team_plan_pool(event_id, user, bool(data.get("replace")))
+    seed = data["seed"] if data.get("seed") is not None else secrets.randbelow(2 ** 31)
+    try:
+        plan = await anyio.to_thread.run_sync(functools.partial(
+            plan_teams, participants,
+            team_count=data.get("team_count"), team_size=data.get("team_size"), balance_by=balance_by,
+            keep_together=data.get("keep_together"), keep_apart=data.get("keep_apart"),
+            seed=seed, time_budget=TEAM_PLAN_TIME_BUDGET
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    prefix = data.get("name_prefix") or "Team"
+    for number, team in enumerate(plan["teams"], 1):
+        team["name"] = f"{prefix} {number}"
+    # Committing this body as-is creates exactly the previewed teams
+    return {**plan, "seed": seed, "replace": bool(data.get("replace")), "participants": len(participants)}
+
+def commit_team_plan(event_id: int, school_id: int, user_id: int, teams: list, replace: bool, team_size: Optional[int]) -> list:
+    with Database.transaction() as conn:
+        requested = [pid for team in teams for pid in team["participant_ids"]]
+        if len(requested) != len(set(requested)):
+            raise HTTPException(status_code=400, detail="A participant appears in more than one team")
+        eligible = {row[0] for row in conn.execute(
+            "SELECT id FROM participants WHERE event_id = ? AND school_id = ? AND status = 'registered'",
+            (event_id, school_id)
+        )}
+        unknown = sorted(set(requested) - eligible)
+        if unknown:
+            raise HTTPException(status_code=400, detail={
+                "message": f"{len(unknown)} participant(s) are not registered for this event", "participant_ids": unknown[:100]
+            })
+        
+        if replace:
+            conn.execute("DELETE FROM team_members WHERE team_id IN (SELECT id FROM teams WHERE event_id = ?)", (event_id,))
+            conn.execute("UPDATE schedules SET team_id = NULL WHERE team_id IN (SELECT id FROM teams WHERE event_id = ?)", (event_id,))
+            conn.execute("DELETE FROM teams WHERE event_id = ?", (event_id,))
+        else:
+            placed = sorted(set(requested) & {row[0] for row in conn.execute(
+                "SELECT tm.participant_id FROM team_members tm JOIN teams t ON t.id = tm.team_id WHERE t.event_id = ?",
+                (event_id,)
+            )})
+            if placed:
+                raise HTTPException(status_code=409, detail={
+                    "message": f"{len(placed)} participant(s) are already on a team; pass replace to regenerate",
+                    "participant_ids": placed[:100]
+                })
+        
+        team_ids = []
+        for team in teams:
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO teams (event_id, name, max_size, created_by) VALUES (?, ?, ?, ?)",
+                    (event_id, team["name"], team_size or len(team["participant_ids"]), user_id)
+                )
+            except sqlite3.IntegrityError:
+                raise HTTPException(status_code=409, detail=f"Team name already exists: {team['name']}")
+            team_ids.append(cursor.lastrowid)
+        conn.executemany(
+            "INSERT INTO team_members (team_id, participant_id, role) VALUES (?, ?, 'member')",
+            [(team_id, pid) for team_id, team in zip(team_ids, teams) for pid in team["participant_ids"]]
+        )
+        return team_ids
+
+@router.post("/api/events/{event_id}/teams/generate/commit")
+async def commit_generated_teams(event_id: int, request: Request, user = Depends(require_role(["admin", "teacher"]))):
+    """Create the teams of a (possibly edited) preview and their members in one transaction.
+
+    team_size, as sent to the preview, becomes each team's max_size; without it a team's
+    max_size is its member count.
+    """
+    data = await request.json()
+    
+    teams = data.get("teams")
+    if not isinstance(teams, list) or not teams:
+        raise HTTPException(status_code=400, detail="teams is required")
+    for team in teams:
+        if not isinstance(team, dict) or not team.get("name") or not isinstance(team.get("participant_ids"), list) \
+                or not all(isinstance(pid, int) for pid in team["participant_ids"]):
+            raise HTTPException(status_code=400, detail="Every team needs a name and a participant_ids list")
+    team_size = data.get("team_size")
+    if team_size is not None:
+        if not isinstance(team_size, int) or team_size < 1:
+            raise HTTPException(status_code=400, detail="team_size must be a positive number")
+        if any(len(team["participant_ids"]) > team_size for team in teams):
+            raise HTTPException(status_code=400, detail=f"A team has more than team_size ({team_size}) members")
+    
+    event = await Database.aexecute(
+        "SELECT id FROM events WHERE id = ? AND school_id = ?", (event_id, user["school_id"]), fetch_one=True
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    replace = bool(data.get("replace"))
+    team_ids = await Database.call(
+        commit_team_plan, event_id, user["school_id"], user["id"], teams, replace, team_size
+    )
+    members = sum(len(team["participant_ids"]) for team in teams)
+    await log_audit(user, "generate", "team", None, {
+        "event_id": event_id, "teams": len(team_ids), "members": members, "replace": replace
+    })
+    
+    return {"team_ids": team_ids, "teams": len(team_ids), "members": members, "message": "Teams created"}
+
+STAFF_ROLES = ("admin", "teacher", "student_coordinator")
+
+def idempotency_key(request: Request) -> Optional[str]:
+    key = request.headers.get("Idempotency-Key")
+    if key is not None and not 0 < len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+    return key
+
+def request_fingerprint(request: Request, data: dict) -> str:
+    """What a retry must repeat for its Idempotency-Key to be honoured"""
+    return hashlib.sha256(f"{request.method} {request.url.path} {json.dumps(data, sort_keys=True)}".encode()).hexdigest()
+
+async def optional_json(request: Request) -> dict:
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    return data
+
+def registrant(data: dict, user: dict) -> dict:
+    """The participant a registration is for: the student themself, or whoever staff name in the body"""
+    if user["role"] not in STAFF_ROLES:
+        first_name, _, last_name = (user.get("name") or "").partition(" ")
+        return {
+            "user_id": user["id"], "first_name": first_name, "last_name": last_name,
+            **{field: user.get(field) or "" for field in (
+                "grade", "section", "email", "guardian_name", "guardian_phone", "medical_notes"
+            )}
+        }
+    if data.get("participant_id") is not None:
+        if not isinstance(data["participant_id"], int):
+            raise HTTPException(status_code=400, detail="participant_id must be a number")
+        return {"id": data["participant_id"]}
+    for field in PARTICIPANT_REQUIRED_FIELDS:
+        if not data.get(field):
+            raise HTTPException(status_code=400, detail=f"participant_id or {field} is required")
+    participant = {field: data[field] for field in PARTICIPANT_REQUIRED_FIELDS}
+    participant.update({field: data.get(field, "") for field in ("email", "phone", "medical_notes")})
+    return participant
+
+@router.post("/api/events/{event_id}/registrations")
+async def register_for_event(event_id: int, request: Request, response: Response, user = Depends(require_auth)):
+    """Take a seat on the event, or a waitlist place once it is full ("waitlist": false refuses instead).
+
+    Send an Idempotency-Key header to make retries safe: a repeat returns the first response.
+    """
+    data = await optional_json(request)
+    key = idempotency_key(request)
+    
+    result, replayed = await Database.call(
+        registrations.run, user["id"], key, request_fingerprint(request, data),
+        registrations.register, event_id, user["school_id"], registrant(data, user), data.get("waitlist", True) is not False
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    elif result["created"]:
+        await log_audit(user, "register", "participant", result["participant_id"], {
+            "event_id": event_id, "status": result["status"]
+        })
+    
+    return {**result, "message": "Registered" if result["status"] == "registered" else "Added to the waitlist"}
+
+@router.post("/api/participants/{participant_id}/cancel")
+async def cancel_registration(participant_id: int, request: Request, response: Response, user = Depends(require_auth)):
+    """Cancel a registration; the freed seat goes to the longest-waiting participant in the same transaction"""
+    key = idempotency_key(request)
+    owner_id = None if user["role"] in STAFF_ROLES else user["id"]
+    
+    result, replayed = await Database.call(
+        registrations.run, user["id"], key, request_fingerprint(request, {}),
+        registrations.cancel, participant_id, user["school_id"], owner_id
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    elif result["was"] != "cancelled":
+        await log_audit(user, "cancel", "participant", participant_id, {
+            "event_id": result["event_id"], "promoted": result["promoted"]
+        })
+    
+    return {**result, "message": "Registration cancelled"}
+
+@router.get("/api/events/{event_id}/registrations")
+async def get_event_registrations(event_id: int, limit: int = 100, user = Depends(require_role(list(STAFF_ROLES)))):
+    event = await Database.aexecute(
+        "SELECT id, max_participants FROM events WHERE id = ? AND school_id = ?",
+        (event_id, user["school_id"]), fetch_one=True
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    counts = await Database.aexecute(
+        "SELECT status, COUNT(*) as count FROM participants WHERE event_id = ? GROUP BY status",
+        (event_id,), fetch_all=True
+    )
+    counts = {row["status"]: row["count"] for row in counts}
+    waitlist = await Database.aexecute(
+        """SELECT id, first_name, last_name, registration_date FROM participants
+           WHERE event_id = ? AND status = 'waitlisted' ORDER BY registration_date, id LIMIT ?""",
+        (event_id, min(max(limit, 0), 1000)), fetch_all=True
+    )
+    capacity = event["max_participants"]
+    registered = counts.get("registered", 0)
+    
+    return {
+        "max_participants": capacity,
+        "registered": registered,
+        "waitlisted": counts.get("waitlisted", 0),
+        "cancelled": counts.get("cancelled", 0),
+        "available": None if capacity is None else max(capacity - registered, 0),
+        "waitlist": [{**dict(row), "position": n} for n, row in enumerate(waitlist, 1)]
     }
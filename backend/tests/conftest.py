@@ -0,0 +1,40 @@
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Point the app at a scratch database before main is imported
+SCRATCH = tempfile.mkdtemp(prefix="arista-tests-")
+os.environ["ARISTA_DB_PATH"] = os.path.join(SCRATCH, "arista.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+from main import Database, create_access_token
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    Database.initialize()
+    yield
+    Database.shutdown_executor()
+    Database.close_pool()
+    shutil.rmtree(SCRATCH, ignore_errors=True)
+
+@pytest.fixture
+def admin():
+    """A school with one admin, as the user dict plus the headers to act as them"""
+    with Database.transaction() as conn:
+        school_id = conn.execute(
+            "INSERT INTO schools (name, code, admin_email) VALUES ('Test school', ?, 'admin@example.invalid')",
+            (f"TEST-{secrets.token_hex(4)}",)
+        ).lastrowid
+        user_id = conn.execute(
+            "INSERT INTO users (school_id, name, email, password_hash, role) VALUES (?, 'Admin', 'admin@example.invalid', '-', 'admin')",
+            (school_id,)
+        ).lastrowid
+    yield {"id": user_id, "school_id": school_id, "headers": {"Authorization": f"Bearer {create_access_token({'sub': user_id})}"}}
+    with Database.transaction() as conn:
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        conn.execute("DELETE FROM schools WHERE id = ?", (school_id,))
@@ -0,0 +1,14 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import app
+
+@pytest.mark.parametrize("path", ["/api/admin/metrics", "/api/admin/storage"])
+def test_server_wide_figures_need_an_operator(admin, monkeypatch, path):
+    client = TestClient(app)
+    monkeypatch.setattr(main, "OPERATOR_USER_IDS", set())
+    assert client.get(path, headers=admin["headers"]).status_code == 403
+
+    monkeypatch.setattr(main, "OPERATOR_USER_IDS", {admin["id"]})
+    assert client.get(path, headers=admin["headers"]).status_code == 200
@@ -0,0 +1,12 @@
+import pytest
+
+import manage
+
+@pytest.mark.parametrize("name, query, params", manage.HOT_QUERIES, ids=[name for name, _, _ in manage.HOT_QUERIES])
+def test_hot_query_uses_an_index(name, query, params):
+    [(_, plan, scans)] = manage.explain([(name, query, params)])
+    assert not scans, f"{name} reads a whole table: {plan}"
+
+def test_explain_flags_a_full_scan():
+    [(_, _, scans)] = manage.explain([("unindexed", "SELECT * FROM participants WHERE guardian_phone = ?", ("1",))])
+    assert scans == ["SCAN participants"]
@@ -0,0 +1,29 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import manage
+from main import Database, app
+
+@pytest.fixture
+def runaway_events(monkeypatch):
+    """Swap every statement on the events table for one that only ends when its timeout aborts it"""
+    execute_query = Database.execute_query
+
+    def runaway(query, params=(), fetch_one=False, fetch_all=False, timeout=None):
+        if " events" in query and "events_fts" not in query:
+            return execute_query(manage.RUNAWAY_QUERY, (), fetch_all=True, timeout=0.05)
+        return execute_query(query, params, fetch_one=fetch_one, fetch_all=fetch_all, timeout=timeout)
+
+    monkeypatch.setattr(Database, "execute_query", staticmethod(runaway))
+
+def test_list_route_maps_query_timeout_to_504(runaway_events):
+    response = TestClient(app).get("/api/events")
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Database query timed out"}
+
+def test_write_route_maps_query_timeout_to_504(admin, runaway_events):
+    response = TestClient(app).post("/api/events", headers=admin["headers"], json={
+        "title": "Timeout", "host": "-", "location": "-", "category": "other",
+        "start_at": "2030-01-01T09:00:00", "end_at": "2030-01-01T10:00:00"
+    })
+    assert response.status_code == 504
@@ -85,6 +85,16 @@ class ApiClient {
         return this.get('/me');
     }
 
+    subscribe(handlers, eventId = null) {
+        if (typeof EventSource === 'undefined') return null;
+        const query = eventId ? `?event_id=${encodeURIComponent(eventId)}` : '';
+        const source = new EventSource(`${this.baseUrl}/stream${query}`, { withCredentials: true });
+        Object.entries(handlers).forEach(([kind, handler]) => {
+            source.addEventListener(kind, (e) => handler(JSON.parse(e.data)));
+        });
+        return source;
+    }
+
     setAuthToken(token) {
         console.log('setAuthToken is no longer needed - using HTTP-only cookies');
     }
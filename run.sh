@@ -10,13 +10,18 @@ echo " ╚═╝  ╚═╝ ╚═╝  ╚═╝ ╚═╝ ╚══════
 if [ ! -f "arista.db" ]; then
     touch arista.db
 fi
-cd backend && uvicorn main:app --reload
-
 if [ "$1" = "prod" ]; then
     cd backend
+    # Apply migrations once up front so the workers start without running DDL
+    python manage.py migrate || exit 1
+    # Also worth running from cron; moves audit months past ARISTA_AUDIT_RETENTION_DAYS into archive segments
+    python manage.py archive-audit
+    export ARISTA_AUTO_MIGRATE=0
     if command -v gunicorn >/dev/null 2>&1; then
         gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:8000
     else
         uvicorn main:app --host 0.0.0.0 --port 8000
     fi
-fi
\ No newline at end of file
+else
+    cd backend && uvicorn main:app --reload
+fi